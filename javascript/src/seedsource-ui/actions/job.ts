@@ -43,8 +43,18 @@ export const runJob = (configuration: any) => {
   const { functions, constraints: constraintsConfig } = config
 
   return (dispatch: (action: any) => any) => {
-    const { variables, traits, objective, climate, region, constraints, userSites, customMode, customFunctions } =
-      configuration
+    const {
+      variables,
+      traits,
+      objective,
+      climate,
+      region,
+      constraints,
+      userSites,
+      customMode,
+      customFunctions,
+      species,
+    } = configuration
 
     /* Run the tool against the seedlot climate when looking for seedlots, otherwise run against the
      * planting site climate.
@@ -91,6 +101,7 @@ export const runJob = (configuration: any) => {
         const { constraint, serialize } = constraintsConfig.objects[name]
         return { name: constraint, args: serialize(configuration, values) }
       }),
+      species,
     } as {
       region: string
       year: string
@@ -98,6 +109,7 @@ export const runJob = (configuration: any) => {
       functions: any
       constraints: any
       points?: any
+      species?: string
     }
 
     if (userSites.length) {
@@ -59,6 +59,7 @@ export const createReport = (name: string) => {
       zoom,
       center,
       opacity,
+      service_id: job.serviceId,
     }
 
     const speciesConfig = species.find(item => item.name === data.configuration.species)
@@ -0,0 +1,55 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ncdjango.models import Service
+
+from seedsource_core.django.seedsource.tasks.scoring import BlockIndex, VariableSource
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the per-block min/max index used to skip blocks of climate services that can't be scored. Indexes "
+        "are stored next to each service's NetCDF file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("regions", nargs="*", type=str)
+        parser.add_argument(
+            "--block-size",
+            dest="block_size",
+            type=int,
+            default=256,
+            help="Block size, in cells (default: 256)",
+        )
+        parser.add_argument(
+            "--force",
+            dest="force",
+            action="store_true",
+            default=False,
+            help="Rebuild indexes which are already current",
+        )
+
+    def handle(self, regions, block_size, force=False, *args, **options):
+        services = Service.objects.filter(name__contains="SY_").order_by("name")
+
+        for service in services:
+            if regions and not any(service.name.startswith(f"{r}_") for r in regions):
+                continue
+
+            variable = service.variable_set.first()
+            path = os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+
+            if not force and BlockIndex.load(path) is not None:
+                print(f"Skipping {service.name}, index is current")
+                continue
+
+            print(f"Indexing {service.name}...")
+
+            source = VariableSource(
+                path, variable.variable, variable.x_dimension, variable.y_dimension
+            )
+            try:
+                BlockIndex.build(source, block_size).save(path)
+            finally:
+                source.close()
@@ -0,0 +1,62 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ncdjango.models import Service
+
+from seedsource_core.django.seedsource.models import Region
+from seedsource_core.django.seedsource.tasks.constraints import (
+    AlignedMask,
+    RasterConstraint,
+)
+from seedsource_core.django.seedsource.tasks.generate_scores import GenerateScores
+
+
+class Command(BaseCommand):
+    help = (
+        "Warps raster constraint services (e.g., species ranges) onto each region grid, and stores them as bit-packed "
+        "masks so that jobs don't need to warp them. Masks are stored next to each service's NetCDF file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("regions", nargs="*", type=str)
+        parser.add_argument(
+            "--service",
+            dest="services",
+            action="append",
+            default=[],
+            help="Service to build masks for (default: all services ending in _pa)",
+        )
+        parser.add_argument(
+            "--force",
+            dest="force",
+            action="store_true",
+            default=False,
+            help="Rebuild masks which are already current",
+        )
+
+    def handle(self, regions, services, force=False, *args, **options):
+        if not regions:
+            regions = list(
+                Region.objects.order_by("name").values_list("name", flat=True)
+            )
+
+        if services:
+            services = Service.objects.filter(name__in=services).order_by("name")
+        else:
+            services = Service.objects.filter(name__endswith="_pa").order_by("name")
+
+        for region in regions:
+            grid = GenerateScores().get_region_grid(region)
+
+            for service in services:
+                path = os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+
+                if not force and AlignedMask.load(path, region, grid) is not None:
+                    print(f"Skipping {service.name} for {region}, mask is current")
+                    continue
+
+                print(f"Aligning {service.name} to {region}...")
+
+                mask = RasterConstraint(grid, region).warp_mask(path)
+                AlignedMask.build(mask).save(path, region, grid)
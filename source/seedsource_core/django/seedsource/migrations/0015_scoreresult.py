@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ncdjango", "0003_auto_20151230_0954"),
+        ("seedsource", "0014_merge_20251008_1033"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScoreResult",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hash", models.CharField(max_length=64, unique=True)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="ncdjango.processingjob",
+                    ),
+                ),
+            ],
+        ),
+    ]
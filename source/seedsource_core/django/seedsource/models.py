@@ -63,3 +63,14 @@ class ShareURL(models.Model):
     version = models.IntegerField()
     created = models.DateTimeField(auto_now_add=True)
     accessed = models.DateTimeField(null=True)
+
+
+class ScoreResult(models.Model):
+    """
+    Maps a hash of `generate_scores` inputs to the job which published the result, so that identical jobs can reuse
+    the result service rather than recomputing it.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    job = models.ForeignKey("ncdjango.ProcessingJob", on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
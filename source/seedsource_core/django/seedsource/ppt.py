@@ -280,6 +280,42 @@ class PPTCreator(object):
                 table.cell(i, 1).text = constraint["value"]
                 table.cell(i, 2).text = constraint["range"]
 
+    def create_area_summary_slide(self, area_summary):
+        slide = self.add_slide()
+        self.add_title_text(
+            slide, "{} ({})".format(_("Area by match"), area_summary["units"])
+        )
+
+        rows = area_summary["rows"]
+        classes = area_summary["classes"]
+        num_rows = len(rows) + 1
+        num_cols = len(classes) + 2
+        table = slide.shapes.add_table(
+            num_rows,
+            num_cols,
+            Inches(0.47),
+            Inches(0.73),
+            Inches(9.05),
+            Inches(0.4) * num_rows,
+        ).table
+
+        cols = table.columns
+        cols[0].width = Inches(2.75)
+        for i in range(1, num_cols):
+            cols[i].width = Inches(6.3 / (num_cols - 1))
+
+        # Headers
+        table.cell(0, 0).text = _("Seed zone")
+        for i, label in enumerate(classes, start=1):
+            table.cell(0, i).text = label
+        table.cell(0, num_cols - 1).text = _("Total")
+
+        for i, row in enumerate(rows, start=1):
+            table.cell(i, 0).text = row["label"]
+            for j, area in enumerate(row["areas"], start=1):
+                table.cell(i, j).text = area
+            table.cell(i, num_cols - 1).text = row["total"]
+
     def add_presenter_notes(self, slide, context):
         text_frame = slide.notes_slide.notes_text_frame
 
@@ -524,6 +560,9 @@ class PPTCreator(object):
         if context["constraints"]:
             self.create_constraints_slide(context["constraints"])
 
+        if context.get("area_summary"):
+            self.create_area_summary_slide(context["area_summary"])
+
         self.add_presenter_notes(self.presentation.slides[0], context)
 
         return self.presentation
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import math
 import sys
 from asyncio import ensure_future
@@ -20,6 +21,7 @@ from django.utils.translation import gettext as _
 from geopy.distance import vincenty
 from io import BytesIO
 from ncdjango.geoimage import world_to_image, image_to_world
+from ncdjango.models import ProcessingResultService
 from pyproj import Proj, transform
 from weasyprint import HTML
 
@@ -43,19 +45,31 @@ YEAR_LABELS = {
     "1991_2020": "1991-2020",
 }
 
+ACRES_PER_HECTARE = 2.47105
+
 RESULTS_RENDERER = StretchedRenderer(
     [(0, Color(240, 59, 32)), (50, Color(254, 178, 76)), (100, Color(255, 237, 160))]
 )
 
 
 class Report(object):
-    def __init__(self, configuration, zoom, center, tile_layers, opacity, request=None):
+    def __init__(
+        self,
+        configuration,
+        zoom,
+        center,
+        tile_layers,
+        opacity,
+        request=None,
+        service_id=None,
+    ):
         self.configuration = configuration
         self.zoom = zoom
         self.center = center
         self.tile_layers = tile_layers
         self.opacity = opacity
         self.request = request
+        self.service_id = service_id
 
     def get_year(self, climate):
         return (
@@ -181,6 +195,45 @@ class Report(object):
 
         return constraints
 
+    def get_context_area_summary(self):
+        """Returns the area in each score class from the outputs of the job which created the result service"""
+
+        if not self.service_id:
+            return None
+
+        result = (
+            ProcessingResultService.objects.filter(service__name=self.service_id)
+            .select_related("job")
+            .first()
+        )
+        if result is None:
+            return None
+
+        summary = json.loads(result.job.outputs or "{}").get("area_summary")
+        if not summary:
+            return None
+
+        is_imperial = self.configuration["unit"] == "imperial"
+
+        def format_area(area):
+            return "{:,.0f}".format(area * ACRES_PER_HECTARE if is_imperial else area)
+
+        def format_row(label, row):
+            return {
+                "label": label,
+                "areas": [format_area(c["area"]) for c in row["classes"]],
+                "total": format_area(row["total"]),
+            }
+
+        zones = sorted(summary["zones"], key=lambda z: z["total"], reverse=True)
+
+        return {
+            "units": _("acres") if is_imperial else _("hectares"),
+            "classes": ["{}-{}".format(c["min"], c["max"]) for c in summary["classes"]],
+            "rows": [format_row(_("All"), summary)]
+            + [format_row(zone["name"], zone) for zone in zones],
+        }
+
     def get_context(self, img_as_bytes=False):
         point = self.configuration["point"]
         elevation = get_elevation_at_point(Point(point["x"], point["y"])) / 0.3048
@@ -314,6 +367,7 @@ class Report(object):
                 for cf in self.configuration["customFunctions"]
             ],
             "constraints": self.get_context_constraints(),
+            "area_summary": self.get_context_area_summary(),
             "title": SEEDSOURCE_TITLE,
         }
 
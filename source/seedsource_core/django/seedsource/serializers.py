@@ -127,6 +127,7 @@ class GenerateReportSerializer(serializers.Serializer):
     zoom = serializers.IntegerField()
     center = serializers.ListField(child=serializers.FloatField())
     opacity = serializers.FloatField()
+    service_id = serializers.CharField(required=False, allow_null=True)
 
 
 class RegionSerializer(serializers.ModelSerializer):
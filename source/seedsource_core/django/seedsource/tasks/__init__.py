@@ -0,0 +1,2 @@
+# Celery's autodiscovery imports only this module, so modules defining tasks are imported here
+from . import result_cache  # noqa: F401
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy
+
+
+class ArrayCache(object):
+    """
+    Stores arrays on disk by key, up to a total size. The least recently used arrays are removed first whenever an
+    array is stored and the cache is over its size. Only the directory and size are held, so the cache can be shared by several processes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get_path(self, key):
+        digest = hashlib.sha256(
+            json.dumps(key, sort_keys=True, separators=(",", ":")).encode()
+        ).hexdigest()
+        return os.path.join(self.directory, f"{digest}.npy")
+
+    def get(self, key):
+        """Returns the array stored for `key`, or None"""
+
+        path = self.get_path(key)
+
+        try:
+            arr = numpy.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return arr
+
+    def set(self, key, arr):
+        """Stores `arr` for `key`, then removes the least recently used arrays if the cache is over its size"""
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to a temporary file first, so that other processes never read a partial array
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                numpy.save(f, arr)
+            os.replace(tmp_path, self.get_path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used arrays until the cache is within its size"""
+
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".npy")]
+        except OSError:
+            return
+
+        stats = []
+        for entry in entries:
+            try:
+                stats.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in stats)
+
+        for _, size, path in sorted(stats):
+            if total <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            total -= size
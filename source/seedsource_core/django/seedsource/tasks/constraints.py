@@ -1,29 +1,60 @@
 import datetime
+import hashlib
 import math
 import os
-from functools import partial
+import tempfile
+from functools import lru_cache
 
 import numpy
-import pyproj
 import rasterio
+import shapely
 from django.conf import settings
 from ncdjango.models import Service
 from netCDF4 import Dataset
+from pyproj import Transformer
 from rasterio.crs import CRS
 from rasterio.enums import Resampling
 from rasterio.features import rasterize
 from rasterio.vrt import WarpedVRT
-from shapely.geometry import Point
-from shapely.ops import transform
+from shapely.geometry import shape
 from trefoil.netcdf.variable import SpatialCoordinateVariables
+from trefoil.utilities.window import Window
+
+from .cache import ArrayCache
+from .scoring import VariableSource, read_cells
+from .utils import Grid, intersect_windows, offset_window
+
+# Semi-major axis (meters) and first eccentricity squared of the WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+# Constraint masks are cached by constraint, arguments, source data and grid window, so that jobs from any worker
+# with the same constraints in a region reuse them. Masks are stored bit-packed, and the least recently used masks are
+# removed once the cache is over its size. Set the directory to None to disable.
+CONSTRAINT_CACHE_DIR = getattr(
+    settings,
+    "SEEDSOURCE_CONSTRAINT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "seedsource_constraints"),
+)
+CONSTRAINT_CACHE_SIZE = getattr(
+    settings, "SEEDSOURCE_CONSTRAINT_CACHE_SIZE", 256 * 1024**2
+)  # 256 MB
+CONSTRAINT_CACHE_VERSION = 2
 
 
 class Constraint(object):
+    # Rectangular constraints are described entirely by their window, and don't need a mask
+    is_rectangular = False
+
     def __init__(self, data, region):
+        """
+        :param data: The raster or `Grid` to evaluate the constraint against. Only its extent, shape and orientation
+            are used.
+        :param region: The region name, used to look up supporting services (e.g., the DEM).
+        """
+
         self.data = data
         self.region = region
-        self.mask = None
-        self.slice = None
 
     @staticmethod
     def by_name(constraint):
@@ -37,32 +68,232 @@ class Constraint(object):
             "raster": RasterConstraint,
         }[constraint]
 
-    def apply_constraint(self, **kwargs):
-        if self.mask is None:
-            self.mask = self.get_mask(**kwargs)
+    @staticmethod
+    def get_service_mtime(name):
+        """Returns the modification time of a service's dataset, used to invalidate cached masks"""
 
-            crop = numpy.argwhere(self.mask == False)
+        service = Service.objects.get(name=name)
+        return os.path.getmtime(
+            os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+        )
 
-            if crop.any():
-                (y_start, x_start), (y_stop, x_stop) = crop.min(0), crop.max(0) + 1
+    def get_region_grid(self):
+        """Returns the grid of the region, which `data` is a window of"""
 
-                self.slice = (slice(x_start, x_stop), slice(y_start, y_stop))
-                self.mask = self.mask[self.slice[1], self.slice[0]]
+        service = Service.objects.get(name="{}_dem".format(self.region))
+        v = service.variable_set.first()
 
-        mask = (
-            self.data.mask[self.slice[1], self.slice[0]]
-            if self.slice
-            else self.data.mask
-        )
-        data = self.data[self.slice[1], self.slice[0]] if self.slice else self.data
+        with Dataset(
+            os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+        ) as ds:
+            shape = (ds.variables[v.y_dimension].size, ds.variables[v.x_dimension].size)
+
+        return Grid(v.full_extent, shape, self.data.y_increasing)
+
+    def get_region_window(self):
+        """
+        Returns the window of the region grid which `data` covers. Windows are found by cell, rather than by
+        coordinates, so that windows only one row or column wide are found exactly.
+        """
+
+        window = self.get_region_grid().get_extent_window(self.data.extent)
+        if window is None or window.shape != tuple(self.data.shape):
+            raise ValueError("The grid is not a window of the region grid")
+
+        return window
 
-        return numpy.ma.masked_where(self.mask | mask, data)
+    def get_cache_key(self, **kwargs):
+        """
+        Returns what the mask depends on other than the grid (the arguments and the modification time of any source
+        data), or None if the mask is cheap enough to calculate that it isn't cached.
+        """
+
+        return None
+
+    def get_window(self, **kwargs):
+        """
+        Returns a window of the grid outside of which all cells are masked, or None if the constraint doesn't limit
+        the window. An empty window masks every cell.
+        """
+
+        return None
 
     def get_mask(self, **kwargs):
-        raise NotImplementedError
+        if not self.is_rectangular:
+            raise NotImplementedError
+
+        window = self.get_window(**kwargs)
+        if window is None:
+            return numpy.zeros(self.data.shape, "bool")
+
+        mask = numpy.ones(self.data.shape, "bool")
+        mask[window.y_slice, window.x_slice] = False
+
+        return mask
+
+    def get_point_mask(self, rows, cols, **kwargs):
+        """
+        Returns the mask at arrays of rows and columns of the grid. By default, the full mask is calculated and
+        sampled; constraints which can evaluate individual cells more cheaply override this.
+        """
+
+        mask = numpy.ma.filled(self.get_mask(**kwargs), True).astype(bool)
+        return mask[rows, cols]
+
+
+class ConstraintMask(object):
+    """
+    Combines a list of constraints into a single mask and crop window. The mask is built once per job against the
+    region grid, before any variable data is read, so that variables can be read for the crop window only.
+    """
+
+    def __init__(self, constraints, region):
+        self.constraints = constraints or []
+        self.region = region
+        self.mask = None
+        self.window = None
+
+    def build(self, grid):
+        self.window = grid.window
+
+        if not self.constraints:
+            return self
+
+        # Windows are intersected first, so that masks only need to be calculated within the final window
+        mask_constraints = []
+        for constraint in self.constraints:
+            name, kwargs = constraint["name"], constraint["args"]
+            instance = Constraint.by_name(name)(grid, self.region)
+
+            window = instance.get_window(**kwargs)
+            if window is not None:
+                self.window = intersect_windows(self.window, window)
+                if self.window is None:
+                    return self.mask_all(grid)
+
+            if not instance.is_rectangular:
+                mask_constraints.append((name, kwargs))
+
+        if not mask_constraints:
+            return self
+
+        subgrid = grid.get_subgrid(self.window)
+        mask = numpy.zeros(subgrid.shape, "bool")
+
+        cache = None
+        if CONSTRAINT_CACHE_DIR is not None:
+            cache = ArrayCache(CONSTRAINT_CACHE_DIR, CONSTRAINT_CACHE_SIZE)
+
+        for name, kwargs in mask_constraints:
+            constraint = Constraint.by_name(name)(subgrid, self.region)
+            mask |= self.get_constraint_mask(constraint, name, kwargs, grid, cache)
+
+        rows = numpy.flatnonzero(~mask.all(axis=1))
+        if not rows.size:
+            return self.mask_all(grid)
+        cols = numpy.flatnonzero(~mask.all(axis=0))
+
+        crop = Window((rows[0], rows[-1] + 1), (cols[0], cols[-1] + 1))
+        self.mask = mask[crop.y_slice, crop.x_slice]
+        self.window = Window(
+            (
+                self.window.y_slice.start + crop.y_slice.start,
+                self.window.y_slice.start + crop.y_slice.stop,
+            ),
+            (
+                self.window.x_slice.start + crop.x_slice.start,
+                self.window.x_slice.start + crop.x_slice.stop,
+            ),
+        )
+
+        return self
+
+    def get_constraint_mask(self, constraint, name, kwargs, grid, cache=None):
+        """
+        Returns the mask of a constraint for the current window of the grid, from the cache if it has been calculated
+        before (by any job or worker).
+        """
+
+        key = constraint.get_cache_key(**kwargs) if cache is not None else None
+
+        if key is not None:
+            key = [
+                CONSTRAINT_CACHE_VERSION,
+                name,
+                key,
+                self.region,
+                grid.extent.as_list(),
+                [int(n) for n in grid.shape],
+                grid.y_increasing,
+                [int(self.window.y_slice.start), int(self.window.y_slice.stop)],
+                [int(self.window.x_slice.start), int(self.window.x_slice.stop)],
+            ]
+
+            packed = cache.get(key)
+            height, width = self.window.shape
+            if packed is not None and packed.shape == (height, math.ceil(width / 8)):
+                return numpy.unpackbits(packed, axis=1, count=width).view(bool)
+
+        mask = numpy.ma.filled(constraint.get_mask(**kwargs), True).astype(bool)
+
+        if key is not None:
+            cache.set(key, numpy.packbits(mask, axis=1))
+
+        return mask
+
+    def mask_all(self, grid):
+        """Masks every cell of the grid, when no cells satisfy the constraints"""
+
+        self.window = grid.window
+        self.mask = numpy.broadcast_to(numpy.True_, grid.shape)
+
+        return self
+
+    def get_mask(self, window):
+        """Returns the combined mask for a window of the grid. Cells outside the crop window are masked."""
+
+        mask = numpy.ones(window.shape, "bool")
+        overlap = intersect_windows(window, self.window)
+
+        if overlap is not None:
+            target = offset_window(overlap, window)
+
+            if self.mask is None:
+                mask[target.y_slice, target.x_slice] = False
+            else:
+                source = offset_window(overlap, self.window)
+                mask[target.y_slice, target.x_slice] = self.mask[
+                    source.y_slice, source.x_slice
+                ]
+
+        return mask
+
+    def get_point_mask(self, grid, rows, cols):
+        """Returns the combined mask at arrays of rows and columns of the grid, without building the full mask"""
+
+        rows = numpy.asarray(rows)
+        cols = numpy.asarray(cols)
+        mask = numpy.zeros(len(rows), "bool")
+
+        for constraint in self.constraints:
+            name, kwargs = constraint["name"], constraint["args"]
+            instance = Constraint.by_name(name)(grid, self.region)
+
+            window = instance.get_window(**kwargs)
+            if window is not None:
+                mask |= (rows < window.y_slice.start) | (rows >= window.y_slice.stop)
+                mask |= (cols < window.x_slice.start) | (cols >= window.x_slice.stop)
+
+            if not instance.is_rectangular:
+                mask |= instance.get_point_mask(rows, cols, **kwargs)
+
+        return mask
 
 
 class ElevationConstraint(Constraint):
+    def get_cache_key(self, **kwargs):
+        return [kwargs, self.get_service_mtime("{}_dem".format(self.region))]
+
     def get_mask(self, **kwargs):
         try:
             min_elevation = kwargs["min"]
@@ -70,18 +301,11 @@ class ElevationConstraint(Constraint):
         except KeyError:
             raise ValueError("Missing constraint arguments")
 
+        window = self.get_region_window()
         service = Service.objects.get(name="{}_dem".format(self.region))
         with Dataset(
             os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
         ) as ds:
-            v = service.variable_set.first()
-            coords = SpatialCoordinateVariables.from_bbox(
-                v.full_extent,
-                ds.variables[v.x_dimension].size,
-                ds.variables[v.y_dimension].size,
-                dtype="float64",
-            )
-            window = coords.get_window_for_bbox(self.data.extent)
             elevation = ds.variables["elevation"][window.y_slice, window.x_slice]
 
         mask = elevation < min_elevation
@@ -89,8 +313,40 @@ class ElevationConstraint(Constraint):
 
         return mask
 
+    def get_point_mask(self, rows, cols, **kwargs):
+        try:
+            min_elevation = kwargs["min"]
+            max_elevation = kwargs["max"]
+        except KeyError:
+            raise ValueError("Missing constraint arguments")
+
+        rows = numpy.asarray(rows)
+        cols = numpy.asarray(cols)
+        if not len(rows):
+            return numpy.zeros(0, "bool")
+
+        # Read only the windows around the points, grouped by block
+        window = self.get_region_window()
+        service = Service.objects.get(name="{}_dem".format(self.region))
+        with Dataset(
+            os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+        ) as ds:
+            elevation = read_cells(
+                lambda w: ds.variables["elevation"][w.y_slice, w.x_slice],
+                rows + window.y_slice.start,
+                cols + window.x_slice.start,
+            )
+
+        mask = elevation < min_elevation
+        mask |= elevation > max_elevation
+
+        return numpy.ma.filled(mask, True).astype(bool)
+
 
 class PhotoperiodConstraint(Constraint):
+    def get_cache_key(self, **kwargs):
+        return [kwargs, self.get_service_mtime("{}_dem".format(self.region))]
+
     def get_julian_day(self, date):
         a = (14 - date.month) // 12
         y = date.year + 4800 - a
@@ -146,6 +402,10 @@ class PhotoperiodConstraint(Constraint):
 
         julian_day = self.get_julian_day(date)
 
+        # Masked arrays don't support the in-place operations below
+        lat = numpy.asarray(lat)
+        lon = numpy.asarray(lon)
+
         lat_arr = numpy.tile(lat.reshape(len(lat), 1), (1, len(lon)))
         lon_arr = numpy.tile(lon, (len(lat), 1))
 
@@ -243,38 +503,76 @@ class PhotoperiodConstraint(Constraint):
         days *= 24
         return days
 
-    def get_mask(self, hours, lat, lon, year, month, day):
+    @classmethod
+    @lru_cache(maxsize=64)
+    def get_row_daylight(cls, path, mtime, date):
+        """
+        Returns daylight hours on `date` for the rows of a dataset (e.g., the region DEM), and the longitude group of
+        each column. Daylight only varies with longitude by `lon // 360`, so it's calculated once per row for each
+        group (usually only one), rather than for every cell. Results are cached by the modification time of the
+        dataset.
+
+        :return: A tuple of (daylight, column_groups). Daylight is an array of (rows, groups).
+        """
+
+        with Dataset(path) as ds:
+            lat_arr = numpy.asarray(ds["lat"][:])
+            lon_arr = numpy.asarray(ds["lon"][:])
+
+        groups, column_groups = numpy.unique(lon_arr // 360, return_inverse=True)
+
+        # Any longitude in a group gives the same daylight, so the group itself stands in
+        daylight = cls(None, None).daylight_array(date, lat_arr, groups * 360)
+        daylight.flags.writeable = False
+        column_groups.flags.writeable = False
+
+        return daylight, column_groups
+
+    def get_row_mask(self, hours, lat, lon, year, month, day):
+        """
+        Returns the mask for each row and longitude group of the grid, and the longitude group of each column of the
+        grid.
+        """
+
         date = datetime.date(year, month, day)
 
         daylight = self.daylight(date, lat, lon)
 
         service = Service.objects.get(name="{}_dem".format(self.region))
-        with Dataset(
-            os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
-        ) as ds:
-            lat_arr = ds["lat"][:]
-            lon_arr = ds["lon"][:]
-            coords = SpatialCoordinateVariables.from_bbox(
-                service.full_extent,
-                ds.variables["lon"].size,
-                ds.variables["lat"].size,
-                dtype="float64",
-            )
+        path = os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+        row_daylight, column_groups = self.get_row_daylight(
+            path, os.path.getmtime(path), date
+        )
 
-        window = coords.get_window_for_bbox(self.data.extent)
+        window = self.get_region_window()
+        row_daylight = row_daylight[window.y_slice]
 
-        daylight_arr = self.daylight_array(
-            date, lat_arr[window.y_slice], lon_arr[window.x_slice]
-        )
+        # Daylight is undefined where the sun doesn't rise or set
+        row_mask = numpy.isnan(row_daylight)
+        row_mask |= row_daylight < (daylight - hours)
+        row_mask |= row_daylight > (daylight + hours)
 
-        mask = daylight_arr < (daylight - hours)
-        mask |= daylight_arr > (daylight + hours)
+        return row_mask, column_groups[window.x_slice]
 
-        return mask
+    def get_mask(self, hours, lat, lon, year, month, day):
+        row_mask, column_groups = self.get_row_mask(hours, lat, lon, year, month, day)
+        shape = (row_mask.shape[0], len(column_groups))
+
+        if row_mask.shape[1] == 1:
+            return numpy.broadcast_to(row_mask, shape)
+
+        return row_mask[:, column_groups]
+
+    def get_point_mask(self, rows, cols, hours, lat, lon, year, month, day):
+        row_mask, column_groups = self.get_row_mask(hours, lat, lon, year, month, day)
+
+        return row_mask[rows, column_groups[cols]]
 
 
 class LatitudeConstraint(Constraint):
-    def get_mask(self, **kwargs):
+    is_rectangular = True
+
+    def get_window(self, **kwargs):
         try:
             min_lat = kwargs["min"]
             max_lat = kwargs["max"]
@@ -284,22 +582,22 @@ class LatitudeConstraint(Constraint):
         min_lat, max_lat = sorted((min_lat, max_lat))
 
         coords = SpatialCoordinateVariables.from_bbox(
-            self.data.extent, *reversed(self.data.shape)
+            self.data.extent,
+            *reversed(self.data.shape),
+            y_ascending=self.data.y_increasing,
         )
         half_pixel_size = float(coords.y.pixel_size) / 2
         start, stop = coords.y.indices_for_range(
             min_lat + half_pixel_size, max_lat - half_pixel_size
         )
 
-        mask = numpy.zeros_like(self.data, "bool")
-        mask[:start][:] = True
-        mask[stop + 1 :][:] = True
-
-        return mask
+        return Window((int(start), int(stop) + 1), (0, self.data.shape[1]))
 
 
 class LongitudeConstraint(Constraint):
-    def get_mask(self, **kwargs):
+    is_rectangular = True
+
+    def get_window(self, **kwargs):
         try:
             min_lon = kwargs["min"]
             max_lon = kwargs["max"]
@@ -318,106 +616,272 @@ class LongitudeConstraint(Constraint):
             min_lon + half_pixel_size, max_lon - half_pixel_size
         )
 
-        mask = numpy.zeros_like(self.data, "bool")
-        mask[:, :start] = True
-        mask[:, stop + 1 :] = True
-
-        return mask
+        return Window((0, self.data.shape[0]), (int(start), int(stop) + 1))
 
 
 class DistanceConstraint(Constraint):
-    def get_mask(self, lat, lon, distance):
-        wgs84 = pyproj.Proj("+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs")
-
-        p = pyproj.Proj(
-            {
-                "proj": "tmerc",
-                "lat_0": lat,
-                "lon_0": lon,
-                "k": 1,
-                "x_0": 0,
-                "y_0": 0,
-                "ellps": "WGS84",
-                "towgs84": "0,0,0,0,0,0,0",
-                "units": "m",
-            }
-        )
+    """
+    Masks cells farther than `distance` (km) from a point. Distances are great circle distances on a sphere with the
+    radius of curvature of the WGS84 ellipsoid at the point, measured from the point itself (not snapped to a cell, so
+    that the mask is the same for any window of the region) to the nearest edge of each cell, so that cells touched by
+    the circle are included. The grid is assumed to be geographic (lat/lon).
+    """
 
-        # Snap point to nearest cell center
-        coords = SpatialCoordinateVariables.from_bbox(
-            self.data.extent,
-            *reversed(self.data.shape),
-            y_ascending=self.data.y_increasing,
-        )
-        lat_pixel_size = (
-            coords.y.pixel_size
-            if coords.y.is_ascending_order()
-            else -1 * coords.y.pixel_size
+    @staticmethod
+    def get_radius(lat):
+        """Returns the Gaussian mean radius of curvature of the WGS84 ellipsoid at a latitude, in meters"""
+
+        sin_lat_2 = math.sin(math.radians(lat)) ** 2
+        return WGS84_A * math.sqrt(1 - WGS84_E2) / (1 - WGS84_E2 * sin_lat_2)
+
+    def get_window(self, lat, lon, distance):
+        angle = distance * 1000 / self.get_radius(lat)
+        lat_range = math.degrees(angle)
+
+        if abs(lat) + lat_range >= 90 or angle >= math.pi / 2:
+            lon_range = 180
+        else:
+            lon_range = math.degrees(
+                math.asin(min(math.sin(angle) / math.cos(math.radians(lat)), 1))
+            )
+
+        return self.data.get_bounds_window(
+            lon - lon_range,
+            lat - lat_range,
+            lon + lon_range,
+            lat + lat_range,
+            padding=1,
         )
-        lat = (
-            sorted(coords.y.values)[
-                int(
-                    (lat - coords.y.pixel_size * 1.5 - self.data.extent.ymin)
-                    / coords.y.pixel_size
-                )
-            ]
-            - lat_pixel_size / 2
+
+    def get_distance_terms(self, lat, lon, rows, cols):
+        """
+        Returns the terms of the haversine formula which depend only on rows and only on columns, from the center to
+        the nearest edge of each cell. The haversine of the distance to a cell is `a[row] + b[row] * c[col]`.
+        """
+
+        cell_x, cell_y = self.data.cell_size
+        coords = self.data.coords
+        lat_0, lon_0 = math.radians(lat), math.radians(lon)
+
+        # The nearest point of each cell is the center, clamped to the cell edges
+        y = numpy.asarray(coords.y.values, "float64")[rows]
+        y = numpy.radians(numpy.clip(lat, y - cell_y / 2, y + cell_y / 2))
+        x = numpy.asarray(coords.x.values, "float64")[cols]
+        x = numpy.radians(numpy.clip(lon, x - cell_x / 2, x + cell_x / 2))
+
+        a = numpy.sin((y - lat_0) / 2) ** 2
+        b = numpy.cos(y) * math.cos(lat_0)
+        c = numpy.sin((x - lon_0) / 2) ** 2
+
+        return a, b, c
+
+    def get_limit(self, lat, distance):
+        """Returns the haversine of the distance, as an angle"""
+
+        angle = min(distance * 1000 / self.get_radius(lat), math.pi)
+        return math.sin(angle / 2) ** 2
+
+    def get_mask(self, lat, lon, distance):
+        mask = numpy.ones(self.data.shape, "bool")
+
+        window = intersect_windows(
+            self.get_window(lat, lon, distance), self.data.window
         )
-        lon = (
-            sorted(coords.x.values)[
-                int(
-                    (lon - coords.x.pixel_size * 1.5 - self.data.extent.xmin)
-                    / coords.x.pixel_size
-                )
-            ]
-            - coords.x.pixel_size / 2
+        if window is None:
+            return mask
+
+        a, b, c = self.get_distance_terms(
+            lat,
+            lon,
+            numpy.arange(window.y_slice.start, window.y_slice.stop),
+            numpy.arange(window.x_slice.start, window.x_slice.stop),
         )
 
-        project_to_custom = partial(pyproj.transform, wgs84, p)
-        project_to_data = partial(pyproj.transform, p, self.data.extent.projection)
+        # Everything outside the window is masked without calculating distances
+        mask[window.y_slice, window.x_slice] = (
+            a[:, None] + b[:, None] * c[None, :]
+        ) > self.get_limit(lat, distance)
 
-        shape = transform(
-            project_to_data,
-            transform(project_to_custom, Point(lon, lat)).buffer(
-                distance * 1000, resolution=64
-            ),
-        )
+        return mask
 
-        return rasterize(
-            [shape],
-            out_shape=self.data.shape,
-            fill=1,
-            transform=coords.affine,
-            all_touched=True,
-            default_value=0,
-            dtype=numpy.uint8,
-        )
+    def get_point_mask(self, rows, cols, lat, lon, distance):
+        a, b, c = self.get_distance_terms(lat, lon, rows, cols)
+
+        return (a + b * c) > self.get_limit(lat, distance)
 
 
 class GeometryConstraint(Constraint):
-    def get_mask(self, **kwargs):
+    @staticmethod
+    def get_geometries(kwargs):
         try:
             geoJSON = kwargs["geoJSON"]
-        except ValueError:
+        except KeyError:
             raise ValueError("Missing constraint arguments")
 
-        features = geoJSON["features"]
-        geometries = [f["geometry"] for f in features]
-        coords = SpatialCoordinateVariables.from_bbox(
-            self.data.extent,
-            *reversed(self.data.shape),
-            y_ascending=self.data.y_increasing,
+        return numpy.array(
+            [shape(f["geometry"]) for f in geoJSON["features"]], dtype=object
+        )
+
+    def get_geometries_window(self, geometries):
+        if not len(geometries):
+            return None
+
+        # Pad by a cell, since cells which only touch the geometries are included
+        return self.data.get_bounds_window(*shapely.total_bounds(geometries), padding=1)
+
+    def get_window(self, **kwargs):
+        return self.get_geometries_window(self.get_geometries(kwargs))
+
+    def rasterize(self, geometries, window):
+        """
+        Rasterizes the geometries within a window of the grid. Geometries are clipped to the window and simplified to
+        half a cell first, so that large, detailed shapefiles rasterize quickly.
+        """
+
+        subgrid = self.data.get_subgrid(window)
+        geometries = shapely.clip_by_rect(geometries, *subgrid.extent.as_list())
+        geometries = shapely.simplify(
+            geometries[~shapely.is_empty(geometries)], min(subgrid.cell_size) / 2
         )
+        geometries = geometries[~shapely.is_empty(geometries)]
+
+        if not len(geometries):
+            return numpy.ones(subgrid.shape, "bool")
+
         return rasterize(
             geometries,
-            out_shape=self.data.shape,
+            out_shape=subgrid.shape,
             fill=1,
-            transform=coords.affine,
+            transform=subgrid.affine,
             all_touched=True,
             default_value=0,
             dtype=numpy.uint8,
+        ).astype(bool)
+
+    def get_cache_key(self, **kwargs):
+        geometries = self.get_geometries(kwargs)
+        return hashlib.sha256(b"".join(shapely.to_wkb(geometries))).hexdigest()
+
+    def get_mask(self, **kwargs):
+        geometries = self.get_geometries(kwargs)
+        mask = numpy.ones(self.data.shape, "bool")
+
+        window = self.get_geometries_window(geometries)
+        if window is not None:
+            window = intersect_windows(window, self.data.window)
+        if window is not None:
+            mask[window.y_slice, window.x_slice] = self.rasterize(geometries, window)
+
+        return mask
+
+    def get_point_mask(self, rows, cols, **kwargs):
+        """
+        Returns the mask at cells of the grid, which are unmasked if any geometry touches them. Each cell is tested
+        against the original geometries, so none are rasterized.
+        """
+
+        geometries = self.get_geometries(kwargs)
+        mask = numpy.ones(len(rows), "bool")
+
+        if not len(geometries) or not len(rows):
+            return mask
+
+        coords = self.data.coords
+        cell_x, cell_y = self.data.cell_size
+        x = numpy.asarray(coords.x.values, "float64")[cols]
+        y = numpy.asarray(coords.y.values, "float64")[rows]
+        cells = shapely.box(
+            x - cell_x / 2, y - cell_y / 2, x + cell_x / 2, y + cell_y / 2
+        )
+
+        touched = shapely.STRtree(geometries).query(cells, predicate="intersects")
+        mask[touched[0]] = False
+
+        return mask
+
+
+class AlignedMask(object):
+    """
+    A raster constraint warped onto a region grid and stored as a bit-packed mask, so that jobs only need to slice a
+    window of it. Masks are stored next to the constraint's NetCDF dataset, and are ignored once the dataset is
+    modified.
+    """
+
+    def __init__(self, packed, shape, extent=None, mtime=None):
+        self.packed = packed
+        self.shape = tuple(shape)
+        self.extent = extent
+        self.mtime = mtime
+
+    @staticmethod
+    def get_path(path, region):
+        return "{}.{}.mask.npz".format(os.path.splitext(path)[0], region)
+
+    @classmethod
+    def build(cls, mask):
+        """Packs a boolean mask, one row at a time so that windows can be unpacked by row and column"""
+
+        return cls(numpy.packbits(mask, axis=1), mask.shape)
+
+    @classmethod
+    def load(cls, path, region, grid):
+        """Returns the mask of the dataset at `path` for a region grid, or None if there is no current mask"""
+
+        try:
+            mask = cls.read(
+                cls.get_path(path, region),
+                os.path.getmtime(cls.get_path(path, region)),
+            )
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        if mask is None or mask.mtime != mtime or mask.shape != tuple(grid.shape):
+            return None
+        if not numpy.allclose(mask.extent, grid.extent.as_list()):
+            return None
+
+        return mask
+
+    @classmethod
+    @lru_cache(maxsize=16)
+    def read(cls, mask_path, mask_mtime):
+        """Reads a stored mask. Masks are cached by the modification time of the file, so rebuilt masks are reread."""
+
+        try:
+            with numpy.load(mask_path) as f:
+                return cls(f["mask"], f["shape"], f["extent"], float(f["mtime"]))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path, region, grid):
+        numpy.savez(
+            self.get_path(path, region),
+            mask=self.packed,
+            shape=self.shape,
+            extent=grid.extent.as_list(),
+            mtime=os.path.getmtime(path),
         )
 
+    def get_window(self, window):
+        """Returns the unpacked mask for a window of the grid"""
+
+        x_start, x_stop = window.x_slice.start, window.x_slice.stop
+        packed = self.packed[window.y_slice, x_start // 8 : math.ceil(x_stop / 8)]
+        offset = x_start % 8
+
+        return numpy.unpackbits(packed, axis=1)[
+            :, offset : offset + x_stop - x_start
+        ].view(bool)
+
+    def get_cells(self, rows, cols):
+        """Returns the mask at arrays of rows and columns of the grid"""
+
+        rows = numpy.asarray(rows)
+        cols = numpy.asarray(cols)
+
+        return (self.packed[rows, cols // 8] >> (7 - cols % 8) & 1).astype(bool)
+
 
 class RasterConstraint(Constraint):
     def warp_to_grid(self, path):
@@ -426,12 +890,7 @@ class RasterConstraint(Constraint):
             vrt_options = {
                 "resampling": Resampling.nearest,
                 "crs": CRS.from_string(bbox.projection.srs),
-                "transform": SpatialCoordinateVariables.from_bbox(
-                    bbox,
-                    self.data.shape[self.data.x_dim],
-                    self.data.shape[self.data.y_dim],
-                    y_ascending=self.data.y_increasing,
-                ).affine,
+                "transform": self.data.affine,
                 "height": self.data.shape[self.data.y_dim],
                 "width": self.data.shape[self.data.x_dim],
             }
@@ -439,19 +898,111 @@ class RasterConstraint(Constraint):
             with WarpedVRT(dataset, **vrt_options) as vrt:
                 return vrt.read(1, masked=True)
 
-    def get_mask(self, **kwargs):
+    def warp_mask(self, path):
+        """Returns the mask of the raster at `path`, warped onto the grid. Cells without data are masked."""
+
+        return numpy.ma.filled(self.warp_to_grid(path) < 1, True).astype(bool)
+
+    def get_cache_key(self, **kwargs):
+        try:
+            return [kwargs, self.get_service_mtime(kwargs["service"])]
+        except (KeyError, Service.DoesNotExist):
+            # Reported when the mask is calculated
+            return None
+
+    def get_service(self, kwargs):
         try:
             service_name = kwargs["service"]
-        except ValueError:
+        except KeyError:
             raise ValueError("Missing constraint arguments")
 
         try:
-            service = Service.objects.get(name=service_name)
+            return Service.objects.get(name=service_name)
         except Service.DoesNotExist:
             raise ValueError("Service {} does not exist".format(service_name))
 
-        raster = self.warp_to_grid(
-            os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+    def get_aligned_mask(self, path):
+        """
+        Returns the mask pre-aligned to the region grid by `build_constraint_masks` and the window of it covered by
+        the grid, or (None, None) if there is no current mask.
+        """
+
+        region_grid = self.get_region_grid()
+        aligned = AlignedMask.load(path, self.region, region_grid)
+        if aligned is not None:
+            window = region_grid.get_extent_window(self.data.extent)
+            if window is not None and window.shape == tuple(self.data.shape):
+                return aligned, window
+
+        return None, None
+
+    def sample_mask(self, service, rows, cols):
+        """
+        Returns the mask at cells of the grid, from the value of the service's dataset at the center of each cell (as
+        for the nearest neighbor warp in `warp_mask`). Only the windows of the dataset around the cells are read.
+        """
+
+        variable = service.variable_set.first()
+        source = VariableSource(
+            os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path),
+            variable.variable,
+            variable.x_dimension,
+            variable.y_dimension,
         )
 
-        return raster < 1
+        try:
+            dataset = source.open()
+            y = dataset.variables[variable.y_dimension]
+            source_grid = Grid(variable.full_extent, source.shape, y[0] < y[-1])
+
+            coords = self.data.coords
+            x = numpy.asarray(coords.x.values, "float64")[cols]
+            y = numpy.asarray(coords.y.values, "float64")[rows]
+
+            projection = self.data.extent.projection
+            source_projection = source_grid.extent.projection
+            if projection.srs != source_projection.srs:
+                transformer = Transformer.from_proj(
+                    projection, source_projection, always_xy=True
+                )
+                x, y = transformer.transform(x, y)
+
+            source_rows, source_cols, inside = source_grid.get_indices(x, y)
+            mask = numpy.ones(len(rows), "bool")
+            if not inside.any():
+                return mask
+
+            values = read_cells(source.read, source_rows[inside], source_cols[inside])
+        finally:
+            source.close()
+
+        mask[inside] = numpy.ma.filled(values < 1, True)
+
+        return mask
+
+    def get_mask(self, **kwargs):
+        service = self.get_service(kwargs)
+        path = os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+
+        aligned, window = self.get_aligned_mask(path)
+        if aligned is not None:
+            return aligned.get_window(window)
+
+        return self.warp_mask(path)
+
+    def get_point_mask(self, rows, cols, **kwargs):
+        rows = numpy.asarray(rows)
+        cols = numpy.asarray(cols)
+        if not len(rows):
+            return numpy.zeros(0, "bool")
+
+        service = self.get_service(kwargs)
+        path = os.path.join(settings.NC_SERVICE_DATA_ROOT, service.data_path)
+
+        aligned, window = self.get_aligned_mask(path)
+        if aligned is not None:
+            return aligned.get_cells(
+                rows + window.y_slice.start, cols + window.x_slice.start
+            )
+
+        return self.sample_mask(service, rows, cols)
@@ -0,0 +1,286 @@
+import operator
+from functools import lru_cache
+
+import numpy
+from ncdjango.geoprocessing.evaluation import Lexer
+
+# Python operator (for numbers) and ufunc (for arrays) for each arithmetic operator
+OPERATORS = {
+    "+": (operator.add, numpy.add),
+    "-": (operator.sub, numpy.subtract),
+    "*": (operator.mul, numpy.multiply),
+    "/": (operator.truediv, numpy.true_divide),
+    "**": (operator.pow, numpy.power),
+    "%": (operator.mod, numpy.remainder),
+}
+
+# Operators which mask invalid results when applied to masked arrays
+DOMAINED_OPERATORS = {"/", "**", "%"}
+
+# Functions of the ncdjango grammar which reduce an array to a single value. Functions are
+# evaluated one tile at a time, so these would give a different result for each tile.
+REDUCTIONS = {"min", "max", "mean", "median", "std", "var"}
+
+
+class UnsupportedExpression(ValueError):
+    """Indicates that an expression uses syntax which `Expression` doesn't support"""
+
+
+class ExpressionCompiler(object):
+    """
+    Compiles the arithmetic subset of the ncdjango expression grammar (numbers, names, parentheses, unary +/- and
+    binary + - * / ** %) into a tree of nodes. Precedence follows the ncdjango grammar, rather than Python's: `**`
+    has the same precedence as `*` and `/`, and unary operators apply to a single factor.
+    """
+
+    def __init__(self, fn):
+        lexer = Lexer().lexer
+        lexer.input(fn)
+
+        try:
+            self.tokens = list(lexer)
+        except SyntaxError as e:
+            raise UnsupportedExpression(str(e))
+
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position].type
+        return None
+
+    def next(self):
+        if self.position >= len(self.tokens):
+            raise UnsupportedExpression("Unexpected end of expression")
+
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def compile(self):
+        node = self.expression()
+
+        if self.position != len(self.tokens):
+            raise UnsupportedExpression(
+                "Unsupported token '{}'".format(self.tokens[self.position].value)
+            )
+
+        return node
+
+    def expression(self):
+        node = self.term()
+
+        while self.peek() in ("ADD", "SUB"):
+            node = binary_node(self.next().value, node, self.term())
+
+        return node
+
+    def term(self):
+        if self.peek() in ("ADD", "SUB"):
+            op = self.next().value
+            node = self.factor()
+
+            if op == "-":
+                node = ("number", -node[1]) if node[0] == "number" else ("neg", node)
+        else:
+            node = self.factor()
+
+        while self.peek() in ("MUL", "DIV", "POW", "MOD"):
+            node = binary_node(self.next().value, node, self.factor())
+
+        return node
+
+    def factor(self):
+        token = self.next()
+
+        if token.type in ("INT", "FLOAT"):
+            return ("number", token.value)
+
+        if token.type == "ID":
+            return ("name", token.value)
+
+        if token.type == "LPAREN":
+            node = self.expression()
+
+            if self.next().type != "RPAREN":
+                raise UnsupportedExpression("Expected ')'")
+
+            return node
+
+        raise UnsupportedExpression("Unsupported token '{}'".format(token.value))
+
+
+def binary_node(op, left, right):
+    """Returns a node for a binary operator, folding the result if both operands are numbers"""
+
+    if left[0] == "number" and right[0] == "number":
+        try:
+            return ("number", OPERATORS[op][0](left[1], right[1]))
+        except ArithmeticError:
+            pass
+
+    return ("op", op, left, right)
+
+
+class Expression(object):
+    """
+    A compiled expression, which evaluates with the same results as `Parser.evaluate()`, but writes each operation
+    into a reusable buffer, rather than creating a new masked array for each operator. Masks are combined once for the
+    whole expression.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.root = ExpressionCompiler(fn).compile()
+        self.names = set()
+        self.is_domained = False
+        self.collect(self.root)
+
+    def collect(self, node):
+        if node[0] == "name":
+            self.names.add(node[1])
+        elif node[0] == "neg":
+            self.collect(node[1])
+        elif node[0] == "op":
+            self.is_domained |= node[1] in DOMAINED_OPERATORS
+            self.collect(node[2])
+            self.collect(node[3])
+
+    def evaluate(self, context):
+        """
+        Evaluates the expression.
+
+        :param context: Dictionary of values by name. Values may be numbers, arrays or callables returning either.
+        """
+
+        values = {}
+        for name in self.names:
+            try:
+                value = context[name]
+            except KeyError:
+                raise NameError("name '{}' is not defined".format(name))
+            values[name] = value() if callable(value) else value
+
+        masks = [
+            numpy.ma.getmaskarray(v)
+            for v in values.values()
+            if numpy.ma.isMaskedArray(v)
+        ]
+        data = {
+            k: numpy.ma.getdata(v) if isinstance(v, numpy.ndarray) else v
+            for k, v in values.items()
+        }
+
+        with numpy.errstate(all="ignore"):
+            result, _ = self.evaluate_node(self.root, data, [])
+
+        if not masks or not isinstance(result, numpy.ndarray):
+            return result
+
+        mask = masks[0].copy()
+        for other in masks[1:]:
+            mask |= other
+        if self.is_domained:
+            mask |= ~numpy.isfinite(result)
+
+        return numpy.ma.masked_array(result, mask=mask)
+
+    def evaluate_node(self, node, data, buffers):
+        """
+        Returns (value, is_buffer) for a node. Buffers are arrays created by this evaluation, which can be written to
+        by later operations. Those no longer needed are added to `buffers` for reuse.
+        """
+
+        kind = node[0]
+
+        if kind == "number":
+            return node[1], False
+
+        if kind == "name":
+            return data[node[1]], False
+
+        if kind == "neg":
+            value, is_buffer = self.evaluate_node(node[1], data, buffers)
+
+            if not isinstance(value, numpy.ndarray):
+                return -value, False
+
+            out = (
+                value
+                if is_buffer
+                else self.get_buffer(buffers, value.shape, value.dtype)
+            )
+            return numpy.negative(value, out=out), True
+
+        op, left_node, right_node = node[1:]
+        python_op, ufunc = OPERATORS[op]
+        left, left_is_buffer = self.evaluate_node(left_node, data, buffers)
+        right, right_is_buffer = self.evaluate_node(right_node, data, buffers)
+
+        if not isinstance(left, numpy.ndarray) and not isinstance(right, numpy.ndarray):
+            return python_op(left, right), False
+
+        # Resolve the result type the same way as the operator would, from single-element
+        # samples of array operands
+        dtype = ufunc(sample(left), sample(right)).dtype
+        shape = numpy.broadcast(left, right).shape
+
+        if left_is_buffer and left.dtype == dtype and left.shape == shape:
+            out = left
+        elif right_is_buffer and right.dtype == dtype and right.shape == shape:
+            out = right
+        else:
+            out = self.get_buffer(buffers, shape, dtype)
+
+        ufunc(left, right, out=out)
+
+        for value, is_buffer in ((left, left_is_buffer), (right, right_is_buffer)):
+            if is_buffer and value is not out:
+                buffers.append(value)
+
+        return out, True
+
+    @staticmethod
+    def get_buffer(buffers, shape, dtype):
+        for i, buffer in enumerate(buffers):
+            if buffer.shape == shape and buffer.dtype == dtype:
+                return buffers.pop(i)
+
+        return numpy.empty(shape, dtype)
+
+
+def sample(value):
+    if isinstance(value, numpy.ndarray):
+        return numpy.ones(1, value.dtype)
+    return value
+
+
+def check_expression(fn):
+    """Raises ValueError if `fn` uses a function which reduces an array, and so can't be evaluated by tile"""
+
+    lexer = Lexer().lexer
+    lexer.input(fn)
+
+    try:
+        reductions = sorted(
+            {t.value for t in lexer if t.type == "FUNC" and t.value in REDUCTIONS}
+        )
+    except SyntaxError as e:
+        raise ValueError(str(e))
+
+    if reductions:
+        raise ValueError(
+            "Functions may not use {}, since scores are calculated by tile: {}".format(
+                ", ".join(reductions), fn
+            )
+        )
+
+
+@lru_cache(maxsize=256)
+def compile_expression(fn):
+    """Returns a compiled `Expression` for `fn`, or None if the expression must be evaluated by `Parser`"""
+
+    try:
+        return Expression(fn)
+    except UnsupportedExpression:
+        return None
@@ -1,29 +1,106 @@
-import math
 from pathlib import Path
 
 import numpy
 from django.conf import settings
+from django.contrib.gis.geos import Polygon
 from ncdjango.geoprocessing.data import Raster
-from ncdjango.geoprocessing.evaluation import Parser, Lexer
+from ncdjango.geoprocessing.evaluation import Lexer
 from ncdjango.geoprocessing.params import (
+    BooleanParameter,
     RasterParameter,
     DictParameter,
+    IntParameter,
+    ListParameter,
     StringParameter,
+    MultiParameter,
     ParameterCollection,
 )
 from ncdjango.geoprocessing.workflow import Task
 from ncdjango.models import Service
 from ncdjango.views import NetCdfDatasetMixin
-from netCDF4 import Dataset
-from numpy.ma import is_masked
-from trefoil.netcdf.variable import SpatialCoordinateVariables
-
-from .utils import create_latitude_data
-from .constraints import Constraint
+from shapely import wkb
+
+from ..models import SeedZone
+from .cache import ArrayCache
+from .constraints import Constraint, ConstraintMask
+from .locations import MAX_TOP_K, PATCH_MIN_SCORE, get_patches, get_top_locations
+from .polygons import get_class_polygons, write_polygons
+from .result_cache import (
+    RESULT_CACHE_ENABLED,
+    cache_result,
+    get_cached_outputs,
+    get_current_job,
+    get_inputs_hash,
+)
+from .scoring import (
+    LatitudeSource,
+    TileScorer,
+    VariableSource,
+    iter_tiles,
+    score_tiles,
+)
+from .summary import AreaSummary
+from .utils import Grid, offset_window
 
 NC_SERVICE_DIR = settings.NC_SERVICE_DATA_ROOT
 Y_INCREASING = True
 
+# Distances for each variable and function can be cached, so that jobs which change only
+# some limits recalculate only those variables. Each tile and item stores a float32 array, so
+# caching is off unless a directory is set.
+DISTANCE_CACHE_DIR = getattr(settings, "SEEDSOURCE_DISTANCE_CACHE_DIR", None)
+DISTANCE_CACHE_SIZE = getattr(
+    settings, "SEEDSOURCE_DISTANCE_CACHE_SIZE", 2 * 1024**3
+)  # 2 GB
+
+# Each scenario of a batch job is published as a separate result service
+MAX_BATCH_SCENARIOS = getattr(settings, "SEEDSOURCE_MAX_BATCH_SCENARIOS", 8)
+
+# Default score above which a model counts as agreeing that a cell is suitable
+ENSEMBLE_THRESHOLD = getattr(settings, "SEEDSOURCE_ENSEMBLE_THRESHOLD", 50)
+
+
+class ScoringWindow(object):
+    """
+    The window of the region grid to score: the window of cells allowed by the constraints. User sites are located on
+    the region grid, but don't extend the window, since they report values even when they fall outside the
+    constraints. The window doesn't depend on the climate scenario, so it can be shared by several scenarios.
+    """
+
+    def __init__(self, grid, constraint_mask, points=None):
+        self.grid = grid
+        self.constraint_mask = constraint_mask
+        self.window = constraint_mask.window
+        self.points = points
+        self.point_rows = self.point_cols = self.point_inside = None
+
+        if points:
+            x_col = points["headers"]["x"]
+            y_col = points["headers"]["y"]
+            self.point_rows, self.point_cols, self.point_inside = grid.get_indices(
+                [p[x_col] for p in points["points"]],
+                [p[y_col] for p in points["points"]],
+            )
+
+    def get_tile_point_indices(self, tile):
+        """Returns the indices of user sites within a tile, or None if there are none"""
+
+        if not self.points:
+            return None
+
+        in_tile = self.point_inside.copy()
+        in_tile &= (self.point_rows >= tile.y_slice.start) & (
+            self.point_rows < tile.y_slice.stop
+        )
+        in_tile &= (self.point_cols >= tile.x_slice.start) & (
+            self.point_cols < tile.x_slice.stop
+        )
+
+        if not in_tile.any():
+            return None
+
+        return numpy.flatnonzero(in_tile)
+
 
 class GenerateScores(NetCdfDatasetMixin, Task):
     name = "sst:generate_scores"
@@ -35,47 +112,368 @@ class GenerateScores(NetCdfDatasetMixin, Task):
         DictParameter("functions", required=False),
         DictParameter("constraints", required=False),
         DictParameter("points", required=False),
+        BooleanParameter("points_only", required=False),
+        StringParameter("species", required=False),
+        IntParameter("top_k", required=False),
+        IntParameter("patch_min_score", required=False),
+        BooleanParameter("polygons", required=False),
+    ]
+    outputs = [
+        # The name of an existing result service is returned for jobs matching an earlier job
+        MultiParameter(
+            [RasterParameter("raster_out"), StringParameter("raster_out")],
+            "raster_out",
+        ),
+        DictParameter("points"),
+        DictParameter("area_summary"),
+        ListParameter(DictParameter(""), "top_locations"),
+        ListParameter(DictParameter(""), "patches"),
+        # Name of a zip file in the download directory
+        StringParameter("polygons"),
     ]
-    outputs = [RasterParameter("raster_out"), DictParameter("points")]
 
     def __init__(self):
         self.service = None
         self.dataset = None
+        self.services = {}
+
+    def get_service(self, name):
+        """Returns a service by name, querying each service at most once per job"""
+
+        if name not in self.services:
+            self.services[name] = Service.objects.get(name=name)
+        return self.services[name]
+
+    def get_region_grid(self, region):
+        """Returns the grid shared by the DEM and climate variables of a region"""
 
-    def load_variable_data(self, variable, region, year, model=None):
+        service = self.get_service(f"{region}_dem")
+        variable = service.variable_set.all()[:1].get()
+        self.service = service
+
+        try:
+            width, height = self.get_grid_spatial_dimensions(variable)
+        finally:
+            self.close_dataset()
+
+        return Grid(variable.full_extent, (height, width), Y_INCREASING)
+
+    def get_variable_source(self, variable, region, year, model=None):
         if variable == "LAT":
-            service = Service.objects.get(name=f"{region}_dem")
-            with Dataset(str(Path(NC_SERVICE_DIR) / service.data_path)) as ds:
-                variable = service.variable_set.all()[:1].get()
-                return create_latitude_data(
-                    SpatialCoordinateVariables.from_dataset(
-                        ds, x_name=variable.x_dimension, y_name=variable.y_dimension
-                    )
-                )
+            service = self.get_service(f"{region}_dem")
+            variable = service.variable_set.all()[:1].get()
+            return LatitudeSource(
+                str(Path(NC_SERVICE_DIR) / service.data_path),
+                variable.x_dimension,
+                variable.y_dimension,
+            )
 
         if model is not None:
             year = "{model}_{year}".format(model=model, year=year)
 
-        service = Service.objects.get(
-            name="{region}_{year}SY_{variable}".format(
+        service = self.get_service(
+            "{region}_{year}SY_{variable}".format(
                 region=region, year=year, variable=variable
             )
         )
         variable = service.variable_set.first()
-        self.service = variable.service
-        self.dataset = None
-        data = self.get_grid_for_variable(variable)
-        return Raster(data, variable.full_extent, 1, 0, Y_INCREASING)
+        return VariableSource(
+            str(Path(NC_SERVICE_DIR) / service.data_path),
+            variable.variable,
+            variable.x_dimension,
+            variable.y_dimension,
+        )
 
-    def apply_constraints(self, data, constraints, region):
-        if constraints is None:
-            return data
+    @staticmethod
+    def get_variable_names(variables, functions):
+        """Returns the names of all variables needed to score variables and functions"""
 
-        for constraint in constraints:
-            name, kwargs = constraint["name"], constraint["args"]
-            data = Constraint.by_name(name)(data, region).apply_constraint(**kwargs)
+        names = {v["name"] for v in variables}
+        for func in functions:
+            names |= Lexer().get_names(func["fn"])
+        names.discard("math_e")
+
+        return names
+
+    def get_data_versions(self, region, year, model, variables, functions, constraints):
+        """
+        Identifies the source data read by a job: the path and modification time of each variable, and what each
+        constraint depends on other than its arguments (e.g., the DEM for elevation constraints).
+        """
+
+        names = self.get_variable_names(variables, functions)
+        versions = [
+            self.get_variable_source(name, region, year, model).cache_key
+            for name in sorted(names)
+        ]
+
+        grid = self.get_region_grid(region)
+        for constraint in constraints or []:
+            instance = Constraint.by_name(constraint["name"])(grid, region)
+            versions.append(instance.get_cache_key(**constraint["args"]))
+
+        return versions
+
+    def get_scorer(self, region, year, model, variables, functions, cache=None):
+        names = self.get_variable_names(variables, functions)
+        sources = {
+            name: self.get_variable_source(name, region, year, model) for name in names
+        }
+        return TileScorer(variables, functions, sources, cache)
+
+    @staticmethod
+    def get_points_output(points, items, year, values, scores):
+        """
+        Returns user sites with their score, and the difference between the value of each variable and function and
+        the midpoint of its limits. Values and scores are masked arrays, with one value per site.
+        """
+
+        deltas = {}
+        for item in items:
+            limit_min, limit_max = item["limit"]["min"], item["limit"]["max"]
+            midpoint = limit_min + (limit_max - limit_min) / 2
+            item_values = values[item["name"]].filled(0)
+
+            if year in ("1961_1990", "1981_2010", "1991_2020"):
+                deltas[item["name"]] = (midpoint - item_values).tolist()
+            else:
+                deltas[item["name"]] = (item_values - midpoint).tolist()
+
+        scores = scores.filled(0).tolist()
+
+        return [
+            {
+                **point,
+                "deltas": {
+                    name: item_deltas[i] for name, item_deltas in deltas.items()
+                },
+                "score": scores[i],
+            }
+            for i, point in enumerate(points["points"])
+        ]
+
+    @staticmethod
+    def get_site_cells(grid, rows, cols):
+        """
+        Returns the unique cells under user sites, as (rows, cols, indices), where `indices` is the index of the cell
+        of each site. Sites in the same cell share one calculation.
+        """
+
+        width = grid.shape[1]
+        cells, indices = numpy.unique(rows * width + cols, return_inverse=True)
+        cell_rows, cell_cols = numpy.divmod(cells, width)
+
+        return cell_rows, cell_cols, indices
+
+    def score_points(
+        self, region, year, model, variables, functions, constraints, points
+    ):
+        """
+        Scores user sites without calculating the full raster. Only the cells under the sites are read, in windows
+        grouped by block (see `read_cells`), and constraints are evaluated for those cells.
+        """
+
+        grid = self.get_region_grid(region)
+        x_col = points["headers"]["x"]
+        y_col = points["headers"]["y"]
+        rows, cols, inside = grid.get_indices(
+            [p[x_col] for p in points["points"]],
+            [p[y_col] for p in points["points"]],
+        )
+
+        cell_rows, cell_cols, cell_indices = self.get_site_cells(
+            grid, rows[inside], cols[inside]
+        )
+        cell_masks = ConstraintMask(constraints, region).get_point_mask(
+            grid, cell_rows, cell_cols
+        )
+
+        items = variables + functions
+        scorer = self.get_scorer(region, year, model, variables, functions)
+        try:
+            cell_scores, cell_values = scorer.score_cells(
+                cell_rows, cell_cols, cell_masks
+            )
+        finally:
+            scorer.close()
+
+        site_indices = numpy.flatnonzero(inside)
+        point_scores = numpy.ma.masked_all(len(rows), "int8")
+        point_scores[site_indices] = cell_scores[cell_indices]
+        point_values = {}
+        for name, values in cell_values.items():
+            point_values[name] = numpy.ma.masked_all(len(rows), "float64")
+            point_values[name][site_indices] = values[cell_indices]
+
+        return self.get_points_output(points, items, year, point_values, point_scores)
+
+    def sample_points(
+        self, scoring_window, indices, region, year, model, variables, functions, values
+    ):
+        """
+        Reads the unconstrained values of the user sites at `indices` into `values`, a dictionary of {item name:
+        masked array with one value per site}, without scoring the tiles containing them.
+        """
+
+        if not len(indices):
+            return
+
+        cell_rows, cell_cols, cell_indices = self.get_site_cells(
+            scoring_window.grid,
+            scoring_window.point_rows[indices],
+            scoring_window.point_cols[indices],
+        )
+
+        scorer = self.get_scorer(region, year, model, variables, functions)
+        try:
+            cell_values = scorer.read_cells(cell_rows, cell_cols)
+        finally:
+            scorer.close()
+
+        for name, item_values in cell_values.items():
+            values[name][indices] = item_values[cell_indices]
+
+    def get_scoring_window(self, region, constraints, points):
+        # Constraints are evaluated against the region grid before any variable is read,
+        # so that each variable is only read for the window of unconstrained cells.
+        grid = self.get_region_grid(region)
+        constraint_mask = ConstraintMask(constraints, region).build(grid)
+
+        return ScoringWindow(grid, constraint_mask, points)
+
+    def get_area_summary(self, scoring_window, species=None):
+        """Returns an `AreaSummary` for the window, by seed zones of `species` if given"""
+
+        grid = scoring_window.grid
+        zones = []
+
+        if species:
+            extent = grid.get_window_extent(scoring_window.window)
+            queryset = SeedZone.objects.filter(
+                species=species,
+                polygon__intersects=Polygon.from_bbox(extent.as_list()),
+            ).select_related("zone_source")
+
+            for zone in queryset:
+                zones.append(
+                    {
+                        "zone_uid": zone.zone_uid,
+                        "name": zone.name,
+                        "source": zone.zone_source_id or zone.source,
+                        "geometry": wkb.loads(bytes(zone.polygon.wkb)),
+                    }
+                )
+
+        return AreaSummary(grid, zones)
+
+    def score_scenario(
+        self, scoring_window, region, year, model, variables, functions, summary=None
+    ):
+        """
+        Scores a window for one climate scenario. If `summary` is given, scored tiles are added to it.
+
+        :return: A tuple of (raster, points). Points is None if the window has no user sites.
+        """
+
+        window = scoring_window.window
+        points = scoring_window.points
+
+        cache = None
+        if DISTANCE_CACHE_DIR is not None:
+            cache = ArrayCache(DISTANCE_CACHE_DIR, DISTANCE_CACHE_SIZE)
+        scorer = self.get_scorer(region, year, model, variables, functions, cache)
+
+        # Scores are calculated one tile at a time, so that only the int8 result is held
+        # for the full window
+        scores = numpy.ma.masked_all(window.shape, "int8")
+        num_points = len(points["points"]) if points else 0
+        point_values = {
+            item["name"]: numpy.ma.masked_all(num_points, "float64")
+            for item in variables + functions
+        }
+        tile_point_indices = {}
+        sampled = numpy.zeros(num_points, "bool")
+
+        def get_tiles():
+            for tile in iter_tiles(window):
+                tile_mask = scoring_window.constraint_mask.get_mask(tile)
+
+                # Nothing to calculate for tiles which are entirely masked by constraints,
+                # or in which no cell can be within the limits of every variable
+                if tile_mask.all() or not scorer.can_score(tile):
+                    continue
+
+                tile_points = None
+                indices = scoring_window.get_tile_point_indices(tile)
+
+                if indices is not None:
+                    tile_point_indices[tile.y_slice.start, tile.x_slice.start] = indices
+                    tile_points = (
+                        scoring_window.point_rows[indices] - tile.y_slice.start,
+                        scoring_window.point_cols[indices] - tile.x_slice.start,
+                    )
+
+                yield tile, tile_mask, tile_points
+
+        try:
+            for tile, tile_scores, tile_values in score_tiles(scorer, get_tiles()):
+                target = offset_window(tile, window)
+                scores[target.y_slice, target.x_slice] = tile_scores
+
+                if summary is not None:
+                    summary.add(tile, tile_scores)
+
+                if tile_values:
+                    indices = tile_point_indices.pop(
+                        (tile.y_slice.start, tile.x_slice.start)
+                    )
+                    for name, values in tile_values.items():
+                        point_values[name][indices] = values
+                    sampled[indices] = True
+        finally:
+            scorer.close()
+
+        # Sites outside of the scored tiles are masked, but still report their values.
+        # These are read in windows around the sites, rather than scoring the tiles around them.
+        if points:
+            unsampled = numpy.flatnonzero(scoring_window.point_inside & ~sampled)
+            self.sample_points(
+                scoring_window,
+                unsampled,
+                region,
+                year,
+                model,
+                variables,
+                functions,
+                point_values,
+            )
+
+        scores.fill_value = -128
+        raster = Raster(
+            scores,
+            scoring_window.grid.get_window_extent(window),
+            1,
+            0,
+            Y_INCREASING,
+        )
+
+        if not points:
+            return raster, None
+
+        # Sites outside of the window are masked by constraints
+        point_rows = scoring_window.point_rows - window.y_slice.start
+        point_cols = scoring_window.point_cols - window.x_slice.start
+        in_window = scoring_window.point_inside.copy()
+        in_window &= (point_rows >= 0) & (point_rows < window.shape[0])
+        in_window &= (point_cols >= 0) & (point_cols < window.shape[1])
+
+        point_scores = numpy.ma.masked_all(num_points, "int8")
+        point_scores[in_window] = scores[point_rows[in_window], point_cols[in_window]]
+        points_out = self.get_points_output(
+            points, variables + functions, year, point_values, point_scores
+        )
 
-        return data
+        return raster, points_out
 
     def execute(
         self,
@@ -86,106 +484,266 @@ class GenerateScores(NetCdfDatasetMixin, Task):
         functions=[],
         constraints=None,
         points=None,
+        points_only=False,
+        species=None,
+        top_k=None,
+        patch_min_score=None,
+        polygons=False,
     ):
-        data = {}
+        # Only user sites are scored, for quick comparisons without a full job
+        if points_only:
+            if not points:
+                raise ValueError("Points are required when scoring points only")
+
+            ret = ParameterCollection(self.outputs)
+            ret["points"] = self.score_points(
+                region, year, model, variables, functions, constraints, points
+            )
+            return ret
+
+        if top_k is not None and not 0 < top_k <= MAX_TOP_K:
+            raise ValueError(f"top_k must be between 1 and {MAX_TOP_K}")
+        if patch_min_score is None:
+            patch_min_score = PATCH_MIN_SCORE
+
+        job = get_current_job() if RESULT_CACHE_ENABLED else None
+        if job is not None:
+            inputs_hash = get_inputs_hash(
+                self.name,
+                {
+                    "region": region,
+                    "year": year,
+                    "model": model,
+                    "variables": variables,
+                    "functions": functions,
+                    "constraints": constraints,
+                    "points": points,
+                    "species": species,
+                    "top_k": top_k,
+                    "patch_min_score": patch_min_score if top_k else None,
+                    "polygons": polygons,
+                },
+                self.get_data_versions(
+                    region, year, model, variables, functions, constraints
+                ),
+            )
+            cached = get_cached_outputs(inputs_hash)
+
+            # Polygon downloads are removed sooner than result services
+            if cached is not None and polygons:
+                path = settings.DATASET_DOWNLOAD_DIR / cached.get("polygons", "")
+                if not path.is_file():
+                    cached = None
+
+            if cached is not None:
+                ret = ParameterCollection(self.outputs)
+                ret["raster_out"] = cached["raster_out"]
+                for name in (
+                    "points",
+                    "area_summary",
+                    "top_locations",
+                    "patches",
+                    "polygons",
+                ):
+                    if name in cached:
+                        ret[name] = cached[name]
+                return ret
+
+        scoring_window = self.get_scoring_window(region, constraints, points)
+        summary = self.get_area_summary(scoring_window, species)
+        raster, points_out = self.score_scenario(
+            scoring_window, region, year, model, variables, functions, summary
+        )
 
-        points_out = None
-        if points:
-            points_out = [{**p, "deltas": {}} for p in points["points"]]
+        ret = ParameterCollection(self.outputs)
+        ret["raster_out"] = raster
+        ret["area_summary"] = summary.to_dict()
+
+        # Locations, patches and polygons are found in the in-memory int8 result, rather
+        # than reading back the published result
+        result_grid = scoring_window.grid.get_subgrid(scoring_window.window)
+        if top_k:
+            ret["top_locations"] = get_top_locations(raster, result_grid, top_k)
+            ret["patches"] = get_patches(raster, result_grid, top_k, patch_min_score)
+        if polygons:
+            ret["polygons"] = write_polygons(get_class_polygons(raster, result_grid))
+
+        if points_out is not None:
+            ret["points"] = points_out
 
-        variable_names = {v["name"] for v in variables}
+        if job is not None:
+            cache_result(inputs_hash, job)
 
-        if points:
-            x_col = points["headers"]["x"]
-            y_col = points["headers"]["y"]
+        return ret
 
-        for func in functions:
 
-            def loader_fn(variable):
-                def load():
-                    return self.load_variable_data(variable, region, year, model)
-
-                return load
-
-            fn = func["fn"]
-            names = Lexer().get_names(fn)
-            context = {**{x: loader_fn(x) for x in names}, "math_e": math.e}
-            data[func["name"]] = Parser().evaluate(fn, context)
-            data.update({k: v for k, v in context.items() if k in variable_names})
-
-        sum_rasters = None
-        sum_masks = None
-
-        for item in variables + functions:
-            limit = item["limit"]
-            limit_min = limit["min"]
-            limit_max = limit["max"]
-            half = (limit_max - limit_min) / 2
-            midpoint = limit_min + half
-            factor = 100 / half
-            mid_factor = factor * midpoint
-
-            if item["name"] in data:
-                raster = data[item["name"]]
-                del data[item["name"]]
-            else:
-                raster = self.load_variable_data(item["name"], region, year, model)
+class GenerateScoresBatch(GenerateScores):
+    """
+    Scores several climate scenarios (year and model) for the same limits and constraints. Constraints and user site
+    locations are resolved once for all scenarios. Scores for each scenario are returned as `raster_out_<index>`, which
+    is listed for the scenario in the `scenarios` output.
+    """
 
-            if points:
-                for i, point in enumerate(points["points"]):
-                    idx = raster.index(point[x_col], point[y_col])
-                    value = raster[idx]
-                    value = value.item() if not is_masked(value) else 0
+    name = "sst:generate_scores_batch"
+    inputs = [
+        StringParameter("region"),
+        ListParameter(DictParameter(""), "scenarios"),
+        DictParameter("variables", required=False),
+        DictParameter("functions", required=False),
+        DictParameter("constraints", required=False),
+        DictParameter("points", required=False),
+    ]
+    outputs = [
+        RasterParameter(f"raster_out_{i}", required=False)
+        for i in range(MAX_BATCH_SCENARIOS)
+    ] + [ListParameter(DictParameter(""), "scenarios")]
+
+    def execute(
+        self,
+        region,
+        scenarios,
+        variables=[],
+        functions=[],
+        constraints=None,
+        points=None,
+    ):
+        if not scenarios:
+            raise ValueError("At least one scenario is required")
+        if len(scenarios) > MAX_BATCH_SCENARIOS:
+            raise ValueError(
+                f"No more than {MAX_BATCH_SCENARIOS} scenarios may be scored in one job"
+            )
 
-                    if year in ("1961_1990", "1981_2010", "1991_2020"):
-                        delta = midpoint - value
-                    else:
-                        delta = value - midpoint
+        scoring_window = self.get_scoring_window(region, constraints, points)
 
-                    points_out[i]["deltas"][item["name"]] = delta
+        ret = ParameterCollection(self.outputs)
+        scenarios_out = []
+
+        for i, scenario in enumerate(scenarios):
+            year = scenario["year"]
+            model = scenario.get("model")
 
-            raster = self.apply_constraints(raster, constraints, region)
-            extent = raster.extent
-            mask = (
-                raster.mask if is_masked(raster) else numpy.zeros_like(raster, "bool")
+            raster, points_out = self.score_scenario(
+                scoring_window, region, year, model, variables, functions
             )
 
-            mask |= raster < limit_min
-            mask |= raster > limit_max
+            ret[f"raster_out_{i}"] = raster
 
-            if sum_masks is not None:
-                sum_masks |= mask
-            else:
-                sum_masks = mask
+            scenario_out = {
+                "year": year,
+                "model": model,
+                "raster_out": f"raster_out_{i}",
+            }
+            if points_out is not None:
+                scenario_out["points"] = points_out
+            scenarios_out.append(scenario_out)
 
-            raster = raster.view(numpy.ndarray).astype("float32")
-            raster *= factor
-            raster -= mid_factor
-            raster **= 2
-            raster = numpy.floor(raster, raster)
+        ret["scenarios"] = scenarios_out
 
-            if sum_rasters is not None:
-                sum_rasters += raster
-            else:
-                sum_rasters = raster
+        return ret
 
-        sum_rasters += 0.4
-        sum_rasters **= 0.5
 
-        sum_masks |= sum_rasters > 100
-        sum_rasters = numpy.ma.masked_where(sum_masks, sum_rasters)
-        sum_rasters = 100 - sum_rasters.astype("int8")
-        sum_rasters.fill_value = -128
+class GenerateEnsembleScores(GenerateScores):
+    """
+    Scores a future period with each available climate model, and summarizes agreement between models: the mean and
+    minimum score, and the number of models scoring above a threshold. Models are scored one at a time into running
+    totals, so memory doesn't grow with the number of models. A cell masked for some models, but not all, counts as a
+    score of 0 for those models.
+    """
 
-        ret = ParameterCollection(self.outputs)
-        ret["raster_out"] = Raster(sum_rasters, extent, 1, 0, Y_INCREASING)
+    name = "sst:generate_ensemble_scores"
+    inputs = [
+        StringParameter("region"),
+        StringParameter("year"),
+        ListParameter(StringParameter(""), "models", required=False),
+        IntParameter("threshold", required=False),
+        DictParameter("variables", required=False),
+        DictParameter("functions", required=False),
+        DictParameter("constraints", required=False),
+    ]
+    outputs = [
+        RasterParameter("mean_out"),
+        RasterParameter("min_out"),
+        RasterParameter("count_out"),
+        ListParameter(StringParameter(""), "models"),
+    ]
 
-        if points:
-            for i, point in enumerate(points["points"]):
-                idx = ret["raster_out"].index(point[x_col], point[y_col])
-                value = ret["raster_out"][idx]
-                points_out[i]["score"] = value.item() if not is_masked(value) else 0
+    def get_models(self, region, year, names):
+        """Returns the climate models for which every variable in `names` is available"""
 
-            ret["points"] = points_out
+        models = None
+        prefix = f"{region}_"
+
+        for name in sorted(names - {"LAT"}):
+            suffix = f"_{year}SY_{name}"
+            service_names = Service.objects.filter(
+                name__startswith=prefix, name__endswith=suffix
+            ).values_list("name", flat=True)
+            found = {
+                n[len(prefix) : -len(suffix)]
+                for n in service_names
+                if len(n) > len(prefix) + len(suffix)
+            }
+            models = found if models is None else models & found
+
+        return sorted(models or [])
+
+    def execute(
+        self,
+        region,
+        year,
+        models=None,
+        threshold=None,
+        variables=[],
+        functions=[],
+        constraints=None,
+    ):
+        if threshold is None:
+            threshold = ENSEMBLE_THRESHOLD
+
+        if not models:
+            names = self.get_variable_names(variables, functions)
+            models = self.get_models(region, year, names)
+        if not models:
+            raise ValueError(f"No climate models are available for {year}")
+
+        scoring_window = self.get_scoring_window(region, constraints, None)
+        shape = scoring_window.window.shape
+
+        total = numpy.zeros(shape, "int32")
+        minimum = numpy.full(shape, 100, "int8")
+        count = numpy.zeros(shape, "int16")
+        scored = numpy.zeros(shape, bool)
+
+        for model in models:
+            raster, _ = self.score_scenario(
+                scoring_window, region, year, model, variables, functions
+            )
+
+            scores = raster.filled(0)
+            total += scores
+            numpy.minimum(minimum, scores, out=minimum)
+            count += scores > threshold
+            scored |= ~numpy.ma.getmaskarray(raster)
+
+            del raster, scores
+
+        extent = scoring_window.grid.get_window_extent(scoring_window.window)
+        mask = ~scored
+
+        mean = numpy.ma.masked_array(
+            (total / len(models)).astype("float32"), mask=mask, fill_value=-128
+        )
+        minimum = numpy.ma.masked_array(minimum, mask=mask, fill_value=-128)
+        count = numpy.ma.masked_array(count, mask=mask, fill_value=-128)
+
+        ret = ParameterCollection(self.outputs)
+        ret["mean_out"] = Raster(mean, extent, 1, 0, Y_INCREASING)
+        ret["min_out"] = Raster(minimum, extent, 1, 0, Y_INCREASING)
+        ret["count_out"] = Raster(count, extent, 1, 0, Y_INCREASING)
+
+        # Lets the results renderer scale counts to the number of models
+        ret["count_out"].model_count = len(models)
+        ret["models"] = list(models)
 
         return ret
@@ -0,0 +1,108 @@
+import numpy
+from django.conf import settings
+from rasterio.features import rasterize, shapes
+from shapely.geometry import shape
+
+from .summary import SQUARE_METERS_PER_HECTARE
+
+# Upper limit on the number of locations and patches a job may return
+MAX_TOP_K = getattr(settings, "SEEDSOURCE_MAX_TOP_K", 1000)
+
+# Cells scoring at least this are grouped into patches
+PATCH_MIN_SCORE = getattr(settings, "SEEDSOURCE_PATCH_MIN_SCORE", 75)
+
+
+def get_top_locations(scores, grid, k):
+    """
+    Returns the `k` highest scoring cells of a result, highest first, as dictionaries of `x`, `y` (the cell center)
+    and `score`.
+
+    :param scores: The masked int8 scores.
+    :param grid: The `Grid` of the scores.
+    """
+
+    valid = numpy.flatnonzero(~numpy.ma.getmaskarray(scores))
+    if not len(valid):
+        return []
+
+    values = numpy.ma.getdata(scores).ravel()[valid]
+    k = min(k, len(values))
+
+    # Only the top k need to be sorted
+    top = numpy.argpartition(values, len(values) - k)[len(values) - k :]
+    top = top[numpy.argsort(values[top], kind="stable")[::-1]]
+
+    rows, cols = numpy.unravel_index(valid[top], scores.shape)
+    coords = grid.coords
+
+    return [
+        {"x": round(float(x), 6), "y": round(float(y), 6), "score": int(score)}
+        for x, y, score in zip(
+            coords.x.values[cols], coords.y.values[rows], values[top]
+        )
+    ]
+
+
+def get_patches(scores, grid, k, min_score=PATCH_MIN_SCORE):
+    """
+    Returns the `k` largest patches of connected (including diagonally) cells scoring at least `min_score`, largest
+    first, as dictionaries of `x`, `y` (the area-weighted centroid), `area` (hectares), `cells` and `score` (the mean
+    score).
+
+    :param scores: The masked int8 scores.
+    :param grid: The `Grid` of the scores.
+    """
+
+    high = numpy.ma.filled(scores >= min_score, False).astype("uint8")
+    if not high.any():
+        return []
+
+    coords = grid.coords
+    transform = grid.affine
+
+    # Patches are labelled by polygonizing connected cells, so that only the largest patches
+    # need to be rasterized for their statistics
+    polygons = [
+        shape(geometry)
+        for geometry, _ in shapes(high, mask=high, connectivity=8, transform=transform)
+    ]
+    polygons.sort(key=lambda p: p.area, reverse=True)
+    polygons = polygons[:k]
+
+    labels = rasterize(
+        [(p, i) for i, p in enumerate(polygons, start=1)],
+        out_shape=scores.shape,
+        fill=0,
+        transform=transform,
+        dtype="int32",
+    )
+
+    in_patch = labels > 0
+    patch_labels = labels[in_patch]
+    rows, cols = numpy.nonzero(in_patch)
+    areas = grid.get_cell_areas()[rows]
+    num_bins = len(polygons) + 1
+
+    def weighted_sum(values):
+        return numpy.bincount(patch_labels, values * areas, minlength=num_bins)[1:]
+
+    patch_areas = weighted_sum(numpy.ones(len(rows)))
+    patch_scores = weighted_sum(numpy.ma.getdata(scores)[in_patch].astype("float64"))
+    patch_x = weighted_sum(coords.x.values[cols])
+    patch_y = weighted_sum(coords.y.values[rows])
+    patch_cells = numpy.bincount(patch_labels, minlength=num_bins)[1:]
+
+    patches = [
+        {
+            "x": round(float(patch_x[i] / patch_areas[i]), 6),
+            "y": round(float(patch_y[i] / patch_areas[i]), 6),
+            "area": round(float(patch_areas[i] / SQUARE_METERS_PER_HECTARE), 2),
+            "cells": int(patch_cells[i]),
+            "score": round(float(patch_scores[i] / patch_areas[i]), 1),
+        }
+        for i in range(len(polygons))
+        if patch_cells[i]
+    ]
+    patches.sort(key=lambda p: p["area"], reverse=True)
+
+    return patches
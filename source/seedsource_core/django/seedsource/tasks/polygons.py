@@ -0,0 +1,78 @@
+import json
+import secrets
+import zipfile
+
+import numpy
+import shapely
+from django.conf import settings
+from rasterio.features import shapes
+from shapely.geometry import MultiPolygon, mapping, shape
+
+from .summary import NUM_SCORES, SCORE_CLASSES
+
+
+def get_class_polygons(scores, grid, tolerance=None):
+    """
+    Returns a GeoJSON feature collection with a (multi)polygon for each score class of a result. Polygons are
+    simplified together, so that polygons of neighboring classes still share their edges.
+
+    :param scores: The masked int8 scores.
+    :param grid: The `Grid` of the scores.
+    :param tolerance: Simplification tolerance, in grid units. Defaults to half a cell.
+    """
+
+    if tolerance is None:
+        tolerance = min(grid.cell_size) / 2
+
+    bounds = list(SCORE_CLASSES) + [NUM_SCORES]
+    valid = ~numpy.ma.getmaskarray(scores)
+    classes = (
+        numpy.searchsorted(bounds, numpy.ma.getdata(scores), side="right") - 1
+    ).astype("uint8")
+
+    geometries = []
+    geometry_classes = []
+    for geometry, value in shapes(
+        classes, mask=valid, connectivity=4, transform=grid.affine
+    ):
+        geometries.append(shape(geometry))
+        geometry_classes.append(int(value))
+
+    if tolerance > 0 and geometries:
+        geometries = shapely.coverage_simplify(numpy.array(geometries), tolerance)
+
+    features = []
+    for i, (low, high) in enumerate(zip(bounds[:-1], bounds[1:])):
+        parts = []
+        for geometry, geometry_class in zip(geometries, geometry_classes):
+            if geometry_class == i and not geometry.is_empty:
+                parts.extend(getattr(geometry, "geoms", [geometry]))
+
+        if parts:
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": mapping(MultiPolygon(parts)),
+                    "properties": {"class": i, "min": low, "max": high - 1},
+                }
+            )
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_polygons(feature_collection):
+    """Writes a feature collection to a zip file in the download directory, and returns the file name"""
+
+    if not settings.DATASET_DOWNLOAD_DIR.exists():
+        settings.DATASET_DOWNLOAD_DIR.mkdir()
+
+    filename = settings.DATASET_DOWNLOAD_DIR / f"tmp{secrets.token_urlsafe(5)}.zip"
+
+    with zipfile.ZipFile(filename, mode="w") as zf:
+        zf.writestr(
+            "SST Results/results.geojson",
+            json.dumps(feature_collection),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+
+    return filename.name
@@ -0,0 +1,107 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from celery import current_task, shared_task
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+from ncdjango.models import ProcessingJob, ProcessingResultService
+
+from ..models import ScoreResult
+
+RESULT_CACHE_ENABLED = getattr(settings, "SEEDSOURCE_RESULT_CACHE", True)
+
+# Cached results are kept this long after they are recorded, even without a result service, since the job may still
+# be publishing its results
+RESULT_CACHE_GRACE_PERIOD = getattr(
+    settings, "SEEDSOURCE_RESULT_CACHE_GRACE_PERIOD", 3600
+)  # 1 hour
+
+# Cached results are reused for at most this long after they are recorded, however often they are used, so that their
+# result services are eventually removed
+RESULT_CACHE_MAX_AGE = getattr(
+    settings, "SEEDSOURCE_RESULT_CACHE_MAX_AGE", 7 * 24 * 3600
+)  # 1 week
+
+# Change when scoring changes, so that results from earlier versions are not reused
+RESULT_CACHE_VERSION = 7
+
+
+def get_inputs_hash(job_name, inputs, data_versions=None):
+    """
+    Returns a hash of job inputs, which is the same for any inputs that serialize to the same JSON. `data_versions`
+    identifies the source data read by the job (e.g., dataset modification times), so that results are not reused once
+    the data is republished.
+    """
+
+    canonical = json.dumps(
+        [RESULT_CACHE_VERSION, job_name, inputs, data_versions],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def get_current_job():
+    """Returns the `ProcessingJob` run by the current celery task, or None if not run by a job"""
+
+    if not current_task or not current_task.request.id:
+        return None
+
+    return ProcessingJob.objects.filter(celery_id=current_task.request.id).first()
+
+
+def get_cached_outputs(inputs_hash):
+    """
+    Returns the outputs of an earlier job with the same inputs, or None if there is no such job or its result service
+    has since been removed. Using a result postpones its removal by `cleanup_temporary_services`, until the result is
+    older than `RESULT_CACHE_MAX_AGE`.
+    """
+
+    try:
+        result = ScoreResult.objects.select_related("job").get(hash=inputs_hash)
+    except ScoreResult.DoesNotExist:
+        return None
+
+    if result.created < now() - timedelta(seconds=RESULT_CACHE_MAX_AGE):
+        result.delete()
+        return None
+
+    outputs = json.loads(result.job.outputs)
+
+    # The job is still running, or failed
+    if "raster_out" not in outputs:
+        return None
+
+    services = ProcessingResultService.objects.filter(
+        job=result.job, service__name=outputs["raster_out"]
+    )
+    if not services.exists():
+        result.delete()
+        return None
+
+    services.update(created=now())
+
+    return outputs
+
+
+def cache_result(inputs_hash, job):
+    """Records `job` as the source of results for `inputs_hash`"""
+
+    ScoreResult.objects.update_or_create(
+        hash=inputs_hash, defaults={"job": job, "created": now()}
+    )
+
+
+@shared_task
+def cleanup_score_results():
+    """Remove cached results which are too old to reuse, or whose result services have been removed"""
+
+    cutoff = now() - timedelta(seconds=RESULT_CACHE_GRACE_PERIOD)
+    services = ProcessingResultService.objects.filter(job=OuterRef("job"))
+
+    ScoreResult.objects.filter(created__lt=cutoff).exclude(Exists(services)).delete()
+    ScoreResult.objects.filter(
+        created__lt=now() - timedelta(seconds=RESULT_CACHE_MAX_AGE)
+    ).delete()
@@ -0,0 +1,797 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+
+import numpy
+from django.conf import settings
+from ncdjango.geoprocessing.evaluation import Lexer, Parser
+from netCDF4 import Dataset
+from trefoil.netcdf.variable import SpatialCoordinateVariables
+from trefoil.utilities.window import Window
+
+from .expressions import check_expression, compile_expression
+
+TILE_SIZE = getattr(settings, "SEEDSOURCE_SCORE_TILE_SIZE", 1024)
+# Tiles are scored in a pool of forked processes when this is more than 1. Celery's prefork
+# workers are daemonic and can't start child processes, so tiles are always scored in the
+# worker itself there; use a thread or solo pool to score with several processes.
+SCORE_PROCESSES = getattr(settings, "SEEDSOURCE_SCORE_PROCESSES", 1)
+
+# Once this many variables have been scored for a tile, the remaining variables are
+# calculated for only the cells which can still be scored, if few enough remain. Set to
+# None to always calculate full tiles.
+SPARSE_SCORING_AFTER = getattr(settings, "SEEDSOURCE_SPARSE_SCORING_AFTER", 2)
+SPARSE_SCORING_DENSITY = 0.25
+
+# Partial sums at or above this are certain to score below 0, since distances are never
+# negative
+MAX_PARTIAL_SUM = 10001
+
+# Cells anywhere in the grid (e.g., user sites) are read in groups, by the block of this many
+# rows and columns they fall in, so that the number of reads grows with the number of blocks
+# rather than the number of cells, and no read is larger than a block
+CELL_BLOCK_SIZE = getattr(settings, "SEEDSOURCE_CELL_BLOCK_SIZE", 256)
+
+# Change when the calculation of distances changes, so that cached distances are not reused
+DISTANCE_CACHE_VERSION = 1
+
+# Scorer used by each worker process in `score_tiles`
+_worker_scorer = None
+
+
+def iter_tiles(window, tile_size=TILE_SIZE):
+    """
+    Yields tiles (as windows of the grid) covering `window`. Tiles are aligned to multiples of `tile_size` on the
+    grid, so a given cell always falls in the same tile, regardless of the window.
+    """
+
+    y_start, y_stop = window.y_slice.start, window.y_slice.stop
+    x_start, x_stop = window.x_slice.start, window.x_slice.stop
+
+    for row in range(y_start - y_start % tile_size, y_stop, tile_size):
+        for col in range(x_start - x_start % tile_size, x_stop, tile_size):
+            yield Window(
+                (max(row, y_start), min(row + tile_size, y_stop)),
+                (max(col, x_start), min(col + tile_size, x_stop)),
+            )
+
+
+class BlockIndex(object):
+    """
+    The minimum and maximum value of each block of a variable, used to find windows in which no value can fall within
+    a limit. Indexes are stored next to the NetCDF dataset, and are ignored once the dataset is modified.
+    """
+
+    def __init__(self, block_size, min_values, max_values):
+        self.block_size = block_size
+        self.min_values = min_values
+        self.max_values = max_values
+
+    @staticmethod
+    def get_path(path):
+        return "{}.blocks.npz".format(os.path.splitext(path)[0])
+
+    @classmethod
+    def build(cls, source, block_size=256):
+        """Calculates the index for a `VariableSource`, reading one row of blocks at a time"""
+
+        height, width = source.shape
+        rows = math.ceil(height / block_size)
+        cols = math.ceil(width / block_size)
+        min_values = numpy.full((rows, cols), numpy.nan)
+        max_values = numpy.full((rows, cols), numpy.nan)
+
+        for row in range(rows):
+            y_start = row * block_size
+            y_stop = min(y_start + block_size, height)
+            data = numpy.ma.masked_invalid(
+                source.read(Window((y_start, y_stop), (0, width)))
+            )
+
+            # Pad to whole blocks, so that blocks can be reduced with a single reshape
+            blocks = numpy.ma.masked_all((block_size, cols * block_size), "float64")
+            blocks[: data.shape[0], :width] = data
+            blocks = blocks.reshape(block_size, cols, block_size)
+
+            min_values[row] = blocks.min(axis=(0, 2)).filled(numpy.nan)
+            max_values[row] = blocks.max(axis=(0, 2)).filled(numpy.nan)
+
+        return cls(block_size, min_values, max_values)
+
+    @classmethod
+    def load(cls, path):
+        """Returns the index for the dataset at `path`, or None if there is no current index"""
+
+        try:
+            with numpy.load(cls.get_path(path)) as f:
+                if f["mtime"] != os.path.getmtime(path):
+                    return None
+                return cls(int(f["block_size"]), f["min"], f["max"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path):
+        numpy.savez(
+            self.get_path(path),
+            block_size=self.block_size,
+            min=self.min_values,
+            max=self.max_values,
+            mtime=os.path.getmtime(path),
+        )
+
+    def get_range(self, window):
+        """Returns the (min, max) of the blocks overlapping `window`, or None if they have no data"""
+
+        y_slice = slice(
+            window.y_slice.start // self.block_size,
+            math.ceil(window.y_slice.stop / self.block_size),
+        )
+        x_slice = slice(
+            window.x_slice.start // self.block_size,
+            math.ceil(window.x_slice.stop / self.block_size),
+        )
+        min_values = self.min_values[y_slice, x_slice]
+        max_values = self.max_values[y_slice, x_slice]
+
+        if numpy.isnan(min_values).all():
+            return None
+
+        return numpy.nanmin(min_values), numpy.nanmax(max_values)
+
+
+class VariableSource(object):
+    """
+    Reads windows of a variable from a NetCDF dataset. Only the path and variable names are needed to recreate the
+    source, so it can be passed to other processes.
+    """
+
+    def __init__(self, path, variable, x_dimension, y_dimension):
+        self.path = path
+        self.variable = variable
+        self.x_dimension = x_dimension
+        self.y_dimension = y_dimension
+        self.dataset = None
+        self.block_index = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["dataset"] = None
+        return state
+
+    @property
+    def shape(self):
+        dimensions = self.open().dimensions
+        return len(dimensions[self.y_dimension]), len(dimensions[self.x_dimension])
+
+    def get_block_index(self):
+        """Returns the `BlockIndex` for this source, or None if it hasn't been built"""
+
+        if self.block_index is None:
+            self.block_index = BlockIndex.load(self.path) or False
+        return self.block_index or None
+
+    @property
+    def cache_key(self):
+        """Identifies the data read by this source, including the modification time of the dataset"""
+
+        return [self.path, self.variable, os.path.getmtime(self.path)]
+
+    def open(self):
+        if self.dataset is None:
+            self.dataset = Dataset(self.path)
+        return self.dataset
+
+    def close(self):
+        if self.dataset is not None and self.dataset.isopen():
+            self.dataset.close()
+        self.dataset = None
+
+    def read(self, window):
+        data = self.open().variables[self.variable]
+        dimensions = list(data.dimensions)
+        slices = []
+
+        for dimension in data.dimensions:
+            if dimension == self.y_dimension:
+                slices.append(window.y_slice)
+            elif dimension == self.x_dimension:
+                slices.append(window.x_slice)
+            else:
+                slices.append(0)
+                dimensions.remove(dimension)
+
+        data = data[tuple(slices)]
+
+        return data.transpose(
+            dimensions.index(self.y_dimension), dimensions.index(self.x_dimension)
+        )
+
+
+@lru_cache(maxsize=64)
+def get_latitudes(path, x_dimension, y_dimension, mtime):
+    """
+    Returns the latitude of each row of a dataset. Latitudes are cached by the modification time of the dataset, so
+    each region's coordinates are read once per process.
+    """
+
+    with Dataset(path) as dataset:
+        coords = SpatialCoordinateVariables.from_dataset(
+            dataset, x_name=x_dimension, y_name=y_dimension
+        )
+        latitudes = numpy.array(coords.y.values)
+
+    latitudes.flags.writeable = False
+    return latitudes
+
+
+class LatitudeSource(VariableSource):
+    """Creates latitude values for windows of a grid, from the coordinates of a dataset (e.g., the region DEM)"""
+
+    def __init__(self, path, x_dimension, y_dimension):
+        super().__init__(path, None, x_dimension, y_dimension)
+
+    def read(self, window):
+        latitudes = get_latitudes(
+            self.path, self.x_dimension, self.y_dimension, os.path.getmtime(self.path)
+        )
+        lat = latitudes[window.y_slice]
+
+        # A read-only view which repeats the latitude of each row, rather than a copy
+        return numpy.broadcast_to(lat.reshape(len(lat), 1), window.shape)
+
+    def get_block_index(self):
+        return None
+
+
+class TileData(object):
+    """
+    Holds the variables read for a tile, so that each variable is read at most once, however many variables and
+    functions reference it.
+    """
+
+    def __init__(self, sources, window):
+        self.sources = sources
+        self.window = window
+        self.data = {}
+        self.cell_data = {}
+
+    def get(self, name):
+        if name not in self.data:
+            self.data[name] = self.sources[name].read(self.window)
+        return self.data[name]
+
+    def get_cells(self, name, rows, cols):
+        """
+        Returns the values of a variable at arrays of rows and columns of the tile. Unless the variable has been read
+        for the full tile, only the window bounding the cells is read. It's kept for later cells within it, so that
+        as fewer cells remain to be scored, the variable is still read only once.
+        """
+
+        if name in self.data:
+            return sample_cells(self.data[name], rows, cols)
+        if not len(rows):
+            return numpy.ma.masked_all(0, "float32")
+
+        bounds = self.get_bounds(rows, cols)
+        held = self.cell_data.get(name)
+        if held is None or not self.covers(held[0], bounds):
+            y_offset, x_offset = self.window.y_slice.start, self.window.x_slice.start
+            window = Window(
+                (y_offset + bounds[0], y_offset + bounds[1]),
+                (x_offset + bounds[2], x_offset + bounds[3]),
+            )
+            held = self.cell_data[name] = (bounds, self.sources[name].read(window))
+
+        (row_start, _, col_start, _), data = held
+        return sample_cells(data, rows - row_start, cols - col_start)
+
+    def holds(self, name, rows, cols):
+        """Returns True if the values of a variable at arrays of rows and columns can be returned without a read"""
+
+        if name in self.data:
+            return True
+
+        held = self.cell_data.get(name)
+        return held is not None and (
+            not len(rows) or self.covers(held[0], self.get_bounds(rows, cols))
+        )
+
+    @staticmethod
+    def get_bounds(rows, cols):
+        return rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+
+    @staticmethod
+    def covers(bounds, other):
+        """Returns True if `bounds` (row start, row stop, column start, column stop) contains `other`"""
+
+        return (
+            bounds[0] <= other[0]
+            and bounds[1] >= other[1]
+            and bounds[2] <= other[2]
+            and bounds[3] >= other[3]
+        )
+
+    def keep(self, names):
+        """Releases all variables except `names`"""
+
+        self.data = {k: v for k, v in self.data.items() if k in names}
+        self.cell_data = {k: v for k, v in self.cell_data.items() if k in names}
+
+
+class CellData(object):
+    """
+    Holds the values of variables for a set of cells of a tile, as 1D arrays. If `fallback` is given, variables are
+    read from it, unless `tile_data` already holds their values at the cells.
+    """
+
+    def __init__(self, tile_data, rows, cols, fallback=None):
+        self.tile_data = tile_data
+        self.rows = rows
+        self.cols = cols
+        self.fallback = fallback
+        self.data = {}
+
+    def get(self, name):
+        if name not in self.data:
+            tile_data = self.tile_data
+            if self.fallback is not None and not tile_data.holds(
+                name, self.rows, self.cols
+            ):
+                tile_data = self.fallback
+            self.data[name] = tile_data.get_cells(name, self.rows, self.cols)
+        return self.data[name]
+
+
+class GridCellData(object):
+    """Holds the values of variables at arrays of rows and columns anywhere in the grid (e.g., user sites)"""
+
+    def __init__(self, sources, rows, cols):
+        self.sources = sources
+        self.rows = rows
+        self.cols = cols
+        self.data = {}
+
+    def get(self, name):
+        if name not in self.data:
+            self.data[name] = read_cells(self.sources[name].read, self.rows, self.cols)
+        return self.data[name]
+
+
+class TileScorer(object):
+    """
+    Calculates scores one tile at a time, so that only a tile's worth of data is held for each variable, rather than
+    the full window.
+    """
+
+    def __init__(self, variables, functions, sources, cache=None):
+        """
+        :param variables: List of variables (name and limit) to score.
+        :param functions: List of functions (name, fn and limit) to score. Functions may not use reductions (e.g.,
+            `mean`), which would differ from tile to tile; see `check_expression`.
+        :param sources: Dictionary of `VariableSource` objects by variable name, for every variable referenced by
+            `variables` or `functions`.
+        :param cache: Optional `ArrayCache` used to store the distances calculated for each variable and function, so
+            that they can be reused by later jobs with the same data and limits.
+        """
+
+        for item in functions:
+            check_expression(item["fn"])
+
+        self.variables = variables
+        self.functions = functions
+        self.sources = sources
+        self.cache = cache
+        self.parser = None
+
+        # Variables referenced by each item, in order of `variables + functions`
+        self.item_names = [
+            (
+                sorted(Lexer().get_names(item["fn"]) - {"math_e"})
+                if "fn" in item
+                else [item["name"]]
+            )
+            for item in variables + functions
+        ]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["parser"] = None
+        return state
+
+    def close(self):
+        for source in self.sources.values():
+            source.close()
+
+    def evaluate_function(self, fn, data):
+        def loader_fn(variable):
+            def load():
+                return data.get(variable)
+
+            return load
+
+        context = {
+            **{name: loader_fn(name) for name in self.sources},
+            "math_e": math.e,
+        }
+
+        # Arithmetic expressions are compiled once per process, and fall back to the
+        # ncdjango parser for anything else
+        expression = compile_expression(fn)
+        if expression is not None:
+            return expression.evaluate(context)
+
+        if self.parser is None:
+            self.parser = Parser()
+        return self.parser.evaluate(fn, context)
+
+    def read_item(self, item, data):
+        """Returns the values of a variable or function, from the variables held by a `TileData`"""
+
+        if "fn" in item:
+            return self.evaluate_function(item["fn"], data)
+        return data.get(item["name"])
+
+    def can_score(self, window):
+        """
+        Returns False if no cell in the window can be scored, because the range of some variable in the window falls
+        entirely outside its limits. Variables without a block index are assumed to be within their limits.
+        """
+
+        for item in self.variables:
+            block_index = self.sources[item["name"]].get_block_index()
+            if block_index is None:
+                continue
+
+            value_range = block_index.get_range(window)
+            if value_range is None:
+                return False
+
+            min_value, max_value = value_range
+            if max_value < item["limit"]["min"] or min_value > item["limit"]["max"]:
+                return False
+
+        return True
+
+    def get_item_order(self, window):
+        """
+        Returns the indices of items (variables, then functions) in the order they should be scored. Variables with
+        the narrowest limits relative to their range in the window come first, since they mask the most cells.
+        Variables without a block index, and functions, keep their order after those.
+        """
+
+        items = self.variables + self.functions
+
+        def get_selectivity(index):
+            item = items[index]
+
+            if "fn" not in item:
+                block_index = self.sources[item["name"]].get_block_index()
+                value_range = block_index.get_range(window) if block_index else None
+
+                if value_range is not None and value_range[1] > value_range[0]:
+                    width = item["limit"]["max"] - item["limit"]["min"]
+                    return 0, width / (value_range[1] - value_range[0]), index
+
+            return 1, 0, index
+
+        return sorted(range(len(items)), key=get_selectivity)
+
+    def get_cache_key(self, item, names, window):
+        return [
+            DISTANCE_CACHE_VERSION,
+            item.get("fn", item["name"]),
+            item["limit"]["min"],
+            item["limit"]["max"],
+            [self.sources[name].cache_key for name in names],
+            [int(window.y_slice.start), int(window.y_slice.stop)],
+            [int(window.x_slice.start), int(window.x_slice.stop)],
+        ]
+
+    @staticmethod
+    def calculate_distances(data, limit):
+        """
+        Returns the squared distance of each value from the midpoint of `limit`, scaled so that the limits are at 100.
+        Values which are masked or outside the limits are infinite, so that they are excluded from any sum.
+        """
+
+        limit_min = limit["min"]
+        limit_max = limit["max"]
+        half = (limit_max - limit_min) / 2
+        midpoint = limit_min + half
+        factor = 100 / half
+        mid_factor = factor * midpoint
+
+        values = numpy.ma.getdata(data)
+        invalid = numpy.ma.getmaskarray(data) | (values < limit_min)
+        invalid |= values > limit_max
+
+        distances = values.astype("float32")
+        distances *= factor
+        distances -= mid_factor
+        distances **= 2
+        distances = numpy.floor(distances, distances)
+        numpy.putmask(distances, invalid, numpy.inf)
+
+        return distances
+
+    def get_normalized_distances(self, window, mask):
+        """
+        Returns the sum over variables and functions of the squared distance of each value from the midpoint of its
+        limits, in units of the half-width of the limits, as float32. A cell is within limits scaled by `m` when the
+        sum is at most `m**2`. Masked cells are infinite.
+        """
+
+        totals = numpy.zeros(window.shape, "float32")
+        tile_data = TileData(self.sources, window)
+        items = self.variables + self.functions
+        order = self.get_item_order(window)
+
+        for position, index in enumerate(order):
+            item = items[index]
+            limit = item["limit"]
+            half = (limit["max"] - limit["min"]) / 2
+            midpoint = limit["min"] + half
+
+            data = self.read_item(item, tile_data)
+            distances = numpy.ma.getdata(data).astype("float32")
+            distances -= midpoint
+            distances /= half
+            distances **= 2
+            numpy.putmask(distances, numpy.ma.getmaskarray(data), numpy.inf)
+            del data
+
+            totals += distances
+            del distances
+
+            tile_data.keep(
+                set().union(*(self.item_names[i] for i in order[position + 1 :]))
+            )
+
+        numpy.putmask(totals, mask, numpy.inf)
+
+        return totals
+
+    def score(self, window, mask, points=None):
+        """
+        Scores a tile.
+
+        :param window: The tile, as a window of the region grid.
+        :param mask: The constraint mask for the tile.
+        :param points: Optional tuple of (rows, cols) arrays for user sites within the tile. Rows and columns are
+            relative to the tile.
+        :return: A tuple of (scores, values). Scores is a masked int8 array, and values is a dictionary of
+            {item name: values}, with the unconstrained value of each variable and function at each point.
+        """
+
+        sum_rasters = numpy.zeros(window.shape, "float32")
+        values = {}
+        tile_data = TileData(self.sources, window)
+        items = self.variables + self.functions
+        order = self.get_item_order(window)
+
+        # Values at user sites are taken from the data already read for the tile where
+        # possible. Others are read separately, for only the window around the sites.
+        point_data = TileData(self.sources, window)
+
+        # Cells which may still be scored
+        active = ~mask
+        active_cells = None
+
+        if points is not None and not len(points[0]):
+            points = None
+
+        for position, index in enumerate(order):
+            item = items[index]
+            names = self.item_names[index]
+            key = None
+            distances = None
+            if self.cache is not None:
+                key = self.get_cache_key(item, names, window)
+                distances = self.cache.get(key)
+
+            if distances is None and active_cells is None:
+                if (
+                    SPARSE_SCORING_AFTER is not None
+                    and position >= SPARSE_SCORING_AFTER
+                    and numpy.count_nonzero(active)
+                    <= active.size * SPARSE_SCORING_DENSITY
+                ):
+                    active_cells = numpy.nonzero(active)
+
+            if distances is None and active_cells is not None:
+                # Calculate only the cells which can still be scored. These distances
+                # depend on the cells ruled out by earlier items, so they aren't cached.
+                data = self.read_item(item, CellData(tile_data, *active_cells))
+                cell_distances = self.calculate_distances(data, item["limit"])
+                del data
+
+                if points is not None:
+                    values[item["name"]] = self.read_item(
+                        item, CellData(tile_data, *points, fallback=point_data)
+                    )
+
+                cell_sums = sum_rasters[active_cells]
+                cell_sums += cell_distances
+                sum_rasters[active_cells] = cell_sums
+                del cell_distances
+
+                still_active = cell_sums < MAX_PARTIAL_SUM
+                active_cells = tuple(a[still_active] for a in active_cells)
+                del cell_sums, still_active
+            else:
+                if distances is None:
+                    data = self.read_item(item, tile_data)
+
+                    if points is not None:
+                        values[item["name"]] = sample_cells(data, *points)
+
+                    distances = self.calculate_distances(data, item["limit"])
+                    del data
+
+                    if key is not None:
+                        self.cache.set(key, distances)
+                elif points is not None:
+                    values[item["name"]] = self.read_item(
+                        item, CellData(tile_data, *points, fallback=point_data)
+                    )
+
+                sum_rasters += distances
+                del distances
+
+                if active_cells is None:
+                    active &= sum_rasters < MAX_PARTIAL_SUM
+                else:
+                    still_active = sum_rasters[active_cells] < MAX_PARTIAL_SUM
+                    active_cells = tuple(a[still_active] for a in active_cells)
+
+            # Release variables which aren't referenced by the remaining items
+            tile_data.keep(
+                set().union(*(self.item_names[i] for i in order[position + 1 :]))
+            )
+
+        return self.get_scores(sum_rasters, mask), values
+
+    def read_cells(self, rows, cols):
+        """
+        Returns the values of each variable and function at cells of the grid, without scoring them, as a dictionary
+        of {item name: values}. Each variable is read with `read_cells`.
+        """
+
+        data = GridCellData(self.sources, rows, cols)
+        return {
+            item["name"]: self.read_item(item, data)
+            for item in self.variables + self.functions
+        }
+
+    def score_cells(self, rows, cols, mask):
+        """
+        Scores individual cells of the grid, such as those under user sites. Each variable is read with `read_cells`,
+        rather than reading a tile around each cell.
+
+        :param rows: Array of the row of each cell.
+        :param cols: Array of the column of each cell.
+        :param mask: The constraint mask at each cell.
+        :return: A tuple of (scores, values), as for `score`, with one score and value per cell.
+        """
+
+        sum_rasters = numpy.zeros(len(rows), "float32")
+        values = {}
+        data = GridCellData(self.sources, rows, cols)
+
+        for item in self.variables + self.functions:
+            values[item["name"]] = self.read_item(item, data)
+            sum_rasters += self.calculate_distances(values[item["name"]], item["limit"])
+
+        return self.get_scores(sum_rasters, mask), values
+
+    @staticmethod
+    def get_scores(sum_rasters, mask):
+        """Returns scores from the sum of distances of each cell, which is modified in place"""
+
+        sum_rasters += 0.4
+        sum_rasters **= 0.5
+
+        sum_masks = mask | (sum_rasters > 100)
+        numpy.putmask(sum_rasters, sum_masks, 100)
+        scores = 100 - sum_rasters.astype("int8")
+
+        return numpy.ma.masked_array(scores, mask=sum_masks)
+
+
+def sample_cells(data, rows, cols):
+    """Returns a masked array of the values of `data` at arrays of rows and columns"""
+
+    return numpy.ma.masked_array(
+        numpy.ma.getdata(data)[rows, cols], mask=numpy.ma.getmaskarray(data)[rows, cols]
+    )
+
+
+def read_cells(read, rows, cols, block_size=None):
+    """
+    Returns a masked array of the values at arrays of rows and columns of the grid. Cells are grouped by the block of
+    `block_size` rows and columns they fall in, and the window bounding the cells of each block is read once.
+
+    :param read: A function which returns the data for a window of the grid, such as `VariableSource.read`.
+    :param block_size: The size of blocks, which limits the size of each read. Defaults to `CELL_BLOCK_SIZE`.
+    """
+
+    if block_size is None:
+        block_size = CELL_BLOCK_SIZE
+
+    rows = numpy.asarray(rows, "int64")
+    cols = numpy.asarray(cols, "int64")
+    if not len(rows):
+        return numpy.ma.masked_all(0, "float32")
+
+    blocks = (rows // block_size) * (cols.max() // block_size + 1) + cols // block_size
+    order = numpy.argsort(blocks, kind="stable")
+    starts = numpy.flatnonzero(numpy.diff(blocks[order])) + 1
+    values = None
+
+    for indices in numpy.split(order, starts):
+        block_rows = rows[indices]
+        block_cols = cols[indices]
+        row_start, col_start = block_rows.min(), block_cols.min()
+        window = Window(
+            (row_start, block_rows.max() + 1), (col_start, block_cols.max() + 1)
+        )
+        block_values = sample_cells(
+            read(window), block_rows - row_start, block_cols - col_start
+        )
+
+        if values is None:
+            values = numpy.ma.masked_all(len(rows), block_values.dtype)
+        values[indices] = block_values
+
+    return values
+
+
+def _init_worker(scorer):
+    global _worker_scorer
+    _worker_scorer = scorer
+
+
+def _score_tile(window, mask, points):
+    return (window,) + _worker_scorer.score(window, mask, points)
+
+
+def score_tiles(scorer, tiles, processes=SCORE_PROCESSES):
+    """
+    Scores tiles with a `TileScorer`, either in this process or spread across a pool of worker processes. Each
+    worker opens its own datasets and reads its own tile windows, so only masks and int8 scores are passed between
+    processes.
+
+    :param scorer: The `TileScorer` to use.
+    :param tiles: Iterable of (window, mask, points) for each tile.
+    :param processes: Number of worker processes. If 1 or less, or if this is a daemonic process (such as a Celery
+        prefork worker), tiles are scored in this process.
+    :return: A generator yielding (window, scores, values) for each tile, in order of completion.
+    """
+
+    if processes <= 1 or multiprocessing.current_process().daemon:
+        for window, mask, points in tiles:
+            yield (window,) + scorer.score(window, mask, points)
+        return
+
+    # Workers are forked, so they don't need to set up Django again. Limit the number of
+    # tiles in flight to keep memory bounded.
+    with ProcessPoolExecutor(
+        processes,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(scorer,),
+    ) as executor:
+        pending = set()
+
+        for tile in tiles:
+            if len(pending) >= processes * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+            pending.add(executor.submit(_score_tile, *tile))
+
+        for future in wait(pending).done:
+            yield future.result()
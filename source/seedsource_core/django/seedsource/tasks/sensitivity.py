@@ -0,0 +1,102 @@
+import numpy
+from django.conf import settings
+from ncdjango.geoprocessing.params import (
+    DictParameter,
+    ListParameter,
+    NumberParameter,
+    ParameterCollection,
+    StringParameter,
+)
+
+from .generate_scores import GenerateScores
+from .scoring import iter_tiles
+from .summary import SQUARE_METERS_PER_HECTARE
+
+# Multipliers of the transfer limits to report suitable area for
+SENSITIVITY_MULTIPLIERS = getattr(
+    settings,
+    "SEEDSOURCE_SENSITIVITY_MULTIPLIERS",
+    (0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 2.5, 3),
+)
+
+
+class TransferLimitSensitivity(GenerateScores):
+    """
+    Calculates the suitable area for the same variables, functions and constraints as `GenerateScores`, with all
+    transfer limits scaled by each of several multipliers. The normalized climate distance of each cell is calculated
+    once, and binned by the squared multipliers, so the whole curve takes a single read of the data.
+
+    A cell is suitable for multiplier `m` when its normalized distance is at most `m**2`. For `m = 1`, this matches
+    the cells scored by `GenerateScores`, other than a few at the edge of the limits, which `GenerateScores` includes
+    since it rounds distances down.
+    """
+
+    name = "sst:transfer_limit_sensitivity"
+    inputs = [
+        StringParameter("region"),
+        StringParameter("year"),
+        StringParameter("model", required=False),
+        DictParameter("variables", required=False),
+        DictParameter("functions", required=False),
+        DictParameter("constraints", required=False),
+        ListParameter(NumberParameter(""), "multipliers", required=False),
+    ]
+    outputs = [DictParameter("sensitivity")]
+
+    def execute(
+        self,
+        region,
+        year,
+        model=None,
+        variables=[],
+        functions=[],
+        constraints=None,
+        multipliers=None,
+    ):
+        if not multipliers:
+            multipliers = SENSITIVITY_MULTIPLIERS
+
+        multipliers = numpy.unique(numpy.asarray(multipliers, "float64"))
+        if (multipliers <= 0).any():
+            raise ValueError("Multipliers must be greater than 0")
+
+        thresholds = (multipliers**2).astype("float32")
+
+        scoring_window = self.get_scoring_window(region, constraints, None)
+        grid = scoring_window.grid
+        constraint_mask = scoring_window.constraint_mask
+        scorer = self.get_scorer(region, year, model, variables, functions)
+
+        # Area of cells by the index of the smallest multiplier they're suitable for. The last
+        # bin holds cells which aren't suitable for any multiplier.
+        bin_areas = numpy.zeros(len(thresholds) + 1, "float64")
+
+        try:
+            for tile in iter_tiles(scoring_window.window):
+                tile_mask = constraint_mask.get_mask(tile)
+                if tile_mask.all():
+                    continue
+
+                distances = scorer.get_normalized_distances(tile, tile_mask)
+                valid = distances <= thresholds[-1]
+                if not valid.any():
+                    continue
+
+                bins = numpy.searchsorted(thresholds, distances[valid], side="left")
+                weights = numpy.broadcast_to(
+                    grid.get_cell_areas(tile)[:, None], tile.shape
+                )[valid]
+                bin_areas += numpy.bincount(bins, weights, minlength=len(bin_areas))
+        finally:
+            scorer.close()
+
+        areas = numpy.cumsum(bin_areas[:-1]) / SQUARE_METERS_PER_HECTARE
+
+        ret = ParameterCollection(self.outputs)
+        ret["sensitivity"] = {
+            "units": "hectares",
+            "multipliers": multipliers.tolist(),
+            "areas": [round(float(area), 2) for area in areas],
+        }
+
+        return ret
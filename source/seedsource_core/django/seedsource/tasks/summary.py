@@ -0,0 +1,116 @@
+from collections import defaultdict
+
+import numpy
+from django.conf import settings
+from rasterio.features import rasterize
+from shapely.geometry import box
+
+# Lower bound of each score class. Each class extends to the next bound, and the last class extends to 100.
+SCORE_CLASSES = getattr(settings, "SEEDSOURCE_SCORE_CLASSES", (0, 25, 50, 75))
+
+NUM_SCORES = 101
+SQUARE_METERS_PER_HECTARE = 10000
+
+
+class AreaSummary(object):
+    """
+    Accumulates the area of scored cells in each score class, for the whole result and within each seed zone. Tiles
+    are added as they are scored, so the summary doesn't need another pass over the result.
+    """
+
+    def __init__(self, grid, zones=()):
+        """
+        :param grid: The region `Grid`, used to calculate cell areas.
+        :param zones: Seed zones to summarize, as dictionaries with `zone_uid`, `name`, `source` and `geometry` (a
+            shapely geometry in the grid projection). Zones from the same source are assumed not to overlap.
+        """
+
+        self.grid = grid
+        self.zones = list(zones)
+        self.areas = numpy.zeros(NUM_SCORES, "float64")
+        self.zone_areas = numpy.zeros((len(self.zones), NUM_SCORES), "float64")
+
+        # Zones from the same source are rasterized together, since they don't overlap
+        self.zone_groups = defaultdict(list)
+        for i, zone in enumerate(self.zones):
+            self.zone_groups[zone["source"]].append(i)
+
+    def get_zone_labels(self, indices, window):
+        """Returns an array of zone index + 1 for each cell in the window, or 0 for cells outside of zones"""
+
+        subgrid = self.grid.get_subgrid(window)
+        extent = box(*subgrid.extent.as_list())
+        shapes = [
+            (self.zones[i]["geometry"], i + 1)
+            for i in indices
+            if self.zones[i]["geometry"].intersects(extent)
+        ]
+
+        if not shapes:
+            return None
+
+        return rasterize(
+            shapes,
+            out_shape=subgrid.shape,
+            fill=0,
+            transform=subgrid.affine,
+            dtype="int32",
+        )
+
+    def add(self, window, scores):
+        """Adds a tile of (masked) scores for a window of the grid"""
+
+        valid = ~numpy.ma.getmaskarray(scores)
+        if not valid.any():
+            return
+
+        values = numpy.ma.getdata(scores)[valid].astype("intp")
+        weights = numpy.broadcast_to(
+            self.grid.get_cell_areas(window)[:, None], scores.shape
+        )[valid]
+
+        self.areas += numpy.bincount(values, weights, minlength=NUM_SCORES)
+
+        for indices in self.zone_groups.values():
+            labels = self.get_zone_labels(indices, window)
+            if labels is None:
+                continue
+
+            labels = labels[valid]
+            in_zone = labels > 0
+            if not in_zone.any():
+                continue
+
+            bins = (labels[in_zone] - 1) * NUM_SCORES + values[in_zone]
+            self.zone_areas += numpy.bincount(
+                bins, weights[in_zone], minlength=self.zone_areas.size
+            ).reshape(self.zone_areas.shape)
+
+    @staticmethod
+    def get_classes(areas):
+        bounds = list(SCORE_CLASSES) + [NUM_SCORES]
+        totals = numpy.add.reduceat(areas, bounds[:-1]) / SQUARE_METERS_PER_HECTARE
+
+        return [
+            {"min": low, "max": high - 1, "area": round(float(area), 2)}
+            for low, high, area in zip(bounds[:-1], bounds[1:], totals)
+        ]
+
+    def to_dict(self):
+        """Returns the summary in hectares, omitting zones without any scored cells"""
+
+        return {
+            "units": "hectares",
+            "total": round(float(self.areas.sum() / SQUARE_METERS_PER_HECTARE), 2),
+            "classes": self.get_classes(self.areas),
+            "zones": [
+                {
+                    "zone_uid": zone["zone_uid"],
+                    "name": zone["name"],
+                    "total": round(float(areas.sum() / SQUARE_METERS_PER_HECTARE), 2),
+                    "classes": self.get_classes(areas),
+                }
+                for zone, areas in zip(self.zones, self.zone_areas)
+                if areas.any()
+            ],
+        }
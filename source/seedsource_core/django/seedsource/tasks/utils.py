@@ -1,10 +1,187 @@
 import numpy
+from affine import Affine
+from trefoil.geometry.bbox import BBox
+from trefoil.netcdf.variable import SpatialCoordinateVariables
+from trefoil.utilities.window import Window
 
+# Radius of a sphere with the same surface area as the WGS84 ellipsoid, in meters
+EARTH_RADIUS = 6371007.2
 
-def create_latitude_data(coords):
-    """ Given spatial coordinates, create a 2D grid of latitude values to match """
 
-    lat = coords.y.values
-    lon = coords.x.values
+def intersect_windows(a, b):
+    """Returns the intersection of two windows, or None if they don't overlap"""
 
-    return numpy.tile(lat.reshape(len(lat), 1), (1, len(lon)))
+    y_start = max(a.y_slice.start, b.y_slice.start)
+    y_stop = min(a.y_slice.stop, b.y_slice.stop)
+    x_start = max(a.x_slice.start, b.x_slice.start)
+    x_stop = min(a.x_slice.stop, b.x_slice.stop)
+
+    if y_start >= y_stop or x_start >= x_stop:
+        return None
+
+    return Window((y_start, y_stop), (x_start, x_stop))
+
+
+def offset_window(window, origin):
+    """Returns `window` relative to the start of the `origin` window"""
+
+    y_offset, x_offset = origin.y_slice.start, origin.x_slice.start
+
+    return Window(
+        (window.y_slice.start - y_offset, window.y_slice.stop - y_offset),
+        (window.x_slice.start - x_offset, window.x_slice.stop - x_offset),
+    )
+
+
+class Grid(object):
+    """
+    Describes a raster grid (extent, shape and row order) without holding any data. Provides the same spatial
+    attributes as `Raster`, so it can be used in place of one where only the grid is needed (e.g., constraints).
+    """
+
+    x_dim = 1
+    y_dim = 0
+
+    def __init__(self, extent, shape, y_increasing=False):
+        self.extent = extent
+        self.shape = tuple(shape)
+        self.y_increasing = y_increasing
+
+    @property
+    def cell_size(self):
+        return self.extent.width / self.shape[1], self.extent.height / self.shape[0]
+
+    @property
+    def coords(self):
+        # Single precision coordinates drift by several cells across a large region
+        return SpatialCoordinateVariables.from_bbox(
+            self.extent,
+            *reversed(self.shape),
+            y_ascending=self.y_increasing,
+            dtype="float64",
+        )
+
+    @property
+    def affine(self):
+        """The affine transform of the grid. Unlike `coords.affine`, this is also defined for a single row or column."""
+
+        cell_x, cell_y = self.cell_size
+
+        if self.y_increasing:
+            return Affine(cell_x, 0, self.extent.xmin, 0, cell_y, self.extent.ymin)
+        return Affine(cell_x, 0, self.extent.xmin, 0, -cell_y, self.extent.ymax)
+
+    @property
+    def window(self):
+        """A window covering the whole grid"""
+
+        return Window((0, self.shape[0]), (0, self.shape[1]))
+
+    def get_window_extent(self, window):
+        """Returns the extent of a window of this grid"""
+
+        cell_x, cell_y = self.cell_size
+        xmin = self.extent.xmin + window.x_slice.start * cell_x
+        xmax = self.extent.xmin + window.x_slice.stop * cell_x
+
+        if self.y_increasing:
+            ymin = self.extent.ymin + window.y_slice.start * cell_y
+            ymax = self.extent.ymin + window.y_slice.stop * cell_y
+        else:
+            ymin = self.extent.ymax - window.y_slice.stop * cell_y
+            ymax = self.extent.ymax - window.y_slice.start * cell_y
+
+        return BBox((xmin, ymin, xmax, ymax), projection=self.extent.projection)
+
+    def get_cell_areas(self, window=None):
+        """
+        Returns the area of cells in each row of a window of a geographic (lat/lon) grid, in square meters. Cells in a
+        row have the same area, so a 1D array with one value per row is returned.
+        """
+
+        if window is None:
+            window = self.window
+
+        cell_x, _ = self.cell_size
+        extent = self.get_window_extent(window)
+        edges = numpy.radians(
+            numpy.linspace(extent.ymin, extent.ymax, window.shape[0] + 1)
+        )
+        areas = EARTH_RADIUS**2 * numpy.radians(cell_x) * numpy.diff(numpy.sin(edges))
+
+        return areas if self.y_increasing else areas[::-1]
+
+    def get_bounds_window(self, xmin, ymin, xmax, ymax, padding=0):
+        """
+        Returns the window of cells which intersect a bounding box, grown by `padding` cells on each side and clipped
+        to the grid. The window may be empty if the bounding box is outside of the grid.
+        """
+
+        cell_x, cell_y = self.cell_size
+        height, width = self.shape
+        extent = self.extent
+
+        x_start = int(numpy.floor((xmin - extent.xmin) / cell_x)) - padding
+        x_stop = int(numpy.ceil((xmax - extent.xmin) / cell_x)) + padding
+        y_start = int(numpy.floor((ymin - extent.ymin) / cell_y)) - padding
+        y_stop = int(numpy.ceil((ymax - extent.ymin) / cell_y)) + padding
+
+        if not self.y_increasing:
+            y_start, y_stop = height - y_stop, height - y_start
+
+        x_start, x_stop = min(max(x_start, 0), width), min(max(x_stop, 0), width)
+        y_start, y_stop = min(max(y_start, 0), height), min(max(y_stop, 0), height)
+
+        return Window((y_start, max(y_start, y_stop)), (x_start, max(x_start, x_stop)))
+
+    def get_extent_window(self, extent):
+        """
+        Returns the window of this grid which covers an extent aligned to its cells, such as that of a subgrid, or
+        None if the extent isn't within the grid.
+        """
+
+        cell_x, cell_y = self.cell_size
+        height = self.shape[0]
+
+        x_start = int(round((extent.xmin - self.extent.xmin) / cell_x))
+        x_stop = int(round((extent.xmax - self.extent.xmin) / cell_x))
+        y_start = int(round((extent.ymin - self.extent.ymin) / cell_y))
+        y_stop = int(round((extent.ymax - self.extent.ymin) / cell_y))
+
+        if not self.y_increasing:
+            y_start, y_stop = height - y_stop, height - y_start
+
+        if min(x_start, y_start) < 0 or x_stop > self.shape[1] or y_stop > height:
+            return None
+
+        return Window((y_start, y_stop), (x_start, x_stop))
+
+    def get_subgrid(self, window):
+        return Grid(self.get_window_extent(window), window.shape, self.y_increasing)
+
+    def get_indices(self, x, y):
+        """
+        Returns the rows and columns of the cells containing arrays of geographic coordinates, and a boolean array
+        which is True for coordinates inside the grid. Rows and columns of coordinates outside the grid are clipped to
+        the grid edge.
+        """
+
+        x = numpy.asarray(x, "float64")
+        y = numpy.asarray(y, "float64")
+        extent = self.extent
+
+        inside = (x >= extent.xmin) & (x <= extent.xmax)
+        inside &= (y >= extent.ymin) & (y <= extent.ymax)
+
+        cell_x, cell_y = self.cell_size
+        cols = numpy.clip(
+            ((x - extent.xmin) / cell_x).astype("int64"), 0, self.shape[1] - 1
+        )
+        rows = numpy.clip(
+            ((y - extent.ymin) / cell_y).astype("int64"), 0, self.shape[0] - 1
+        )
+
+        if not self.y_increasing:
+            rows = self.shape[0] - rows - 1
+
+        return rows, cols, inside
@@ -0,0 +1,160 @@
+from functools import partial
+from types import SimpleNamespace
+
+import numpy
+import pyproj
+import pytest
+from netCDF4 import Dataset
+from trefoil.geometry.bbox import BBox
+
+from seedsource_core.django.seedsource.tasks import constraints, generate_scores
+from seedsource_core.django.seedsource.tasks.scoring import VariableSource, iter_tiles
+from seedsource_core.django.seedsource.tasks.utils import Grid
+
+WGS84 = pyproj.Proj("+proj=longlat +datum=WGS84 +no_defs")
+
+
+class VariableSet(list):
+    def first(self):
+        return self[0]
+
+
+class ServiceStub(object):
+    """Stands in for an ncdjango `Service` backed by a dataset written by `make_source`"""
+
+    class DoesNotExist(Exception):
+        pass
+
+    def __init__(self, source, extent):
+        self.data_path = source.path
+        self.full_extent = extent
+        self.variable_set = VariableSet(
+            [
+                SimpleNamespace(
+                    variable=source.variable,
+                    x_dimension=source.x_dimension,
+                    y_dimension=source.y_dimension,
+                    full_extent=extent,
+                )
+            ]
+        )
+
+
+@pytest.fixture
+def grid():
+    """A 200 x 300 geographic grid, with rows in order of increasing latitude"""
+
+    return Grid(BBox((-120, 40, -110, 47), projection=WGS84), (200, 300), True)
+
+
+@pytest.fixture
+def make_source(tmp_path, grid):
+    """Returns a function which writes a 2D array to a NetCDF dataset on `grid`, and returns a `VariableSource` for it"""
+
+    def make_source(name, data, filename=None):
+        coords = grid.coords
+        path = str(tmp_path / "{}.nc".format(filename or name))
+
+        with Dataset(path, "w") as dataset:
+            dataset.createDimension("lat", grid.shape[0])
+            dataset.createDimension("lon", grid.shape[1])
+            dataset.createVariable("lat", "f8", ("lat",))[:] = coords.y.values
+            dataset.createVariable("lon", "f8", ("lon",))[:] = coords.x.values
+            variable = dataset.createVariable(
+                name, data.dtype, ("lat", "lon"), fill_value=-9999
+            )
+            variable[:] = data
+
+        return VariableSource(path, name, "lon", "lat")
+
+    return make_source
+
+
+@pytest.fixture
+def climate(grid, make_source):
+    """Sources for two smoothly varying variables, `a` and `b`, with a masked corner"""
+
+    rows, cols = numpy.indices(grid.shape)
+    mask = (rows > 180) & (cols < 20)
+
+    return {
+        "a": make_source(
+            "a", numpy.ma.masked_array((rows / 10 + cols / 20).astype("float32"), mask)
+        ),
+        "b": make_source(
+            "b",
+            numpy.ma.masked_array(
+                (numpy.sin(rows / 30) * 10 + cols / 15).astype("float32"), mask
+            ),
+        ),
+    }
+
+
+@pytest.fixture
+def services(grid, monkeypatch):
+    """
+    A dictionary of {name: `VariableSource`} used in place of services by constraints. Datasets are assumed to cover
+    `grid`.
+    """
+
+    services = {}
+
+    def get(name):
+        try:
+            return ServiceStub(services[name], grid.extent)
+        except KeyError:
+            raise ServiceStub.DoesNotExist(name)
+
+    monkeypatch.setattr(
+        constraints,
+        "Service",
+        SimpleNamespace(
+            objects=SimpleNamespace(get=get), DoesNotExist=ServiceStub.DoesNotExist
+        ),
+    )
+
+    return services
+
+
+@pytest.fixture
+def dem(grid, make_source, services):
+    """A DEM for the `test` region, rising from 0 m in the southwest corner to 2,490 m in the northeast"""
+
+    rows, cols = numpy.indices(grid.shape)
+    services["test_dem"] = make_source(
+        "elevation", (rows * 5 + cols * 5).astype("int16")
+    )
+
+    return services["test_dem"]
+
+
+@pytest.fixture
+def make_task(grid, climate, monkeypatch):
+    """
+    Returns a function which creates a scoring task for the `test` region on `grid`, with caches disabled and small
+    tiles. Variables are read from `climate` for any year and model, unless `get_source(variable, model)` is given.
+    """
+
+    monkeypatch.setattr(generate_scores, "DISTANCE_CACHE_DIR", None)
+    monkeypatch.setattr(constraints, "CONSTRAINT_CACHE_DIR", None)
+    monkeypatch.setattr(
+        generate_scores, "iter_tiles", partial(iter_tiles, tile_size=16)
+    )
+
+    def make_task(cls, get_source=None):
+        if get_source is None:
+
+            def get_source(variable, model):
+                return climate[variable]
+
+        task = cls()
+        monkeypatch.setattr(task, "get_region_grid", lambda region: grid)
+        monkeypatch.setattr(
+            task,
+            "get_variable_source",
+            lambda variable, region, year, model=None: get_source(variable, model),
+        )
+
+        return task
+
+    return make_task
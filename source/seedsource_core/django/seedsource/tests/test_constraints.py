@@ -0,0 +1,415 @@
+import datetime
+import os
+
+import numpy
+import pyproj
+import pytest
+from rasterio.features import rasterize
+from trefoil.utilities.window import Window
+
+from seedsource_core.django.seedsource.tasks import constraints
+from seedsource_core.django.seedsource.tasks.constraints import (
+    AlignedMask,
+    Constraint,
+    ConstraintMask,
+    DistanceConstraint,
+    ElevationConstraint,
+    GeometryConstraint,
+    LatitudeConstraint,
+    LongitudeConstraint,
+    PhotoperiodConstraint,
+    RasterConstraint,
+)
+from seedsource_core.django.seedsource.tasks.utils import Grid
+
+# Windows of the test grid, including windows a single row or column wide
+WINDOWS = [
+    Window((37, 151), (61, 243)),
+    Window((100, 160), (20, 90)),
+    Window((113, 114), (0, 300)),
+    Window((0, 200), (299, 300)),
+    Window((5, 6), (7, 8)),
+]
+
+CONSTRAINTS = [
+    {"name": "latitude", "args": {"min": 41.5, "max": 45.2}},
+    {"name": "longitude", "args": {"min": -118.3, "max": -112}},
+    {"name": "distance", "args": {"lat": 43, "lon": -116, "distance": 180}},
+    {"name": "elevation", "args": {"min": 400, "max": 1200}},
+]
+
+
+@pytest.fixture
+def no_constraint_cache(monkeypatch):
+    monkeypatch.setattr(constraints, "CONSTRAINT_CACHE_DIR", None)
+
+
+def get_full_mask(grid, constraint_list):
+    """Returns the combined mask of constraints, calculated separately for the full grid"""
+
+    mask = numpy.zeros(grid.shape, "bool")
+    for constraint in constraint_list:
+        instance = Constraint.by_name(constraint["name"])(grid, "test")
+        mask |= instance.get_mask(**constraint["args"]).astype(bool)
+
+    return mask
+
+
+def test_constraint_mask_is_cropped_to_unmasked_cells(grid, dem, no_constraint_cache):
+    expected = get_full_mask(grid, CONSTRAINTS)
+    constraint_mask = ConstraintMask(CONSTRAINTS, "test").build(grid)
+    window = constraint_mask.window
+
+    rows = numpy.flatnonzero(~expected.all(axis=1))
+    cols = numpy.flatnonzero(~expected.all(axis=0))
+    assert window.y_slice == slice(rows[0], rows[-1] + 1)
+    assert window.x_slice == slice(cols[0], cols[-1] + 1)
+
+    # Cells outside of the window are masked
+    for window in [grid.window] + WINDOWS:
+        mask = constraint_mask.get_mask(window)
+        assert (mask == expected[window.y_slice, window.x_slice]).all()
+
+    # Masks for individual cells are calculated without building the mask
+    rng = numpy.random.default_rng(0)
+    rows = rng.integers(0, grid.shape[0], 500)
+    cols = rng.integers(0, grid.shape[1], 500)
+    point_mask = ConstraintMask(CONSTRAINTS, "test").get_point_mask(grid, rows, cols)
+    assert (point_mask == expected[rows, cols]).all()
+
+
+def test_disjoint_constraints_mask_every_cell(grid, no_constraint_cache):
+    disjoint = [
+        {"name": "latitude", "args": {"min": 41, "max": 42}},
+        {"name": "distance", "args": {"lat": 45, "lon": -115, "distance": 50}},
+    ]
+    constraint_mask = ConstraintMask(disjoint, "test").build(grid)
+
+    assert constraint_mask.get_mask(grid.window).all()
+
+
+def test_rectangular_constraints_follow_row_order(grid, no_constraint_cache):
+    flipped = Grid(grid.extent, grid.shape, False)
+    lat_window = LatitudeConstraint(grid, "test").get_window(min=45.2, max=41.5)
+    flipped_window = LatitudeConstraint(flipped, "test").get_window(min=41.5, max=45.2)
+    lon_window = LongitudeConstraint(grid, "test").get_window(min=-118.3, max=-112)
+
+    # Windows cover the same latitudes whichever order the rows are in, to within a cell or two
+    # of the range
+    lat = grid.coords.y.values[lat_window.y_slice]
+    assert lat_window.x_slice == slice(0, grid.shape[1])
+    assert numpy.allclose(
+        sorted(lat), sorted(flipped.coords.y.values[flipped_window.y_slice])
+    )
+    assert abs(lat.min() - 41.5) < 0.07 and abs(lat.max() - 45.2) < 0.07
+
+    lon = grid.coords.x.values[lon_window.x_slice]
+    assert lon_window.y_slice == slice(0, grid.shape[0])
+    assert abs(lon.min() + 118.3) < 2 / 30 and abs(lon.max() + 112) < 2 / 30
+
+    # Only windows are needed for rectangular constraints, so no mask is held
+    constraint_mask = ConstraintMask(CONSTRAINTS[:2], "test").build(grid)
+    assert constraint_mask.mask is None
+    assert constraint_mask.window.y_slice == lat_window.y_slice
+    assert constraint_mask.window.x_slice == lon_window.x_slice
+
+
+def test_distance_mask_is_the_same_for_any_window(grid):
+    rows, cols = numpy.indices(grid.shape).reshape(2, -1)
+
+    # Centers on the edge of a cell are the most sensitive to how a window's cells are aligned
+    centers = [(44.0, -115.0, 150), (40 + 66 * 0.035, -120 + 83 / 30, 100)]
+
+    for lat, lon, distance in centers:
+        full = DistanceConstraint(grid, "test").get_mask(lat, lon, distance)
+        point_mask = DistanceConstraint(grid, "test").get_point_mask(
+            rows, cols, lat, lon, distance
+        )
+        assert (point_mask.reshape(grid.shape) == full).all()
+
+        for window in WINDOWS:
+            subgrid = grid.get_subgrid(window)
+            constraint = DistanceConstraint(subgrid, "test")
+            mask = constraint.get_mask(lat, lon, distance)
+            sub_rows, sub_cols = numpy.indices(subgrid.shape).reshape(2, -1)
+            point_mask = constraint.get_point_mask(
+                sub_rows, sub_cols, lat, lon, distance
+            )
+
+            assert (mask == full[window.y_slice, window.x_slice]).all()
+            assert (point_mask.reshape(subgrid.shape) == mask).all()
+
+        # Cells outside of the window of the circle are all masked
+        window = DistanceConstraint(grid, "test").get_window(lat, lon, distance)
+        outside = numpy.ones(grid.shape, "bool")
+        outside[window.y_slice, window.x_slice] = False
+        assert full[outside].all()
+
+
+def test_distance_mask_matches_geodesic_distances(grid):
+    lat, lon, distance = 44.0, -115.0, 150
+    mask = DistanceConstraint(grid, "test").get_mask(lat, lon, distance)
+
+    x, y = numpy.meshgrid(grid.coords.x.values, grid.coords.y.values)
+    _, _, meters = pyproj.Geod(ellps="WGS84").inv(
+        numpy.full(x.size, lon), numpy.full(y.size, lat), x.ravel(), y.ravel()
+    )
+    km = meters.reshape(grid.shape) / 1000
+
+    # Cells are included if any part of them is within the distance, so allow for a cell diagonal
+    assert not mask[km < distance].any()
+    assert mask[km > distance + 3].all()
+
+
+def assert_masks_match_windows(grid, constraint, kwargs):
+    """Asserts that the masks of a constraint for windows of the grid, and for cells of them, match the full mask"""
+
+    full = constraint(grid, "test").get_mask(**kwargs)
+    assert 0 < full.sum() < full.size
+
+    for window in WINDOWS:
+        subgrid = grid.get_subgrid(window)
+        mask = constraint(subgrid, "test").get_mask(**kwargs)
+        rows, cols = numpy.indices(subgrid.shape).reshape(2, -1)
+        point_mask = constraint(subgrid, "test").get_point_mask(rows, cols, **kwargs)
+
+        assert (mask == full[window.y_slice, window.x_slice]).all()
+        assert (point_mask.reshape(subgrid.shape) == mask).all()
+
+
+def test_elevation_mask_for_any_window(grid, dem):
+    assert_masks_match_windows(grid, ElevationConstraint, {"min": 500, "max": 1500})
+
+
+def test_photoperiod_mask_for_any_window(grid, dem):
+    kwargs = {
+        "hours": 0.1,
+        "lat": 43.5,
+        "lon": -115,
+        "year": 2020,
+        "month": 6,
+        "day": 1,
+    }
+    assert_masks_match_windows(grid, PhotoperiodConstraint, kwargs)
+
+
+TRIANGLE = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [-118.71, 41.02],
+                        [-111.33, 43.57],
+                        [-117.05, 46.38],
+                        [-118.71, 41.02],
+                    ]
+                ],
+            },
+        }
+    ],
+}
+
+
+@pytest.fixture
+def constraint_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "constraints")
+    monkeypatch.setattr(constraints, "CONSTRAINT_CACHE_DIR", path)
+    return path
+
+
+def test_shapefile_mask_for_any_window(grid, constraint_cache):
+    assert_masks_match_windows(grid, GeometryConstraint, {"geoJSON": TRIANGLE})
+
+
+def test_shapefile_mask_is_clipped_to_geometries(grid, constraint_cache):
+    mask = GeometryConstraint(grid, "test").get_mask(geoJSON=TRIANGLE)
+
+    # The same as rasterizing the geometry for the full grid
+    expected = rasterize(
+        [TRIANGLE["features"][0]["geometry"]],
+        out_shape=grid.shape,
+        fill=1,
+        transform=grid.coords.affine,
+        all_touched=True,
+        default_value=0,
+        dtype="uint8",
+    ).astype(bool)
+    assert (mask == expected).all()
+
+    window = GeometryConstraint(grid, "test").get_window(geoJSON=TRIANGLE)
+    rows = numpy.flatnonzero(~mask.all(axis=1))
+    cols = numpy.flatnonzero(~mask.all(axis=0))
+    assert window.y_slice.start <= rows[0] and window.y_slice.stop > rows[-1]
+    assert window.x_slice.start <= cols[0] and window.x_slice.stop > cols[-1]
+
+    # Geometries outside of the grid mask every cell
+    outside = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[-100, 41], [-99, 41], [-99, 42], [-100, 41]]],
+                },
+            }
+        ],
+    }
+    assert GeometryConstraint(grid, "test").get_mask(geoJSON=outside).all()
+
+
+def test_shapefile_masks_are_cached(grid, constraint_cache, monkeypatch):
+    shapefile = [{"name": "shapefile", "args": {"geoJSON": TRIANGLE}}]
+    mask = ConstraintMask(shapefile, "test").build(grid).get_mask(grid.window)
+    assert os.listdir(constraint_cache)
+
+    calls = []
+    rasterize_geometries = GeometryConstraint.rasterize
+
+    def count_calls(self, geometries, window):
+        calls.append(window)
+        return rasterize_geometries(self, geometries, window)
+
+    monkeypatch.setattr(GeometryConstraint, "rasterize", count_calls)
+
+    cached = ConstraintMask(shapefile, "test").build(grid).get_mask(grid.window)
+    assert not calls
+    assert (cached == mask).all()
+    assert (cached == GeometryConstraint(grid, "test").get_mask(geoJSON=TRIANGLE)).all()
+
+    # Masks are cached by geometry, as well as by grid
+    calls.clear()
+    moved = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[-118, 42], [-112, 42], [-115, 46], [-118, 42]]],
+                },
+            }
+        ],
+    }
+    ConstraintMask([{"name": "shapefile", "args": {"geoJSON": moved}}], "test").build(
+        grid
+    )
+    assert len(calls) == 1
+
+
+def test_constraint_masks_are_cached(grid, dem, constraint_cache, monkeypatch):
+    expected = get_full_mask(grid, CONSTRAINTS)
+    mask = ConstraintMask(CONSTRAINTS, "test").build(grid).get_mask(grid.window)
+
+    calls = []
+    get_mask = ElevationConstraint.get_mask
+
+    def count_calls(self, **kwargs):
+        calls.append(kwargs)
+        return get_mask(self, **kwargs)
+
+    monkeypatch.setattr(ElevationConstraint, "get_mask", count_calls)
+
+    # The elevation mask is read from the cache, and the distance mask isn't cached
+    cached = ConstraintMask(CONSTRAINTS, "test").build(grid).get_mask(grid.window)
+    assert not calls
+    assert (mask == expected).all()
+    assert (cached == expected).all()
+
+    # Cached masks aren't used once the DEM is modified
+    mtime = os.path.getmtime(dem.path)
+    os.utime(dem.path, (mtime + 60, mtime + 60))
+    ConstraintMask(CONSTRAINTS, "test").build(grid)
+    assert len(calls) == 1
+
+
+def test_aligned_mask_windows(grid, make_source):
+    rows, cols = numpy.indices(grid.shape)
+    mask = (rows * 7 + cols * 3) % 11 < 4
+    path = make_source("pa", mask.astype("int8")).path
+
+    AlignedMask.build(mask).save(path, "test", grid)
+    aligned = AlignedMask.load(path, "test", grid)
+
+    # Windows start and end part way through bytes of the packed rows
+    for window in WINDOWS + [Window((3, 190), (13, 290)), Window((0, 200), (1, 7))]:
+        expected = mask[window.y_slice, window.x_slice]
+        assert (aligned.get_window(window) == expected).all()
+
+    assert (aligned.get_cells(rows.ravel(), cols.ravel()) == mask.ravel()).all()
+
+    # Masks are only used for the grid they were aligned to, and until the dataset changes
+    assert AlignedMask.load(path, "other", grid) is None
+    assert AlignedMask.load(path, "test", grid.get_subgrid(WINDOWS[0])) is None
+
+    mtime = os.path.getmtime(path)
+    os.utime(path, (mtime + 60, mtime + 60))
+    assert AlignedMask.load(path, "test", grid) is None
+
+
+def test_raster_point_mask(grid, dem, make_source, services):
+    rows, cols = numpy.indices(grid.shape)
+    presence = ((rows - 100) ** 2 + (cols - 150) ** 2 < 80**2).astype("int8")
+    services["test_pa"] = make_source("pa", presence)
+    expected = presence < 1
+
+    def assert_matches(get_mask=True):
+        for window in [grid.window] + WINDOWS:
+            constraint = RasterConstraint(grid.get_subgrid(window), "test")
+            sub_rows, sub_cols = numpy.indices(window.shape).reshape(2, -1)
+            point_mask = constraint.get_point_mask(
+                sub_rows, sub_cols, service="test_pa"
+            )
+            expected_window = expected[window.y_slice, window.x_slice]
+
+            assert (point_mask.reshape(window.shape) == expected_window).all()
+            if get_mask:
+                assert (constraint.get_mask(service="test_pa") == expected_window).all()
+
+    # Without an aligned mask, cells are sampled from the dataset
+    assert_matches(get_mask=False)
+
+    # With an aligned mask, cells are read from it
+    AlignedMask.build(expected).save(services["test_pa"].path, "test", grid)
+    services["test_pa"].close()
+    assert_matches()
+
+
+def test_no_constraints(grid, no_constraint_cache):
+    constraint_mask = ConstraintMask(None, "test").build(grid)
+
+    assert constraint_mask.window.shape == grid.shape
+    assert not constraint_mask.get_mask(grid.window).any()
+
+
+def test_photoperiod_mask_matches_daylight_of_each_cell(grid, dem):
+    kwargs = {
+        "hours": 0.1,
+        "lat": 43.5,
+        "lon": -115,
+        "year": 2020,
+        "month": 6,
+        "day": 1,
+    }
+    constraint = PhotoperiodConstraint(grid, "test")
+    date = datetime.date(2020, 6, 1)
+    daylight = constraint.daylight(date, 43.5, -115)
+    coords = grid.coords
+
+    # Daylight calculated for every cell, as the mask was before being calculated by row
+    daylight_arr = constraint.daylight_array(date, coords.y.values, coords.x.values)
+    expected = daylight_arr < daylight - 0.1
+    expected |= daylight_arr > daylight + 0.1
+
+    mask = constraint.get_mask(**kwargs)
+    assert 0 < expected.sum() < expected.size
+    assert mask.shape == grid.shape
+    assert (mask == expected).all()
+
+    rows, cols = numpy.indices(grid.shape).reshape(2, -1)
+    point_mask = constraint.get_point_mask(rows, cols, **kwargs)
+    assert (point_mask.reshape(grid.shape) == expected).all()
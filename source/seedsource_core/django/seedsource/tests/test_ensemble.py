@@ -0,0 +1,81 @@
+import numpy
+import pytest
+
+from seedsource_core.django.seedsource.tasks.generate_scores import (
+    GenerateEnsembleScores,
+    GenerateScores,
+)
+
+VARIABLES = [
+    {"name": "a", "limit": {"min": 5, "max": 25}},
+    {"name": "b", "limit": {"min": 0, "max": 20}},
+]
+CONSTRAINTS = [{"name": "latitude", "args": {"min": 41, "max": 46}}]
+MODELS = ["m1", "m2", "m3"]
+
+
+@pytest.fixture
+def get_source(grid, climate, make_source):
+    """Returns sources for each model, with `a` shifted by a different amount"""
+
+    a = climate["a"].read(grid.window)
+    sources = {
+        model: make_source("a", a + shift, filename="a_{}".format(model))
+        for model, shift in zip(MODELS, (-4, 0, 6))
+    }
+
+    def get_source(variable, model):
+        if variable == "a" and model in sources:
+            return sources[model]
+        return climate[variable]
+
+    return get_source
+
+
+def test_ensemble_matches_scores_of_each_model(make_task, get_source, monkeypatch):
+    task = make_task(GenerateEnsembleScores, get_source)
+    monkeypatch.setattr(task, "get_models", lambda region, year, names: MODELS)
+
+    result = task.execute(
+        "test",
+        "rcp45_2050",
+        threshold=50,
+        variables=VARIABLES,
+        constraints=CONSTRAINTS,
+    )
+
+    scores = [
+        make_task(GenerateScores, get_source).execute(
+            "test",
+            "rcp45_2050",
+            model=model,
+            variables=VARIABLES,
+            constraints=CONSTRAINTS,
+        )["raster_out"]
+        for model in MODELS
+    ]
+    filled = numpy.array([s.filled(0) for s in scores], "int32")
+    mask = numpy.logical_and.reduce([numpy.ma.getmaskarray(s) for s in scores])
+
+    assert result["models"] == MODELS
+    assert result["count_out"].model_count == len(MODELS)
+    for name in ("mean_out", "min_out", "count_out"):
+        assert result[name].shape == scores[0].shape
+        assert (numpy.ma.getmaskarray(result[name]) == mask).all()
+
+    # Models disagree on some cells, which count as 0 for models that don't score them
+    assert (numpy.ma.getmaskarray(scores[0]) != numpy.ma.getmaskarray(scores[2])).any()
+
+    valid = ~mask
+    assert valid.any()
+    assert numpy.allclose(result["mean_out"][valid], filled.mean(axis=0)[valid])
+    assert (result["min_out"][valid] == filled.min(axis=0)[valid]).all()
+    assert (result["count_out"][valid] == (filled > 50).sum(axis=0)[valid]).all()
+
+
+def test_ensemble_requires_models(make_task, monkeypatch):
+    task = make_task(GenerateEnsembleScores)
+    monkeypatch.setattr(task, "get_models", lambda region, year, names: [])
+
+    with pytest.raises(ValueError):
+        task.execute("test", "rcp45_2050", variables=VARIABLES)
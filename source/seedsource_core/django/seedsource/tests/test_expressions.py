@@ -0,0 +1,38 @@
+import math
+
+import numpy
+from ncdjango.geoprocessing.evaluation import Parser
+
+from seedsource_core.django.seedsource.tasks.expressions import compile_expression
+
+
+def test_compiled_expressions_match_parser():
+    """Compiled expressions should give the same values, types and masks as the ncdjango parser"""
+
+    a = numpy.ma.masked_array(
+        numpy.arange(-10, 10, dtype="float32").reshape(4, 5), mask=numpy.eye(4, 5)
+    )
+    b = numpy.ma.masked_array(numpy.linspace(1, 3, 20, dtype="float32").reshape(4, 5))
+    lat = numpy.tile(numpy.linspace(40, 47, 4).reshape(4, 1), (1, 5))
+
+    for fn in (
+        "381 + (-1.72*LAT) + (-0.011*a)",
+        "math_e**(6.705 + (0.07443*a))",
+        "-2.07 - 0.004*a + 0.004*b",
+        "a*b**2",
+        "-a*b",
+        "a + -b",
+        "a / (b - 2) % 3",
+    ):
+        context = {"a": a, "b": b, "LAT": lat, "math_e": math.e}
+        expected = Parser().evaluate(fn, dict(context))
+        result = compile_expression(fn).evaluate(dict(context))
+
+        assert result.dtype == expected.dtype
+        assert (numpy.ma.getmaskarray(result) == numpy.ma.getmaskarray(expected)).all()
+        assert numpy.ma.allequal(result, expected)
+
+
+def test_unsupported_expressions_fall_back():
+    assert compile_expression("abs(a)") is None
+    assert compile_expression("a > 1") is None
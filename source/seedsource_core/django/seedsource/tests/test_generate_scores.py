@@ -0,0 +1,415 @@
+import os
+from functools import partial
+from types import SimpleNamespace
+
+import numpy
+import pytest
+
+from seedsource_core.django.seedsource.tasks import (
+    constraints,
+    generate_scores,
+    scoring,
+)
+from seedsource_core.django.seedsource.tasks.constraints import ConstraintMask
+from seedsource_core.django.seedsource.tasks.generate_scores import (
+    GenerateScores,
+    GenerateScoresBatch,
+)
+from seedsource_core.django.seedsource.tasks.result_cache import get_inputs_hash
+from seedsource_core.django.seedsource.tasks.scoring import TileScorer, iter_tiles
+
+VARIABLES = [
+    {"name": "a", "limit": {"min": 5, "max": 25}},
+    {"name": "b", "limit": {"min": 0, "max": 20}},
+]
+FUNCTIONS = [{"name": "fn", "fn": "a - b / 2", "limit": {"min": 0, "max": 20}}]
+CONSTRAINTS = [
+    {"name": "latitude", "args": {"min": 42, "max": 45}},
+    {"name": "longitude", "args": {"min": -118, "max": -112}},
+]
+
+# A band of latitude, and a circle within it
+CIRCLE_CONSTRAINTS = [
+    {"name": "latitude", "args": {"min": 42, "max": 45}},
+    {"name": "distance", "args": {"lat": 43.5, "lon": -115, "distance": 100}},
+]
+
+POINTS = {
+    "headers": {"x": "lon", "y": "lat"},
+    "points": [
+        # Within the constraints
+        {"lon": -115, "lat": 43.5},
+        # Within the constraint window, but in a tile masked by the distance constraint
+        {"lon": -116.3, "lat": 42.2},
+        # Outside of the constraint window
+        {"lon": -111, "lat": 46.5},
+        {"lon": -119.9, "lat": 40.1},
+        # Outside of the region
+        {"lon": -100, "lat": 46},
+    ],
+}
+
+
+@pytest.fixture
+def task(grid, climate, monkeypatch):
+    monkeypatch.setattr(generate_scores, "DISTANCE_CACHE_DIR", None)
+    monkeypatch.setattr(constraints, "CONSTRAINT_CACHE_DIR", None)
+    monkeypatch.setattr(
+        generate_scores, "iter_tiles", partial(iter_tiles, tile_size=16)
+    )
+
+    task = GenerateScores()
+    task.reads = []
+
+    for name, source in climate.items():
+
+        def read(window, name=name, read=source.read):
+            task.reads.append((name, window))
+            return read(window)
+
+        monkeypatch.setattr(source, "read", read)
+
+    monkeypatch.setattr(task, "get_region_grid", lambda region: grid)
+    monkeypatch.setattr(
+        task, "get_variable_source", lambda variable, *args: climate[variable]
+    )
+
+    return task
+
+
+def test_variables_are_read_for_constraint_window(task, grid):
+    expected = task.execute(
+        "test", "1961_1990", variables=VARIABLES, functions=FUNCTIONS
+    )["raster_out"]
+
+    task.reads.clear()
+    result = task.execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        functions=FUNCTIONS,
+        constraints=CONSTRAINTS,
+    )["raster_out"]
+    constraint_mask = ConstraintMask(CONSTRAINTS, "test").build(grid)
+    window = constraint_mask.window
+
+    # Variables are only read for tiles of the window of unconstrained cells
+    assert {name for name, _ in task.reads} == {"a", "b"}
+    for _, tile in task.reads:
+        assert window.y_slice.start <= tile.y_slice.start < window.y_slice.stop
+        assert window.x_slice.start <= tile.x_slice.start < window.x_slice.stop
+        assert tile.shape[0] <= 16 and tile.shape[1] <= 16
+
+    assert result.extent.as_list() == grid.get_window_extent(window).as_list()
+
+    # Scores are the same as the full grid's, with constrained cells masked
+    expected_mask = numpy.ma.getmaskarray(expected)[window.y_slice, window.x_slice]
+    expected = numpy.ma.getdata(expected)[window.y_slice, window.x_slice]
+    mask = expected_mask | constraint_mask.get_mask(window)
+    assert 0 < mask.sum() < mask.size
+
+    assert (numpy.ma.getmaskarray(result) == mask).all()
+    assert (numpy.ma.getdata(result)[~mask] == expected[~mask]).all()
+
+
+def test_identical_jobs_reuse_results(task, monkeypatch):
+    cached = {}
+
+    def cache_result(inputs_hash, job):
+        cached[inputs_hash] = {"raster_out": "{}_result".format(job)}
+
+    monkeypatch.setattr(generate_scores, "get_current_job", lambda: "job")
+    monkeypatch.setattr(generate_scores, "get_cached_outputs", cached.get)
+    monkeypatch.setattr(generate_scores, "cache_result", cache_result)
+
+    result = task.execute("test", "1961_1990", variables=VARIABLES)
+    assert len(cached) == 1
+    assert task.reads
+
+    # Inputs which only differ in the order of keys are the same job
+    task.reads.clear()
+    variables = [dict(reversed(list(v.items()))) for v in VARIABLES]
+    result = task.execute("test", "1961_1990", variables=variables)
+
+    assert result["raster_out"] == "job_result"
+    assert not task.reads
+
+    task.execute("test", "1961_1990", variables=VARIABLES[:1])
+    assert len(cached) == 2
+
+
+def test_services_are_queried_once_per_job(monkeypatch):
+    queries = []
+
+    def get(name):
+        queries.append(name)
+        variable = SimpleNamespace(variable="a", x_dimension="lon", y_dimension="lat")
+        return SimpleNamespace(
+            data_path="a.nc", variable_set=SimpleNamespace(first=lambda: variable)
+        )
+
+    monkeypatch.setattr(
+        generate_scores, "Service", SimpleNamespace(objects=SimpleNamespace(get=get))
+    )
+
+    task = GenerateScores()
+    for _ in range(3):
+        source = task.get_variable_source("a", "test", "1961_1990")
+        assert source.variable == "a"
+
+    task.get_variable_source("b", "test", "1961_1990")
+    assert queries == ["test_1961_1990SY_a", "test_1961_1990SY_b"]
+
+
+def test_sites_report_values_and_scores(task, grid, climate):
+    coords = grid.coords
+    cells = [(10, 20), (100, 150), (120, 60), (190, 5), (199, 299)]
+    sites = [
+        {"lon": coords.x.values[col], "lat": coords.y.values[row], "name": str(i)}
+        for i, (row, col) in enumerate(cells)
+    ]
+    sites.append({"lon": -100, "lat": 43, "name": "outside"})
+    points = {"headers": {"x": "lon", "y": "lat"}, "points": sites}
+
+    full = task.execute("test", "1961_1990", variables=VARIABLES, functions=FUNCTIONS)
+    result = task.execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        functions=FUNCTIONS,
+        constraints=CONSTRAINTS,
+        points=points,
+    )
+    constraint_mask = ConstraintMask(CONSTRAINTS, "test").build(grid)
+    constrained = constraint_mask.get_mask(grid.window)
+    full_scores = full["raster_out"]
+    a = climate["a"].read(grid.window)
+    b = climate["b"].read(grid.window)
+    values = {"a": a, "b": b, "fn": a - b / 2}
+
+    # Sites include cells outside the constraints, and a masked cell
+    assert constrained[10, 20] and not constrained[100, 150]
+    assert numpy.ma.getmaskarray(a)[190, 5]
+
+    assert [p["name"] for p in result["points"]] == [p["name"] for p in sites]
+
+    for point, (row, col) in zip(result["points"], cells):
+        for item in VARIABLES + FUNCTIONS:
+            midpoint = (item["limit"]["min"] + item["limit"]["max"]) / 2
+            value = values[item["name"]][row, col]
+            value = 0 if value is numpy.ma.masked else value
+            assert point["deltas"][item["name"]] == pytest.approx(midpoint - value)
+
+        score = full_scores[row, col]
+        if constrained[row, col] or score is numpy.ma.masked:
+            score = 0
+        assert point["score"] == score
+
+    assert result["points"][-1]["score"] == 0
+    assert result["points"][-1]["deltas"] == {
+        item["name"]: (item["limit"]["min"] + item["limit"]["max"]) / 2
+        for item in VARIABLES + FUNCTIONS
+    }
+
+    # Scoring only the sites reports the same values, without reading full tiles
+    task.reads.clear()
+    points_only = task.execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        functions=FUNCTIONS,
+        constraints=CONSTRAINTS,
+        points=points,
+        points_only=True,
+    )
+
+    assert points_only["points"] == result["points"]
+
+    # Sites are read once per variable for each block they fall in, rather than once per site
+    block_size = scoring.CELL_BLOCK_SIZE
+    blocks = {(row // block_size, col // block_size) for row, col in cells}
+    assert len(task.reads) == len(blocks) * 2
+    assert all(
+        window.shape[0] <= block_size and window.shape[1] <= block_size
+        for _, window in task.reads
+    )
+
+
+def test_sites_outside_window_are_read_by_block(task, grid):
+    coords = grid.coords
+    rng = numpy.random.default_rng(0)
+    rows = rng.integers(150, 200, 40)
+    cols = rng.integers(0, 300, 40)
+    sites = [
+        {"lon": coords.x.values[col], "lat": coords.y.values[row]}
+        for row, col in zip(rows, cols)
+    ]
+    points = {"headers": {"x": "lon", "y": "lat"}, "points": sites}
+    kwargs = {
+        "variables": VARIABLES,
+        "functions": FUNCTIONS,
+        "constraints": CONSTRAINTS,
+    }
+
+    task.execute("test", "1961_1990", **kwargs)
+    tile_reads = len(task.reads)
+    task.reads.clear()
+    result = task.execute("test", "1961_1990", points=points, **kwargs)
+
+    # Sites are all outside of the constraint window, so none are in a scored tile
+    constrained = ConstraintMask(CONSTRAINTS, "test").build(grid).get_mask(grid.window)
+    assert constrained[rows, cols].all()
+    assert all(point["score"] == 0 for point in result["points"])
+
+    block_size = scoring.CELL_BLOCK_SIZE
+    blocks = {(row // block_size, col // block_size) for row, col in zip(rows, cols)}
+    assert len(task.reads) - tile_reads == len(blocks) * 2
+
+
+def test_points_only_requires_points(task):
+    with pytest.raises(ValueError):
+        task.execute("test", "1961_1990", variables=VARIABLES, points_only=True)
+
+
+def test_batch_matches_separate_jobs(grid, climate, make_source, make_task):
+    # `a` is warmer for future scenarios, and warmer still for the second model
+    a = climate["a"].read(grid.window)
+    future = {
+        model: make_source("a", a + shift, filename="a_{}".format(model))
+        for model, shift in (("m1", 3), ("m2", 6))
+    }
+
+    def get_source(variable, model):
+        if variable == "a" and model is not None:
+            return future[model]
+        return climate[variable]
+
+    points = {
+        "headers": {"x": "lon", "y": "lat"},
+        "points": [{"lon": -115, "lat": 43.5}, {"lon": -119.9, "lat": 40.1}],
+    }
+    scenarios = [
+        {"year": "1961_1990"},
+        {"year": "rcp45_2050", "model": "m1"},
+        {"year": "rcp85_2050", "model": "m2"},
+    ]
+    kwargs = {
+        "variables": VARIABLES,
+        "functions": FUNCTIONS,
+        "constraints": CONSTRAINTS,
+        "points": points,
+    }
+
+    result = make_task(GenerateScoresBatch, get_source).execute(
+        "test", scenarios, **kwargs
+    )
+
+    assert [s["raster_out"] for s in result["scenarios"]] == [
+        "raster_out_0",
+        "raster_out_1",
+        "raster_out_2",
+    ]
+
+    rasters = []
+    for i, scenario in enumerate(scenarios):
+        expected = make_task(GenerateScores, get_source).execute(
+            "test", scenario["year"], scenario.get("model"), **kwargs
+        )
+        raster = result["raster_out_{}".format(i)]
+        rasters.append(raster)
+
+        assert result["scenarios"][i]["year"] == scenario["year"]
+        assert result["scenarios"][i]["model"] == scenario.get("model")
+        assert result["scenarios"][i]["points"] == expected["points"]
+
+        expected_raster = expected["raster_out"]
+        mask = numpy.ma.getmaskarray(expected_raster)
+        assert raster.extent.as_list() == expected_raster.extent.as_list()
+        assert (numpy.ma.getmaskarray(raster) == mask).all()
+        assert (
+            numpy.ma.getdata(raster)[~mask] == numpy.ma.getdata(expected_raster)[~mask]
+        ).all()
+
+    # Scenarios score differently, and outputs past the number of scenarios are unset
+    assert (rasters[0] != rasters[2]).any()
+    for i in range(len(scenarios), generate_scores.MAX_BATCH_SCENARIOS):
+        assert "raster_out_{}".format(i) not in result.values
+
+
+def test_batch_scenario_count(make_task):
+    batch = make_task(GenerateScoresBatch)
+
+    with pytest.raises(ValueError):
+        batch.execute("test", [], variables=VARIABLES)
+
+    scenarios = [{"year": "1961_1990"}] * (generate_scores.MAX_BATCH_SCENARIOS + 1)
+    with pytest.raises(ValueError):
+        batch.execute("test", scenarios, variables=VARIABLES)
+
+
+def test_sites_do_not_extend_scoring_window(task, grid, monkeypatch):
+    scored = []
+    score = TileScorer.score
+
+    def record_score(self, window, mask, points=None):
+        scored.append((window, mask))
+        return score(self, window, mask, points)
+
+    monkeypatch.setattr(TileScorer, "score", record_score)
+
+    result = task.execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        constraints=CIRCLE_CONSTRAINTS,
+        points=POINTS,
+    )
+    scoring_window = task.get_scoring_window("test", CIRCLE_CONSTRAINTS, POINTS)
+    window = scoring_window.window
+
+    assert result["raster_out"].shape == window.shape
+    assert (
+        result["raster_out"].extent.as_list()
+        == grid.get_window_extent(window).as_list()
+    )
+
+    # Sites outside of the scored tiles are read one cell at a time, and no tile is scored
+    # only because it contains a site
+    for tile, mask in scored:
+        if tile.shape != (1, 1):
+            assert not mask.all()
+            assert window.y_slice.start <= tile.y_slice.start < window.y_slice.stop
+            assert window.x_slice.start <= tile.x_slice.start < window.x_slice.stop
+
+    # Sites are reported the same as when scoring sites only
+    expected = task.execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        constraints=CIRCLE_CONSTRAINTS,
+        points=POINTS,
+        points_only=True,
+    )["points"]
+    points = result["points"]
+
+    assert points == expected
+    assert points[0]["score"] > 0
+    assert [p["score"] for p in points[1:]] == [0, 0, 0, 0]
+    assert all(numpy.isfinite(list(p["deltas"].values())).all() for p in points)
+    assert points[2]["deltas"] != points[3]["deltas"]
+
+
+def test_results_are_not_reused_after_data_changes(task, climate):
+    def get_hash():
+        versions = task.get_data_versions(
+            "test", "1961_1990", None, VARIABLES, [], CONSTRAINTS
+        )
+        return get_inputs_hash(task.name, {"variables": VARIABLES}, versions)
+
+    inputs_hash = get_hash()
+    assert get_hash() == inputs_hash
+
+    mtime = os.path.getmtime(climate["b"].path)
+    os.utime(climate["b"].path, (mtime + 60, mtime + 60))
+
+    assert get_hash() != inputs_hash
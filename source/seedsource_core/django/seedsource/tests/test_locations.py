@@ -0,0 +1,63 @@
+import numpy
+
+from seedsource_core.django.seedsource.tasks.locations import (
+    get_patches,
+    get_top_locations,
+)
+
+
+def test_top_locations(grid):
+    rng = numpy.random.default_rng(0)
+    scores = numpy.ma.masked_array(
+        rng.integers(0, 101, grid.shape).astype("int8"),
+        rng.random(grid.shape) < 0.3,
+    )
+    locations = get_top_locations(scores, grid, 20)
+    valid = numpy.ma.getdata(scores)[~scores.mask]
+
+    assert [loc["score"] for loc in locations] == sorted(valid)[::-1][:20]
+
+    coords = grid.coords
+    for location in locations:
+        row = numpy.argmin(numpy.abs(coords.y.values - location["y"]))
+        col = numpy.argmin(numpy.abs(coords.x.values - location["x"]))
+        assert not scores.mask[row, col]
+        assert scores[row, col] == location["score"]
+
+    # There are fewer valid cells than requested
+    few = numpy.ma.masked_array(scores, True)
+    few.mask[3, 4] = False
+    assert len(get_top_locations(few, grid, 20)) == 1
+    assert get_top_locations(numpy.ma.masked_all(grid.shape, "int8"), grid, 5) == []
+
+
+def test_patches(grid):
+    scores = numpy.ma.masked_array(numpy.full(grid.shape, 50, "int8"))
+
+    # A square of 10 x 10 cells, two squares of 3 x 3 cells touching at a corner (one patch), and
+    # a single cell
+    scores[20:30, 40:50] = 90
+    scores[100:103, 200:203] = 80
+    scores[103:106, 203:206] = 100
+    scores[150, 10] = 75
+    scores[25, 45] = numpy.ma.masked
+
+    patches = get_patches(scores, grid, 10)
+
+    assert [p["cells"] for p in patches] == [99, 18, 1]
+    assert patches[0]["score"] == 90
+    assert patches[1]["score"] == 90
+
+    # The centroid of the corner-joined squares is the corner they share
+    coords = grid.coords
+    x = (coords.x.values[202] + coords.x.values[203]) / 2
+    y = (coords.y.values[102] + coords.y.values[103]) / 2
+    assert numpy.isclose(patches[1]["x"], x)
+    assert numpy.isclose(patches[1]["y"], y, atol=1e-4)
+
+    cell_area = grid.get_cell_areas()[150] / 10000
+    assert numpy.isclose(patches[2]["area"], cell_area, atol=0.01)
+
+    # Only the largest patches are returned
+    assert [p["cells"] for p in get_patches(scores, grid, 2)] == [99, 18]
+    assert get_patches(scores, grid, 10, min_score=101) == []
@@ -0,0 +1,78 @@
+import json
+import zipfile
+
+import numpy
+from django.conf import settings
+from shapely.geometry import Point, shape
+
+from seedsource_core.django.seedsource.tasks.polygons import (
+    get_class_polygons,
+    write_polygons,
+)
+
+
+def get_scores(grid):
+    rows, cols = numpy.indices(grid.shape)
+    scores = numpy.clip(100 - numpy.hypot(rows - 100, cols - 150), 0, 100)
+    return numpy.ma.masked_where(cols < 30, scores.astype("int8"))
+
+
+def test_class_polygons(grid):
+    scores = get_scores(grid)
+    features = get_class_polygons(scores, grid, tolerance=0)["features"]
+
+    assert [f["properties"]["class"] for f in features] == [0, 1, 2, 3]
+    assert features[3]["properties"] == {"class": 3, "min": 75, "max": 100}
+
+    # Each cell center is within the polygon of its class
+    coords = grid.coords
+    polygons = [shape(f["geometry"]) for f in features]
+    for row, col in [(100, 150), (100, 190), (10, 10), (10, 40), (180, 290)]:
+        point = Point(coords.x.values[col], coords.y.values[row])
+        expected = None
+        if not scores.mask[row, col]:
+            expected = (
+                int(numpy.searchsorted([0, 25, 50, 75], scores[row, col], "right")) - 1
+            )
+        assert [i for i, p in enumerate(polygons) if p.contains(point)] == (
+            [] if expected is None else [expected]
+        )
+
+    # Polygons cover the unmasked cells
+    cell_x, cell_y = grid.cell_size
+    area = sum(p.area for p in polygons)
+    assert numpy.isclose(area, scores.count() * cell_x * cell_y)
+
+
+def test_simplified_polygons_share_edges(grid):
+    scores = get_scores(grid)
+    exact = get_class_polygons(scores, grid, tolerance=0)["features"]
+    simplified = get_class_polygons(scores, grid, tolerance=min(grid.cell_size) * 2)[
+        "features"
+    ]
+
+    exact_polygons = [shape(f["geometry"]) for f in exact]
+    polygons = [shape(f["geometry"]) for f in simplified]
+
+    # Simplified classes have fewer vertices, but still don't overlap or leave gaps
+    assert sum(len(json.dumps(f["geometry"])) for f in simplified) < sum(
+        len(json.dumps(f["geometry"])) for f in exact
+    )
+    for i, polygon in enumerate(polygons):
+        for other in polygons[i + 1 :]:
+            assert polygon.intersection(other).area < 1e-9
+
+    total = sum(p.area for p in polygons)
+    assert numpy.isclose(total, sum(p.area for p in exact_polygons), rtol=0.01)
+
+
+def test_write_polygons(grid, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATASET_DOWNLOAD_DIR", tmp_path / "downloads")
+    feature_collection = get_class_polygons(get_scores(grid), grid)
+
+    filename = write_polygons(feature_collection)
+
+    with zipfile.ZipFile(settings.DATASET_DOWNLOAD_DIR / filename) as zf:
+        data = json.loads(zf.read("SST Results/results.geojson"))
+
+    assert data == json.loads(json.dumps(feature_collection))
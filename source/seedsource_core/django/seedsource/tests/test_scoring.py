@@ -0,0 +1,452 @@
+import multiprocessing
+import os
+
+import numpy
+import pytest
+from ncdjango.geoprocessing.evaluation import Parser
+from netCDF4 import Dataset
+from trefoil.netcdf.variable import SpatialCoordinateVariables
+from trefoil.utilities.window import Window
+
+from seedsource_core.django.seedsource.tasks import scoring
+from seedsource_core.django.seedsource.tasks.cache import ArrayCache
+from seedsource_core.django.seedsource.tasks.scoring import (
+    BlockIndex,
+    CellData,
+    LatitudeSource,
+    TileData,
+    TileScorer,
+    iter_tiles,
+    read_cells,
+    score_tiles,
+)
+
+VARIABLES = [
+    {"name": "a", "limit": {"min": 8, "max": 16}},
+    {"name": "b", "limit": {"min": 0, "max": 14}},
+]
+FUNCTIONS = [{"name": "fn", "fn": "a - b / 2", "limit": {"min": 2, "max": 12}}]
+
+
+def get_expected_scores(grid, climate, items):
+    """Returns scores calculated for the full grid at once, the same way as before scores were tiled"""
+
+    values = {
+        "a": climate["a"].read(grid.window),
+        "b": climate["b"].read(grid.window),
+    }
+    for item in items:
+        if "fn" in item:
+            values[item["name"]] = Parser().evaluate(item["fn"], context=values)
+
+    sum_rasters = numpy.zeros(grid.shape, "float32")
+    sum_masks = numpy.zeros(grid.shape, "bool")
+
+    for item in items:
+        limit_min, limit_max = item["limit"]["min"], item["limit"]["max"]
+        half = (limit_max - limit_min) / 2
+        factor = 100 / half
+        data = values[item["name"]]
+
+        sum_masks |= numpy.ma.getmaskarray(data)
+        sum_masks |= (data < limit_min).filled(False) | (data > limit_max).filled(False)
+
+        raster = numpy.ma.getdata(data).astype("float32")
+        raster *= factor
+        raster -= factor * (limit_min + half)
+        raster **= 2
+        sum_rasters += numpy.floor(raster)
+
+    sum_rasters += 0.4
+    sum_rasters **= 0.5
+    sum_masks |= sum_rasters > 100
+
+    return numpy.ma.masked_where(sum_masks, 100 - sum_rasters.astype("int8"))
+
+
+def get_tiles(grid, points=None, tile_size=64):
+    """Returns (window, mask, points) for tiles of the grid, with no cells masked by constraints"""
+
+    tiles = []
+    for tile in iter_tiles(grid.window, tile_size):
+        tile_points = None
+        if points is not None:
+            rows, cols = points
+            in_tile = (rows >= tile.y_slice.start) & (rows < tile.y_slice.stop)
+            in_tile &= (cols >= tile.x_slice.start) & (cols < tile.x_slice.stop)
+            tile_points = (
+                rows[in_tile] - tile.y_slice.start,
+                cols[in_tile] - tile.x_slice.start,
+            )
+        tiles.append((tile, numpy.zeros(tile.shape, "bool"), tile_points))
+
+    return tiles
+
+
+def score_grid(scorer, grid, points=None, processes=1):
+    """Returns the scores for the full grid, and the values of each item at each point, by tile"""
+
+    scores = numpy.ma.masked_all(grid.shape, "int8")
+    values = {}
+
+    for tile, tile_scores, tile_values in score_tiles(
+        scorer, get_tiles(grid, points), processes
+    ):
+        scores[tile.y_slice, tile.x_slice] = tile_scores
+        values[tile.y_slice.start, tile.x_slice.start] = {
+            name: v.tolist() for name, v in tile_values.items()
+        }
+
+    return scores, values
+
+
+def count_reads(monkeypatch, sources):
+    """Records the name and shape of each window read from `sources`"""
+
+    reads = []
+
+    for name, source in sources.items():
+
+        def read(window, name=name, read=source.read):
+            reads.append((name, window.shape))
+            return read(window)
+
+        monkeypatch.setattr(source, "read", read)
+
+    return reads
+
+
+@pytest.fixture
+def points(grid):
+    rng = numpy.random.default_rng(0)
+    return rng.integers(0, grid.shape[0], 50), rng.integers(0, grid.shape[1], 50)
+
+
+def test_tiles_cover_window(grid):
+    window = Window((37, 151), (61, 243))
+    covered = numpy.zeros(grid.shape, "int")
+
+    for tile in iter_tiles(window, 64):
+        covered[tile.y_slice, tile.x_slice] += 1
+
+        # Tiles are aligned to the grid, so a cell is in the same tile for any window
+        assert tile.y_slice.start in (37, 64, 128)
+        assert tile.x_slice.start in (61, 64, 128, 192)
+
+    assert (covered[window.y_slice, window.x_slice] == 1).all()
+    assert covered.sum() == window.shape[0] * window.shape[1]
+
+
+def test_tiled_sparse_and_pooled_scores_match_full_grid(
+    grid, climate, points, monkeypatch
+):
+    scorer = TileScorer(VARIABLES, FUNCTIONS, climate)
+    scores, values = score_grid(scorer, grid, points)
+    pooled_scores, pooled_values = score_grid(scorer, grid, points, processes=2)
+
+    expected = get_expected_scores(grid, climate, VARIABLES + FUNCTIONS)
+    assert 0 < expected.count() < expected.size
+
+    # Enough cells are ruled out by the first variables for some tiles to be scored sparsely
+    assert expected.count() < expected.size * scoring.SPARSE_SCORING_DENSITY
+
+    monkeypatch.setattr(scoring, "SPARSE_SCORING_AFTER", None)
+    dense_scores, dense_values = score_grid(scorer, grid, points)
+
+    for tiled_scores in (scores, pooled_scores, dense_scores):
+        assert (tiled_scores.mask == expected.mask).all()
+        assert (tiled_scores == expected).all()
+    assert pooled_values == values
+    assert dense_values == values
+
+    # Scores don't depend on how the grid is tiled
+    full_scores, _ = scorer.score(grid.window, numpy.zeros(grid.shape, "bool"))
+    assert (full_scores.mask == expected.mask).all()
+    assert (full_scores == expected).all()
+
+    # Values at sites are the unconstrained values of each item
+    a = climate["a"].read(grid.window)
+    b = climate["b"].read(grid.window)
+    expected_values = {}
+    for tile, _, (rows, cols) in get_tiles(grid, points):
+        rows = rows + tile.y_slice.start
+        cols = cols + tile.x_slice.start
+        expected_values[tile.y_slice.start, tile.x_slice.start] = (
+            {
+                "a": a[rows, cols].tolist(),
+                "b": b[rows, cols].tolist(),
+                "fn": (a - b / 2)[rows, cols].tolist(),
+            }
+            if len(rows)
+            else {}
+        )
+    assert values == expected_values
+
+
+def test_parsed_functions_match_full_grid(grid, climate):
+    # Functions outside the arithmetic subset are evaluated by the ncdjango parser for each tile
+    functions = [
+        {"name": "abs", "fn": "abs(a - 12) + b", "limit": {"min": 0, "max": 16}},
+        {"name": "floor", "fn": "floor(a / 2) * 2", "limit": {"min": 6, "max": 18}},
+    ]
+    scores, _ = score_grid(TileScorer(VARIABLES, functions, climate), grid)
+
+    expected = get_expected_scores(grid, climate, VARIABLES + functions)
+    assert len(get_tiles(grid)) > 1
+    assert 0 < expected.count() < expected.size
+    assert (scores.mask == expected.mask).all()
+    assert (scores == expected).all()
+
+
+@pytest.mark.parametrize(
+    "fn", ["a - mean(a)", "max(a) - b", "std(b) * 2", "a - median(b) + min(a)"]
+)
+def test_reductions_are_rejected(climate, fn):
+    # A reduction would be over each tile rather than the full grid, so it's rejected rather
+    # than giving scores which depend on the tile size
+    with pytest.raises(ValueError):
+        TileScorer(
+            VARIABLES,
+            [{"name": "fn", "fn": fn, "limit": FUNCTIONS[0]["limit"]}],
+            climate,
+        )
+
+
+def test_sparse_scoring_reads_bounding_windows(grid, climate, monkeypatch):
+    reads = count_reads(monkeypatch, climate)
+    variables = [{"name": "a", "limit": {"min": 8, "max": 14}}]
+    functions = [
+        {"name": "half", "fn": "a / 2", "limit": {"min": 4, "max": 7}},
+        {"name": "c", "fn": "b + 1", "limit": {"min": 1, "max": 15}},
+    ]
+
+    # `b` is only needed for the last item, which is scored sparsely, so it's read for the
+    # window around the remaining cells
+    scores, _ = TileScorer(variables, functions, climate).score(
+        grid.window, numpy.zeros(grid.shape, "bool")
+    )
+    _, b_shape = [read for read in reads if read[0] == "b"][0]
+
+    assert reads[0] == ("a", grid.shape)
+    assert len(reads) == 2
+    assert b_shape[0] < grid.shape[0] and b_shape[1] < grid.shape[1]
+
+    monkeypatch.setattr(scoring, "SPARSE_SCORING_AFTER", None)
+    dense_scores, _ = TileScorer(variables, functions, climate).score(
+        grid.window, numpy.zeros(grid.shape, "bool")
+    )
+
+    assert (scores.mask == dense_scores.mask).all()
+    assert (scores == dense_scores).all()
+
+
+def test_daemonic_processes_score_tiles_in_process(grid, climate, monkeypatch):
+    scorer = TileScorer(VARIABLES, FUNCTIONS, climate)
+    expected, _ = score_grid(scorer, grid)
+
+    # Daemonic processes (e.g., Celery prefork workers) can't start a process pool
+    def no_pool(*args, **kwargs):
+        raise AssertionError("A process pool was started")
+
+    monkeypatch.setattr(scoring, "ProcessPoolExecutor", no_pool)
+    monkeypatch.setattr(multiprocessing.current_process(), "daemon", True)
+    scores, _ = score_grid(scorer, grid, processes=2)
+
+    assert (scores.mask == expected.mask).all()
+    assert (scores == expected).all()
+
+
+def test_cached_distances_are_reused(grid, climate, points, tmp_path, monkeypatch):
+    # Distances of sparsely scored items depend on the cells ruled out before them, so they
+    # aren't cached
+    cache = ArrayCache(str(tmp_path / "sparse"), 2 * 1024**3)
+    score_grid(TileScorer(VARIABLES, FUNCTIONS, climate, cache), grid, points)
+    sparse_entries = len(os.listdir(cache.directory))
+
+    monkeypatch.setattr(scoring, "SPARSE_SCORING_AFTER", None)
+    cache = ArrayCache(str(tmp_path / "distances"), 2 * 1024**3)
+    scorer = TileScorer(VARIABLES, FUNCTIONS, climate, cache)
+    scores, values = score_grid(scorer, grid, points)
+    assert 0 < sparse_entries < len(os.listdir(cache.directory))
+
+    reads = count_reads(monkeypatch, climate)
+    cached_scores, cached_values = score_grid(scorer, grid, points)
+
+    assert (cached_scores.mask == scores.mask).all()
+    assert (cached_scores == scores).all()
+    assert cached_values == values
+
+    # Only the window around the sites in each tile is read
+    site_tiles = sum(1 for tile in get_tiles(grid, points) if len(tile[2][0]))
+    assert len(reads) == site_tiles * 2
+    assert all(shape[0] * shape[1] < 64 * 64 for _, shape in reads)
+
+    # Changing a limit recalculates only that item
+    variables = [VARIABLES[0], {"name": "b", "limit": {"min": 1, "max": 14}}]
+    reads.clear()
+    score_grid(TileScorer(variables, FUNCTIONS, climate, cache), grid)
+    assert {name for name, shape in reads} == {"b"}
+
+
+def test_tile_data_reads_cells_once(grid, climate, monkeypatch):
+    reads = count_reads(monkeypatch, climate)
+    tile = Window((64, 128), (128, 192))
+    tile_data = TileData(climate, tile)
+    rows, cols = numpy.array([3, 10, 40]), numpy.array([20, 5, 33])
+
+    values = tile_data.get_cells("a", rows, cols)
+    expected = climate["a"].read(tile)[rows, cols]
+    reads.pop()
+
+    assert (values == expected).all()
+    assert reads == [("a", (38, 29))]
+
+    # Cells within the window already read don't read it again
+    assert (tile_data.get_cells("a", rows[1:], cols[1:]) == expected[1:]).all()
+    assert len(reads) == 1
+
+
+def test_cells_are_read_by_block(grid, climate, monkeypatch):
+    reads = count_reads(monkeypatch, climate)
+    rng = numpy.random.default_rng(0)
+    rows = rng.integers(0, grid.shape[0], 1000)
+    cols = rng.integers(0, grid.shape[1], 1000)
+    expected = climate["a"].read(grid.window)
+    reads.clear()
+
+    values = read_cells(climate["a"].read, rows, cols, block_size=64)
+
+    assert (values.mask == expected.mask[rows, cols]).all()
+    assert (values == expected[rows, cols]).all()
+
+    # One read for each block with cells, however many cells there are
+    blocks = {(row // 64, col // 64) for row, col in zip(rows, cols)}
+    assert len(reads) == len(blocks)
+    assert all(shape[0] <= 64 and shape[1] <= 64 for _, shape in reads)
+
+
+def test_scored_cells_match_tiles(grid, climate, points):
+    scorer = TileScorer(VARIABLES, FUNCTIONS, climate)
+    mask = numpy.zeros(grid.shape, "bool")
+    mask[:, :40] = True
+    scores, values = scorer.score(grid.window, mask, points)
+
+    rows, cols = points
+    cell_scores, cell_values = scorer.score_cells(rows, cols, mask[rows, cols])
+    assert 0 < cell_scores.count() < len(rows)
+
+    assert (cell_scores.mask == scores.mask[rows, cols]).all()
+    assert (cell_scores == scores[rows, cols]).all()
+    for name, item_values in values.items():
+        assert (cell_values[name].mask == item_values.mask).all()
+        assert (cell_values[name] == item_values).all()
+
+
+def test_site_values_reuse_tile_data(grid, climate, monkeypatch):
+    reads = count_reads(monkeypatch, climate)
+    tile = Window((64, 128), (128, 192))
+    tile_data = TileData(climate, tile)
+    point_data = TileData(climate, tile)
+    rows, cols = numpy.array([3, 10, 40]), numpy.array([20, 5, 33])
+    tile_data.get("a")
+    tile_data.get_cells("b", numpy.array([0, 50]), numpy.array([0, 50]))
+    reads.clear()
+
+    # Values held for the full tile, or for a window around the sites, aren't read again
+    cell_data = CellData(tile_data, rows, cols, fallback=point_data)
+    assert (cell_data.get("a") == climate["a"].read(tile)[rows, cols]).all()
+    assert (cell_data.get("b") == climate["b"].read(tile)[rows, cols]).all()
+    assert len(reads) == 2
+
+    # Values which aren't held are read from the fallback, leaving the tile's data as it was
+    reads.clear()
+    cell_data = CellData(tile_data, rows + 20, cols, fallback=point_data)
+    assert (cell_data.get("b") == climate["b"].read(tile)[rows + 20, cols]).all()
+    assert reads[0] == ("b", (38, 29))
+    assert "b" in point_data.cell_data
+    assert tile_data.cell_data["b"][0] == (0, 51, 0, 51)
+
+
+def test_block_index_skips_tiles_outside_limits(grid, climate):
+    source = climate["a"]
+    BlockIndex.build(source, block_size=32).save(source.path)
+    index = BlockIndex.load(source.path)
+    data = source.read(grid.window)
+
+    scorer = TileScorer(VARIABLES, [], climate)
+    for tile in iter_tiles(grid.window, 32):
+        tile_data = data[tile.y_slice, tile.x_slice]
+        min_value, max_value = index.get_range(tile)
+
+        assert min_value <= tile_data.min() and max_value >= tile_data.max()
+
+        if not scorer.can_score(tile):
+            assert not ((tile_data >= 8) & (tile_data <= 16)).any()
+
+    # Tiles far outside the limits of `a` are skipped
+    assert not scorer.can_score(Window((160, 192), (256, 288)))
+    assert scorer.can_score(Window((96, 128), (64, 96)))
+
+    # The index is ignored once the dataset is modified
+    mtime = os.path.getmtime(source.path)
+    os.utime(source.path, (mtime + 60, mtime + 60))
+    assert BlockIndex.load(source.path) is None
+
+
+def test_latitudes_match_per_cell_array(grid, climate):
+    source = LatitudeSource(climate["a"].path, "lon", "lat")
+
+    # The array of latitudes for every cell, as it was created before latitudes were broadcast
+    with Dataset(climate["a"].path) as dataset:
+        coords = SpatialCoordinateVariables.from_dataset(
+            dataset, x_name="lon", y_name="lat"
+        )
+        lat = coords.y.values
+        per_cell = numpy.tile(lat.reshape(len(lat), 1), (1, len(coords.x.values)))
+
+    assert per_cell.shape == grid.shape
+
+    for window in (grid.window, Window((37, 151), (61, 243)), Window((5, 6), (7, 8))):
+        latitudes = source.read(window)
+        expected = per_cell[window.y_slice, window.x_slice]
+
+        assert latitudes.shape == expected.shape
+        assert (latitudes == expected).all()
+
+    # Latitudes are a view of one value per row, which can't be modified by scoring
+    assert not latitudes.flags.writeable
+    assert latitudes.strides[1] == 0
+
+
+def test_array_cache_evicts_least_recently_used(tmp_path):
+    arrays = {key: numpy.full(1000, i, "float64") for i, key in enumerate("abc")}
+    cache = ArrayCache(str(tmp_path), 2 * 1024**3)
+    cache.set("a", arrays["a"])
+    cache.max_bytes = os.path.getsize(cache.get_path("a")) * 2
+
+    cache.set("b", arrays["b"])
+    for i, key in enumerate("ab"):
+        mtime = 1000000 + i * 10
+        os.utime(cache.get_path(key), (mtime, mtime))
+
+    # Reading `a` makes `b` the least recently used, which is removed as soon as `c` is stored
+    assert (cache.get("a") == arrays["a"]).all()
+    cache.set("c", arrays["c"])
+
+    assert cache.get("b") is None
+    assert (cache.get("a") == arrays["a"]).all()
+    assert (cache.get("c") == arrays["c"]).all()
+
+
+def test_variables_are_read_once_per_tile(grid, climate, monkeypatch):
+    reads = count_reads(monkeypatch, climate)
+    functions = FUNCTIONS + [
+        {"name": "fn2", "fn": "b * 2", "limit": {"min": 0, "max": 30}}
+    ]
+
+    tiles = get_tiles(grid)
+    score_grid(TileScorer(VARIABLES, functions, climate), grid)
+
+    assert sorted(reads) == sorted(
+        (name, tile.shape) for tile, _, _ in tiles for name in ("a", "b")
+    )
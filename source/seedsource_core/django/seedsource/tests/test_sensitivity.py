@@ -0,0 +1,80 @@
+import numpy
+import pytest
+
+from seedsource_core.django.seedsource.tasks.constraints import ConstraintMask
+from seedsource_core.django.seedsource.tasks.generate_scores import GenerateScores
+from seedsource_core.django.seedsource.tasks.sensitivity import (
+    TransferLimitSensitivity,
+)
+
+VARIABLES = [
+    {"name": "a", "limit": {"min": 10, "max": 16}},
+    {"name": "b", "limit": {"min": 2, "max": 12}},
+]
+FUNCTIONS = [{"name": "fn", "fn": "a + b", "limit": {"min": 14, "max": 26}}]
+CONSTRAINTS = [
+    {"name": "latitude", "args": {"min": 41, "max": 46}},
+    {"name": "distance", "args": {"lat": 43.5, "lon": -115, "distance": 300}},
+]
+MULTIPLIERS = [0.5, 1, 2]
+
+
+def test_sensitivity_areas(make_task, grid, climate):
+    result = make_task(TransferLimitSensitivity).execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        functions=FUNCTIONS,
+        constraints=CONSTRAINTS,
+        multipliers=[2, 1, 0.5, 1],
+    )["sensitivity"]
+
+    a = climate["a"].read(grid.window)
+    b = climate["b"].read(grid.window)
+    distances = numpy.zeros(grid.shape, "float64")
+    for item, values in zip(VARIABLES + FUNCTIONS, (a, b, a + b)):
+        half = (item["limit"]["max"] - item["limit"]["min"]) / 2
+        distances += ((values - item["limit"]["min"] - half) / half) ** 2
+    distances = numpy.ma.masked_where(
+        ConstraintMask(CONSTRAINTS, "test").build(grid).get_mask(grid.window),
+        distances,
+    )
+    areas = numpy.broadcast_to(grid.get_cell_areas()[:, None], grid.shape)
+
+    # Multipliers are sorted and duplicates removed
+    assert result["multipliers"] == MULTIPLIERS
+    assert result["areas"] == sorted(result["areas"])
+
+    for multiplier, area in zip(MULTIPLIERS, result["areas"]):
+        suitable = numpy.ma.filled(distances <= multiplier**2, False)
+        assert area > 0
+        assert area == pytest.approx(areas[suitable].sum() / 10000, rel=1e-3)
+
+
+def test_sensitivity_matches_scored_area(make_task):
+    area = make_task(TransferLimitSensitivity).execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        functions=FUNCTIONS,
+        constraints=CONSTRAINTS,
+        multipliers=[1],
+    )["sensitivity"]["areas"][0]
+    summary = make_task(GenerateScores).execute(
+        "test",
+        "1961_1990",
+        variables=VARIABLES,
+        functions=FUNCTIONS,
+        constraints=CONSTRAINTS,
+    )["area_summary"]
+
+    # Scores include a few more cells at the edge of the limits
+    assert area <= summary["total"]
+    assert area == pytest.approx(summary["total"], rel=0.01)
+
+
+def test_multipliers_must_be_positive(make_task):
+    with pytest.raises(ValueError):
+        make_task(TransferLimitSensitivity).execute(
+            "test", "1961_1990", variables=VARIABLES, multipliers=[0, 1]
+        )
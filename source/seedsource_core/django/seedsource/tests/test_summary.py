@@ -0,0 +1,94 @@
+import numpy
+from shapely.geometry import box
+from trefoil.utilities.window import Window
+
+from seedsource_core.django.seedsource.tasks.scoring import iter_tiles
+from seedsource_core.django.seedsource.tasks.summary import AreaSummary
+
+ZONES = [
+    {
+        "zone_uid": "a1",
+        "name": "West",
+        "source": "a",
+        "geometry": box(-120, 40, -116, 47),
+    },
+    {
+        "zone_uid": "a2",
+        "name": "East",
+        "source": "a",
+        "geometry": box(-116, 40, -110, 47),
+    },
+    {
+        "zone_uid": "b1",
+        "name": "North",
+        "source": "b",
+        "geometry": box(-118, 45, -112, 47),
+    },
+    {
+        "zone_uid": "c1",
+        "name": "Outside",
+        "source": "c",
+        "geometry": box(-100, 40, -95, 47),
+    },
+]
+
+
+def get_scores(grid):
+    rows, cols = numpy.indices(grid.shape)
+    scores = (rows // 2 + cols // 3) % 101
+    return numpy.ma.masked_where((rows + cols) % 7 == 0, scores.astype("int8"))
+
+
+def test_summary_by_tile_matches_full_grid(grid):
+    scores = get_scores(grid)
+
+    full = AreaSummary(grid, ZONES)
+    full.add(grid.window, scores)
+
+    tiled = AreaSummary(grid, ZONES)
+    for tile in iter_tiles(grid.window, 32):
+        tiled.add(tile, scores[tile.y_slice, tile.x_slice])
+
+    # Including windows a single row or column wide
+    narrow = AreaSummary(grid, ZONES)
+    for row in range(grid.shape[0]):
+        narrow.add(Window((row, row + 1), (0, 1)), scores[row : row + 1, :1])
+        narrow.add(Window((row, row + 1), (1, 300)), scores[row : row + 1, 1:])
+
+    assert numpy.allclose(tiled.areas, full.areas)
+    assert numpy.allclose(narrow.areas, full.areas)
+    assert numpy.allclose(narrow.zone_areas, full.zone_areas)
+    assert numpy.allclose(tiled.zone_areas, full.zone_areas)
+    assert tiled.to_dict() == full.to_dict()
+
+
+def test_summary_areas(grid):
+    scores = get_scores(grid)
+    summary = AreaSummary(grid, ZONES)
+    summary.add(grid.window, scores)
+    result = summary.to_dict()
+
+    areas = numpy.broadcast_to(grid.get_cell_areas()[:, None], grid.shape)
+    total = areas[~scores.mask].sum() / 10000
+
+    # The region is about 800 km wide and 780 km tall
+    assert 6e7 < areas.sum() / 10000 < 7e7
+    assert round(total, 2) == result["total"]
+    assert round(sum(c["area"] for c in result["classes"]), 0) == round(total, 0)
+
+    high = ~scores.mask & (scores >= 75)
+    assert result["classes"][-1] == {
+        "min": 75,
+        "max": 100,
+        "area": round(float(areas[high].sum() / 10000), 2),
+    }
+
+    # Zones from one source split the total, and zones without scored cells are left out
+    zones = {zone["zone_uid"]: zone for zone in result["zones"]}
+    assert set(zones) == {"a1", "a2", "b1"}
+    assert round(zones["a1"]["total"] + zones["a2"]["total"], 0) == round(total, 0)
+
+    west = grid.coords.x.values < -116
+    assert numpy.isclose(
+        zones["a1"]["total"], areas[~scores.mask & west[None, :]].sum() / 10000
+    )
@@ -0,0 +1,36 @@
+import numpy
+from trefoil.geometry.bbox import BBox
+
+from seedsource_core.django.seedsource.tasks.utils import Grid
+
+
+def test_indices_of_cell_centers(grid):
+    flipped = Grid(grid.extent, grid.shape, False)
+
+    for g in (grid, flipped):
+        coords = g.coords
+        rows, cols = numpy.indices(g.shape)
+        x = coords.x.values[cols]
+        y = coords.y.values[rows]
+
+        result_rows, result_cols, inside = g.get_indices(x.ravel(), y.ravel())
+
+        assert inside.all()
+        assert (result_rows == rows.ravel()).all()
+        assert (result_cols == cols.ravel()).all()
+
+
+def test_indices_outside_grid(grid):
+    grid = Grid(BBox((0, 0, 10, 5), projection=grid.extent.projection), (5, 10), False)
+
+    rows, cols, inside = grid.get_indices(
+        [0.5, 9.5, -1, 11, 3.5, 10], [4.5, 0.5, 2.5, 2.5, 6, 0]
+    )
+
+    assert inside.tolist() == [True, True, False, False, False, True]
+    assert rows[inside].tolist() == [0, 4, 4]
+    assert cols[inside].tolist() == [0, 9, 9]
+
+    # Coordinates outside the grid are clipped to the edge
+    assert (rows >= 0).all() and (rows < 5).all()
+    assert (cols >= 0).all() and (cols < 10).all()
@@ -132,6 +132,7 @@ class ReportViewBase(GenericAPIView):
                 data["tile_layers"],
                 data["opacity"],
                 request,
+                service_id=data.get("service_id"),
             )
         )
 
@@ -195,6 +195,11 @@ CELERYBEAT_SCHEDULE = {
         "options": {"expires": 7200},  # 2 hrs
         "kwargs": {"age": 7200},
     },
+    "cleanup_score_results": {
+        "task": "seedsource_core.django.seedsource.tasks.result_cache.cleanup_score_results",
+        "schedule": timedelta(hours=1),
+        "options": {"expires": 7200},  # 2 hrs
+    },
 }
 
 WEBPACK_LOADER = {
@@ -211,18 +216,55 @@ WEBPACK_LOADER = {
 if not DEBUG:
     WEBPACK_LOADER["DEFAULT"]["BUNDLE_DIR_NAME"] = "/"
 
+SCORES_RENDERER = StretchedRenderer(
+    [
+        (100, Color(240, 59, 32)),
+        (50, Color(254, 178, 76)),
+        (0, Color(255, 237, 160)),
+    ]
+)
+
+
+def get_ensemble_renderer(raster):
+    """
+    Renders outputs of the ensemble job. Model counts are stretched from 0 to the number of models, rather than 0 to
+    100 like mean and minimum scores.
+    """
+
+    model_count = getattr(raster, "model_count", None)
+    if model_count is None:
+        return SCORES_RENDERER
+
+    return StretchedRenderer(
+        [
+            (value * model_count / 100, color)
+            for value, color in SCORES_RENDERER.colormap
+        ]
+    )
+
+
 NC_REGISTERED_JOBS = {
     "generate_scores": {
         "type": "task",
         "task": "seedsource_core.django.seedsource.tasks.generate_scores.GenerateScores",
         "publish_raster_results": True,
-        "results_renderer": StretchedRenderer(
-            [
-                (100, Color(240, 59, 32)),
-                (50, Color(254, 178, 76)),
-                (0, Color(255, 237, 160)),
-            ]
-        ),
+        "results_renderer": SCORES_RENDERER,
+    },
+    "generate_scores_batch": {
+        "type": "task",
+        "task": "seedsource_core.django.seedsource.tasks.generate_scores.GenerateScoresBatch",
+        "publish_raster_results": True,
+        "results_renderer": SCORES_RENDERER,
+    },
+    "generate_ensemble_scores": {
+        "type": "task",
+        "task": "seedsource_core.django.seedsource.tasks.generate_scores.GenerateEnsembleScores",
+        "publish_raster_results": True,
+        "results_renderer": get_ensemble_renderer,
+    },
+    "transfer_limit_sensitivity": {
+        "type": "task",
+        "task": "seedsource_core.django.seedsource.tasks.sensitivity.TransferLimitSensitivity",
     },
     "write_tif": {
         "type": "task",